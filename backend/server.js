@@ -5,18 +5,20 @@ const path = require('path');
 const fs = require('fs');
 const cors = require('cors');
 const FormData = require('form-data');
+const { pipeline } = require('stream/promises');
 
 const app = express();
 const upload = multer({ dest: 'uploads/' });
 
 // Enable CORS
 app.use(cors());
+app.use(express.json());
 
 // Serve static visualization files (adjust path if needed)
 app.use('/static/visualizations', express.static(path.join(__dirname, 'static/visualizations')));
 
 // Helper function to send file to Flask backend
-const sendFileToFlask = async (filePath, originalname, mimetype, endpoint) => {
+const sendFileToFlask = async (filePath, originalname, mimetype, endpoint, query = {}) => {
     const formData = new FormData();
     formData.append('file', fs.createReadStream(filePath), {
         filename: originalname,
@@ -28,6 +30,7 @@ const sendFileToFlask = async (filePath, originalname, mimetype, endpoint) => {
             headers: {
                 ...formData.getHeaders(),
             },
+            params: query,
             timeout: 300000, // Increased timeout for heavy computations
         });
         return response.data;
@@ -37,9 +40,78 @@ const sendFileToFlask = async (filePath, originalname, mimetype, endpoint) => {
     }
 };
 
+// Read the dataset ID returned by /upload_csv from the JSON body or query string
+const getDatasetId = (req) => req.body?.dataset_id || req.query.dataset_id;
+
+// Helper function to run an analysis on a dataset already stored by the Flask backend
+const sendDatasetToFlask = async (datasetId, endpoint, query = {}) => {
+    try {
+        const response = await axios.post(`http://localhost:5000/${endpoint}`, { dataset_id: datasetId }, {
+            params: query,
+            timeout: 300000, // Increased timeout for heavy computations
+        });
+        return response.data;
+    } catch (error) {
+        console.error(`Error in ${endpoint}:`, error.response?.data?.error || error.message);
+        throw new Error(error.response?.data?.error || `Error processing ${endpoint}`);
+    }
+};
+
+// Forward either the uploaded file or the dataset ID to the Flask backend
+const forwardToFlask = (req, endpoint) => {
+    if (req.file) {
+        return sendFileToFlask(req.file.path, req.file.originalname, req.file.mimetype, endpoint, req.query);
+    }
+    return sendDatasetToFlask(getDatasetId(req), endpoint, req.query);
+};
+
+// Read the error message from the body of a failed streamed request
+const readStreamError = async (stream) => {
+    let body = '';
+    for await (const chunk of stream) {
+        body += chunk;
+    }
+    try {
+        return JSON.parse(body).error;
+    } catch (parseError) {
+        return body;
+    }
+};
+
+// Pipe a streamed Flask response (NDJSON, chunked JSON or Arrow) to the client as it
+// arrives, instead of buffering the whole body
+const pipeFromFlask = async (req, res, endpoint) => {
+    const url = `http://localhost:5000/${endpoint}`;
+    const options = { params: req.query, responseType: 'stream', timeout: 300000 };
+    let response;
+    try {
+        if (req.file) {
+            const formData = new FormData();
+            formData.append('file', fs.createReadStream(req.file.path), {
+                filename: req.file.originalname,
+                contentType: req.file.mimetype,
+            });
+            response = await axios.post(url, formData, { ...options, headers: formData.getHeaders() });
+        } else {
+            response = await axios.post(url, { dataset_id: getDatasetId(req) }, options);
+        }
+    } catch (error) {
+        const message = error.response ? await readStreamError(error.response.data) : error.message;
+        console.error(`Error in ${endpoint}:`, message);
+        throw new Error(message || `Error processing ${endpoint}`);
+    }
+    res.status(response.status);
+    res.setHeader('Content-Type', response.headers['content-type']);
+    await pipeline(response.data, res);
+};
+
 // Error handling middleware
 const errorHandler = (error, req, res, next) => {
     console.error(error.stack);
+    if (res.headersSent) {
+        // A stream failed part-way; let Express close the connection
+        return next(error);
+    }
     res.status(500).json({ error: error.message || 'Internal Server Error' });
 };
 
@@ -50,8 +122,14 @@ app.post('/upload_csv', upload.single('file'), async (req, res, next) => {
     }
 
     try {
-        const result = await sendFileToFlask(req.file.path, req.file.originalname, req.file.mimetype, 'upload_csv');
-        res.json({ message: result.message || 'File uploaded and cleaned successfully' });
+        // ?chunked=true asks Flask to ingest the file chunk by chunk
+        const result = await sendFileToFlask(req.file.path, req.file.originalname, req.file.mimetype, 'upload_csv', req.query);
+        res.json({
+            message: result.message || 'File uploaded and cleaned successfully',
+            dataset_id: result.dataset_id,
+            // Rows read, dropped and kept, reported for chunked ingests
+            ...(result.ingest_stats && { ingest_stats: result.ingest_stats })
+        });
     } catch (error) {
         next(error);
     } finally {
@@ -65,340 +143,391 @@ app.post('/upload_csv', upload.single('file'), async (req, res, next) => {
 
 // RFM analysis
 app.post('/rfm_analysis', upload.single('file'), async (req, res, next) => {
-    if (!req.file) {
-        return res.status(400).json({ error: 'No file uploaded' });
+    if (!req.file && !getDatasetId(req)) {
+        return res.status(400).json({ error: 'No file uploaded or dataset_id provided' });
     }
 
     try {
-        const result = await sendFileToFlask(req.file.path, req.file.originalname, req.file.mimetype, 'rfm_analysis');
-        res.json({ segment_data: result.segment_data });
+        if (req.query.stream) {
+            return await pipeFromFlask(req, res, 'rfm_analysis');
+        }
+        const result = await forwardToFlask(req, 'rfm_analysis');
+        res.json({ segment_data: result.segment_data, customers: result.customers, page: result.page });
     } catch (error) {
         next(error);
     } finally {
-        try {
-            fs.unlinkSync(req.file.path);
-        } catch (unlinkError) {
-            console.error('Error deleting file:', unlinkError);
+        if (req.file) {
+            try {
+                fs.unlinkSync(req.file.path);
+            } catch (unlinkError) {
+                console.error('Error deleting file:', unlinkError);
+            }
         }
     }
 });
 
 // Train model
 app.post('/train_model', upload.single('file'), async (req, res, next) => {
-    if (!req.file) {
-        return res.status(400).json({ error: 'No file uploaded' });
+    if (!req.file && !getDatasetId(req)) {
+        return res.status(400).json({ error: 'No file uploaded or dataset_id provided' });
     }
 
     try {
-        const result = await sendFileToFlask(req.file.path, req.file.originalname, req.file.mimetype, 'train_model');
+        const result = await forwardToFlask(req, 'train_model');
         res.json({
             confusion_matrix: result.confusion_matrix,
             classification_report: result.classification_report,
-            model_trained: result.model_trained
+            model_trained: result.model_trained,
+            model_version: result.model_version,
+            models: result.models,
+            wall_time_s: result.wall_time_s
         });
     } catch (error) {
         next(error);
     } finally {
-        try {
-            fs.unlinkSync(req.file.path);
-        } catch (unlinkError) {
-            console.error('Error deleting file:', unlinkError);
+        if (req.file) {
+            try {
+                fs.unlinkSync(req.file.path);
+            } catch (unlinkError) {
+                console.error('Error deleting file:', unlinkError);
+            }
         }
     }
 });
 
 // Churn prediction
 app.post('/churn_prediction', upload.single('file'), async (req, res, next) => {
-    if (!req.file) {
-        return res.status(400).json({ error: 'No file uploaded' });
+    if (!req.file && !getDatasetId(req)) {
+        return res.status(400).json({ error: 'No file uploaded or dataset_id provided' });
     }
 
     try {
-        const result = await sendFileToFlask(req.file.path, req.file.originalname, req.file.mimetype, 'churn_prediction');
+        if (req.query.stream) {
+            return await pipeFromFlask(req, res, 'churn_prediction');
+        }
+        const result = await forwardToFlask(req, 'churn_prediction');
         res.json({
             confusion_matrix: result.confusion_matrix,
             classification_report: result.classification_report,
-            churn_predictions: result.churn_predictions
+            churn_predictions: result.churn_predictions,
+            page: result.page
         });
     } catch (error) {
         next(error);
     } finally {
-        try {
-            fs.unlinkSync(req.file.path);
-        } catch (unlinkError) {
-            console.error('Error deleting file:', unlinkError);
+        if (req.file) {
+            try {
+                fs.unlinkSync(req.file.path);
+            } catch (unlinkError) {
+                console.error('Error deleting file:', unlinkError);
+            }
         }
     }
 });
 
 // Repurchase prediction
 app.post('/repurchase_prediction', upload.single('file'), async (req, res, next) => {
-    if (!req.file) {
-        return res.status(400).json({ error: 'No file uploaded' });
+    if (!req.file && !getDatasetId(req)) {
+        return res.status(400).json({ error: 'No file uploaded or dataset_id provided' });
     }
 
     try {
-        const result = await sendFileToFlask(req.file.path, req.file.originalname, req.file.mimetype, 'repurchase_prediction');
-        res.json({ repurchase_predictions: result.repurchase_predictions });
+        if (req.query.stream) {
+            return await pipeFromFlask(req, res, 'repurchase_prediction');
+        }
+        const result = await forwardToFlask(req, 'repurchase_prediction');
+        res.json({ repurchase_predictions: result.repurchase_predictions, page: result.page });
     } catch (error) {
         next(error);
     } finally {
-        try {
-            fs.unlinkSync(req.file.path);
-        } catch (unlinkError) {
-            console.error('Error deleting file:', unlinkError);
+        if (req.file) {
+            try {
+                fs.unlinkSync(req.file.path);
+            } catch (unlinkError) {
+                console.error('Error deleting file:', unlinkError);
+            }
         }
     }
 });
 
 // Customer Lifetime Value
 app.post('/customer_lifetime_value', upload.single('file'), async (req, res, next) => {
-    if (!req.file) {
-        return res.status(400).json({ error: 'No file uploaded' });
+    if (!req.file && !getDatasetId(req)) {
+        return res.status(400).json({ error: 'No file uploaded or dataset_id provided' });
     }
 
     try {
-        const result = await sendFileToFlask(req.file.path, req.file.originalname, req.file.mimetype, 'customer_lifetime_value');
-        res.json({ clv: result.clv });
+        if (req.query.stream) {
+            return await pipeFromFlask(req, res, 'customer_lifetime_value');
+        }
+        const result = await forwardToFlask(req, 'customer_lifetime_value');
+        res.json({ clv: result.clv, page: result.page });
     } catch (error) {
         next(error);
     } finally {
-        try {
-            fs.unlinkSync(req.file.path);
-        } catch (unlinkError) {
-            console.error('Error deleting file:', unlinkError);
+        if (req.file) {
+            try {
+                fs.unlinkSync(req.file.path);
+            } catch (unlinkError) {
+                console.error('Error deleting file:', unlinkError);
+            }
         }
     }
 });
 
 // Product Affinity Analysis
 app.post('/product_affinity', upload.single('file'), async (req, res, next) => {
-    if (!req.file) {
-        return res.status(400).json({ error: 'No file uploaded' });
+    if (!req.file && !getDatasetId(req)) {
+        return res.status(400).json({ error: 'No file uploaded or dataset_id provided' });
     }
 
     try {
-        const result = await sendFileToFlask(req.file.path, req.file.originalname, req.file.mimetype, 'product_affinity');
+        const result = await forwardToFlask(req, 'product_affinity');
         res.json({ affinity_rules: result.affinity_rules });
     } catch (error) {
         next(error);
     } finally {
-        try {
-            fs.unlinkSync(req.file.path);
-        } catch (unlinkError) {
-            console.error('Error deleting file:', unlinkError);
+        if (req.file) {
+            try {
+                fs.unlinkSync(req.file.path);
+            } catch (unlinkError) {
+                console.error('Error deleting file:', unlinkError);
+            }
         }
     }
 });
 
 // Sentiment Analysis
 app.post('/sentiment_analysis', upload.single('file'), async (req, res, next) => {
-    if (!req.file) {
-        return res.status(400).json({ error: 'No file uploaded' });
+    if (!req.file && !getDatasetId(req)) {
+        return res.status(400).json({ error: 'No file uploaded or dataset_id provided' });
     }
 
     try {
-        const result = await sendFileToFlask(req.file.path, req.file.originalname, req.file.mimetype, 'sentiment_analysis');
-        res.json({ sentiment_summary: result.sentiment_summary });
+        if (req.query.stream) {
+            return await pipeFromFlask(req, res, 'sentiment_analysis');
+        }
+        const result = await forwardToFlask(req, 'sentiment_analysis');
+        res.json({ sentiment_summary: result.sentiment_summary, page: result.page });
     } catch (error) {
         next(error);
     } finally {
-        try {
-            fs.unlinkSync(req.file.path);
-        } catch (unlinkError) {
-            console.error('Error deleting file:', unlinkError);
+        if (req.file) {
+            try {
+                fs.unlinkSync(req.file.path);
+            } catch (unlinkError) {
+                console.error('Error deleting file:', unlinkError);
+            }
         }
     }
 });
 
 // Inventory Turnover
 app.post('/inventory_turnover', upload.single('file'), async (req, res, next) => {
-    if (!req.file) {
-        return res.status(400).json({ error: 'No file uploaded' });
+    if (!req.file && !getDatasetId(req)) {
+        return res.status(400).json({ error: 'No file uploaded or dataset_id provided' });
     }
 
     try {
-        const result = await sendFileToFlask(req.file.path, req.file.originalname, req.file.mimetype, 'inventory_turnover');
+        const result = await forwardToFlask(req, 'inventory_turnover');
         res.json({ inventory_turnover: result.inventory_turnover });
     } catch (error) {
         next(error);
     } finally {
-        try {
-            fs.unlinkSync(req.file.path);
-        } catch (unlinkError) {
-            console.error('Error deleting file:', unlinkError);
+        if (req.file) {
+            try {
+                fs.unlinkSync(req.file.path);
+            } catch (unlinkError) {
+                console.error('Error deleting file:', unlinkError);
+            }
         }
     }
 });
 
 // Discount Impact Analysis
 app.post('/discount_impact', upload.single('file'), async (req, res, next) => {
-    if (!req.file) {
-        return res.status(400).json({ error: 'No file uploaded' });
+    if (!req.file && !getDatasetId(req)) {
+        return res.status(400).json({ error: 'No file uploaded or dataset_id provided' });
     }
 
     try {
-        const result = await sendFileToFlask(req.file.path, req.file.originalname, req.file.mimetype, 'discount_impact');
+        const result = await forwardToFlask(req, 'discount_impact');
         res.json({ discount_impact: result.discount_impact });
     } catch (error) {
         next(error);
     } finally {
-        try {
-            fs.unlinkSync(req.file.path);
-        } catch (unlinkError) {
-            console.error('Error deleting file:', unlinkError);
+        if (req.file) {
+            try {
+                fs.unlinkSync(req.file.path);
+            } catch (unlinkError) {
+                console.error('Error deleting file:', unlinkError);
+            }
         }
     }
 });
 
 // Monthly revenue
 app.post('/monthly_revenue', upload.single('file'), async (req, res, next) => {
-    if (!req.file) {
-        return res.status(400).json({ error: 'No file uploaded' });
+    if (!req.file && !getDatasetId(req)) {
+        return res.status(400).json({ error: 'No file uploaded or dataset_id provided' });
     }
 
     try {
-        const result = await sendFileToFlask(req.file.path, req.file.originalname, req.file.mimetype, 'monthly_revenue');
+        const result = await forwardToFlask(req, 'monthly_revenue');
         res.json({ monthly_revenue: result.monthly_revenue });
     } catch (error) {
         next(error);
     } finally {
-        try {
-            fs.unlinkSync(req.file.path);
-        } catch (unlinkError) {
-            console.error('Error deleting file:', unlinkError);
+        if (req.file) {
+            try {
+                fs.unlinkSync(req.file.path);
+            } catch (unlinkError) {
+                console.error('Error deleting file:', unlinkError);
+            }
         }
     }
 });
 
 // Daily revenue
 app.post('/daily_revenue', upload.single('file'), async (req, res, next) => {
-    if (!req.file) {
-        return res.status(400).json({ error: 'No file uploaded' });
+    if (!req.file && !getDatasetId(req)) {
+        return res.status(400).json({ error: 'No file uploaded or dataset_id provided' });
     }
 
     try {
-        const result = await sendFileToFlask(req.file.path, req.file.originalname, req.file.mimetype, 'daily_revenue');
+        const result = await forwardToFlask(req, 'daily_revenue');
         res.json({ daily_revenue: result.daily_revenue });
     } catch (error) {
         next(error);
     } finally {
-        try {
-            fs.unlinkSync(req.file.path);
-        } catch (unlinkError) {
-            console.error('Error deleting file:', unlinkError);
+        if (req.file) {
+            try {
+                fs.unlinkSync(req.file.path);
+            } catch (unlinkError) {
+                console.error('Error deleting file:', unlinkError);
+            }
         }
     }
 });
 
 // Top customers
 app.post('/top_customers', upload.single('file'), async (req, res, next) => {
-    if (!req.file) {
-        return res.status(400).json({ error: 'No file uploaded' });
+    if (!req.file && !getDatasetId(req)) {
+        return res.status(400).json({ error: 'No file uploaded or dataset_id provided' });
     }
 
     try {
-        const result = await sendFileToFlask(req.file.path, req.file.originalname, req.file.mimetype, 'top_customers');
+        const result = await forwardToFlask(req, 'top_customers');
         res.json({ top_customers: result.top_customers });
     } catch (error) {
         next(error);
     } finally {
-        try {
-            fs.unlinkSync(req.file.path);
-        } catch (unlinkError) {
-            console.error('Error deleting file:', unlinkError);
+        if (req.file) {
+            try {
+                fs.unlinkSync(req.file.path);
+            } catch (unlinkError) {
+                console.error('Error deleting file:', unlinkError);
+            }
         }
     }
 });
 
 // Top products
 app.post('/top_products', upload.single('file'), async (req, res, next) => {
-    if (!req.file) {
-        return res.status(400).json({ error: 'No file uploaded' });
+    if (!req.file && !getDatasetId(req)) {
+        return res.status(400).json({ error: 'No file uploaded or dataset_id provided' });
     }
 
     try {
-        const result = await sendFileToFlask(req.file.path, req.file.originalname, req.file.mimetype, 'top_products');
+        const result = await forwardToFlask(req, 'top_products');
         res.json({ top_products: result.top_products });
     } catch (error) {
         next(error);
     } finally {
-        try {
-            fs.unlinkSync(req.file.path);
-        } catch (unlinkError) {
-            console.error('Error deleting file:', unlinkError);
+        if (req.file) {
+            try {
+                fs.unlinkSync(req.file.path);
+            } catch (unlinkError) {
+                console.error('Error deleting file:', unlinkError);
+            }
         }
     }
 });
 
 // Monthly customer acquisition
 app.post('/monthly_customer_acquisition', upload.single('file'), async (req, res, next) => {
-    if (!req.file) {
-        return res.status(400).json({ error: 'No file uploaded' });
+    if (!req.file && !getDatasetId(req)) {
+        return res.status(400).json({ error: 'No file uploaded or dataset_id provided' });
     }
 
     try {
-        const result = await sendFileToFlask(req.file.path, req.file.originalname, req.file.mimetype, 'monthly_customer_acquisition');
+        const result = await forwardToFlask(req, 'monthly_customer_acquisition');
         res.json({ monthly_acquisition: result.monthly_acquisition });
     } catch (error) {
         next(error);
     } finally {
-        try {
-            fs.unlinkSync(req.file.path);
-        } catch (unlinkError) {
-            console.error('Error deleting file:', unlinkError);
+        if (req.file) {
+            try {
+                fs.unlinkSync(req.file.path);
+            } catch (unlinkError) {
+                console.error('Error deleting file:', unlinkError);
+            }
         }
     }
 });
 
 // Geographical analysis
 app.post('/geographical_analysis', upload.single('file'), async (req, res, next) => {
-    if (!req.file) {
-        return res.status(400).json({ error: 'No file uploaded' });
+    if (!req.file && !getDatasetId(req)) {
+        return res.status(400).json({ error: 'No file uploaded or dataset_id provided' });
     }
 
     try {
-        const result = await sendFileToFlask(req.file.path, req.file.originalname, req.file.mimetype, 'geographical_analysis');
+        const result = await forwardToFlask(req, 'geographical_analysis');
         res.json({ geographical_revenue: result.geographical_revenue });
     } catch (error) {
         next(error);
     } finally {
-        try {
-            fs.unlinkSync(req.file.path);
-        } catch (unlinkError) {
-            console.error('Error deleting file:', unlinkError);
+        if (req.file) {
+            try {
+                fs.unlinkSync(req.file.path);
+            } catch (unlinkError) {
+                console.error('Error deleting file:', unlinkError);
+            }
         }
     }
 });
 
 // Product return rate
 app.post('/product_return_rate', upload.single('file'), async (req, res, next) => {
-    if (!req.file) {
-        return res.status(400).json({ error: 'No file uploaded' });
+    if (!req.file && !getDatasetId(req)) {
+        return res.status(400).json({ error: 'No file uploaded or dataset_id provided' });
     }
 
     try {
-        const result = await sendFileToFlask(req.file.path, req.file.originalname, req.file.mimetype, 'product_return_rate');
+        const result = await forwardToFlask(req, 'product_return_rate');
         res.json({ product_return_rate: result.product_return_rate });
     } catch (error) {
         next(error);
     } finally {
-        try {
-            fs.unlinkSync(req.file.path);
-        } catch (unlinkError) {
-            console.error('Error deleting file:', unlinkError);
+        if (req.file) {
+            try {
+                fs.unlinkSync(req.file.path);
+            } catch (unlinkError) {
+                console.error('Error deleting file:', unlinkError);
+            }
         }
     }
 });
 
 // Customer activity heatmap
 app.post('/customer_activity_heatmap', upload.single('file'), async (req, res, next) => {
-    if (!req.file) {
-        return res.status(400).json({ error: 'No file uploaded' });
+    if (!req.file && !getDatasetId(req)) {
+        return res.status(400).json({ error: 'No file uploaded or dataset_id provided' });
     }
 
     try {
-        const result = await sendFileToFlask(req.file.path, req.file.originalname, req.file.mimetype, 'customer_activity_heatmap');
+        const result = await forwardToFlask(req, 'customer_activity_heatmap');
         res.json({
             activity_heatmap: result.activity_heatmap,
             peak_hour: result.peak_hour,
@@ -409,89 +538,252 @@ app.post('/customer_activity_heatmap', upload.single('file'), async (req, res, n
     } catch (error) {
         next(error);
     } finally {
-        try {
-            fs.unlinkSync(req.file.path);
-        } catch (unlinkError) {
-            console.error('Error deleting file:', unlinkError);
+        if (req.file) {
+            try {
+                fs.unlinkSync(req.file.path);
+            } catch (unlinkError) {
+                console.error('Error deleting file:', unlinkError);
+            }
         }
     }
 });
 
 // Seasonality analysis
 app.post('/seasonality_analysis', upload.single('file'), async (req, res, next) => {
-    if (!req.file) {
-        return res.status(400).json({ error: 'No file uploaded' });
+    if (!req.file && !getDatasetId(req)) {
+        return res.status(400).json({ error: 'No file uploaded or dataset_id provided' });
     }
 
     try {
-        const result = await sendFileToFlask(req.file.path, req.file.originalname, req.file.mimetype, 'seasonality_analysis');
+        const result = await forwardToFlask(req, 'seasonality_analysis');
         res.json({ seasonal_revenue: result.seasonal_revenue });
     } catch (error) {
         next(error);
     } finally {
-        try {
-            fs.unlinkSync(req.file.path);
-        } catch (unlinkError) {
-            console.error('Error deleting file:', unlinkError);
+        if (req.file) {
+            try {
+                fs.unlinkSync(req.file.path);
+            } catch (unlinkError) {
+                console.error('Error deleting file:', unlinkError);
+            }
         }
     }
 });
 
 // Retention rate
 app.post('/retention_rate', upload.single('file'), async (req, res, next) => {
-    if (!req.file) {
-        return res.status(400).json({ error: 'No file uploaded' });
+    if (!req.file && !getDatasetId(req)) {
+        return res.status(400).json({ error: 'No file uploaded or dataset_id provided' });
     }
 
     try {
-        const result = await sendFileToFlask(req.file.path, req.file.originalname, req.file.mimetype, 'retention_rate');
+        const result = await forwardToFlask(req, 'retention_rate');
         res.json({
             retention_data: result.retention_data,
             avg_retention: result.avg_retention,
-            recommendation: result.recommendation
+            recommendation: result.recommendation,
+            revenue_retention_data: result.revenue_retention_data,
+            avg_revenue_retention: result.avg_revenue_retention
         });
     } catch (error) {
         next(error);
     } finally {
-        try {
-            fs.unlinkSync(req.file.path);
-        } catch (unlinkError) {
-            console.error('Error deleting file:', unlinkError);
+        if (req.file) {
+            try {
+                fs.unlinkSync(req.file.path);
+            } catch (unlinkError) {
+                console.error('Error deleting file:', unlinkError);
+            }
         }
     }
 });
 
 // Sales drop analysis
 app.post('/sales_drop_analysis', upload.single('file'), async (req, res, next) => {
-    if (!req.file) {
-        return res.status(400).json({ error: 'No file uploaded' });
+    if (!req.file && !getDatasetId(req)) {
+        return res.status(400).json({ error: 'No file uploaded or dataset_id provided' });
     }
 
     try {
-        const result = await sendFileToFlask(req.file.path, req.file.originalname, req.file.mimetype, 'sales_drop_analysis');
+        const result = await forwardToFlask(req, 'sales_drop_analysis');
         res.json({ sales_drop_factors: result.sales_drop_factors });
     } catch (error) {
         next(error);
     } finally {
-        try {
-            fs.unlinkSync(req.file.path);
-        } catch (unlinkError) {
-            console.error('Error deleting file:', unlinkError);
+        if (req.file) {
+            try {
+                fs.unlinkSync(req.file.path);
+            } catch (unlinkError) {
+                console.error('Error deleting file:', unlinkError);
+            }
         }
     }
 });
 
 // Marketing recommendations
 app.post('/marketing_recommendations', upload.single('file'), async (req, res, next) => {
-    if (!req.file) {
-        return res.status(400).json({ error: 'No file uploaded' });
+    if (!req.file && !getDatasetId(req)) {
+        return res.status(400).json({ error: 'No file uploaded or dataset_id provided' });
     }
 
     try {
-        const result = await sendFileToFlask(req.file.path, req.file.originalname, req.file.mimetype, 'marketing_recommendations');
+        const result = await forwardToFlask(req, 'marketing_recommendations');
         res.json({ marketing_recommendations: result.marketing_recommendations });
     } catch (error) {
         next(error);
+    } finally {
+        if (req.file) {
+            try {
+                fs.unlinkSync(req.file.path);
+            } catch (unlinkError) {
+                console.error('Error deleting file:', unlinkError);
+            }
+        }
+    }
+});
+
+// Product bundles for a product or for the top products of an RFM segment
+app.post('/bundles', upload.single('file'), async (req, res, next) => {
+    if (!req.file && !getDatasetId(req)) {
+        return res.status(400).json({ error: 'No file uploaded or dataset_id provided' });
+    }
+
+    try {
+        const { product, segment, top_k } = req.body || {};
+        const query = { ...req.query, product: req.query.product || product, segment: req.query.segment || segment, top_k: req.query.top_k || top_k };
+        const result = req.file
+            ? await sendFileToFlask(req.file.path, req.file.originalname, req.file.mimetype, 'bundles', query)
+            : await sendDatasetToFlask(getDatasetId(req), 'bundles', query);
+        res.json(result);
+    } catch (error) {
+        next(error);
+    } finally {
+        if (req.file) {
+            try {
+                fs.unlinkSync(req.file.path);
+            } catch (unlinkError) {
+                console.error('Error deleting file:', unlinkError);
+            }
+        }
+    }
+});
+
+// Roll up the pre-aggregated revenue cube by date, country and product category
+app.post('/revenue_cube', upload.single('file'), async (req, res, next) => {
+    if (!req.file && !getDatasetId(req)) {
+        return res.status(400).json({ error: 'No file uploaded or dataset_id provided' });
+    }
+
+    try {
+        const { by, start, end, country } = req.body || {};
+        const query = { ...req.query, by: req.query.by || by, start: req.query.start || start, end: req.query.end || end, country: req.query.country || country };
+        const result = req.file
+            ? await sendFileToFlask(req.file.path, req.file.originalname, req.file.mimetype, 'revenue_cube', query)
+            : await sendDatasetToFlask(getDatasetId(req), 'revenue_cube', query);
+        res.json(result);
+    } catch (error) {
+        next(error);
+    } finally {
+        if (req.file) {
+            try {
+                fs.unlinkSync(req.file.path);
+            } catch (unlinkError) {
+                console.error('Error deleting file:', unlinkError);
+            }
+        }
+    }
+});
+
+// Score every customer with a registered model, streamed as NDJSON or Arrow
+app.post('/batch_score', upload.single('file'), async (req, res, next) => {
+    if (!req.file && !getDatasetId(req)) {
+        return res.status(400).json({ error: 'No file uploaded or dataset_id provided' });
+    }
+
+    try {
+        await pipeFromFlask(req, res, 'batch_score');
+    } catch (error) {
+        next(error);
+    } finally {
+        if (req.file) {
+            try {
+                fs.unlinkSync(req.file.path);
+            } catch (unlinkError) {
+                console.error('Error deleting file:', unlinkError);
+            }
+        }
+    }
+});
+
+// Submit analyses to run as a background job; returns the job with its ID
+app.post('/jobs', upload.single('file'), async (req, res, next) => {
+    if (!req.file && !getDatasetId(req)) {
+        return res.status(400).json({ error: 'No file uploaded or dataset_id provided' });
+    }
+
+    try {
+        // Form fields of an upload are passed on as analysis options
+        const { analyses, options, dataset_id: datasetId, ...fields } = req.body || {};
+        const query = { ...(req.file ? fields : {}), ...req.query, analyses: req.query.analyses || analyses };
+        if (req.file) {
+            return res.json(await sendFileToFlask(req.file.path, req.file.originalname, req.file.mimetype, 'jobs', query));
+        }
+        const response = await axios.post('http://localhost:5000/jobs', { dataset_id: getDatasetId(req), options }, {
+            params: query,
+        });
+        res.json(response.data);
+    } catch (error) {
+        next(new Error(error.response?.data?.error || error.message));
+    } finally {
+        if (req.file) {
+            try {
+                fs.unlinkSync(req.file.path);
+            } catch (unlinkError) {
+                console.error('Error deleting file:', unlinkError);
+            }
+        }
+    }
+});
+
+// Poll a job's status and progress
+app.get('/jobs/:jobId', async (req, res, next) => {
+    try {
+        const response = await axios.get(`http://localhost:5000/jobs/${encodeURIComponent(req.params.jobId)}`, {
+            validateStatus: () => true,
+        });
+        res.status(response.status).json(response.data);
+    } catch (error) {
+        next(error);
+    }
+});
+
+// Fetch the result of a finished job, piped through as it is read
+app.get('/jobs/:jobId/result', async (req, res, next) => {
+    try {
+        const response = await axios.get(`http://localhost:5000/jobs/${encodeURIComponent(req.params.jobId)}/result`, {
+            responseType: 'stream',
+            validateStatus: () => true,
+        });
+        res.status(response.status);
+        res.setHeader('Content-Type', response.headers['content-type']);
+        await pipeline(response.data, res);
+    } catch (error) {
+        next(error);
+    }
+});
+
+// Append new transactions to a stored dataset
+app.post('/append_transactions', upload.single('file'), async (req, res, next) => {
+    if (!req.file || !getDatasetId(req)) {
+        return res.status(400).json({ error: 'A file and the dataset_id to append to are required' });
+    }
+
+    try {
+        const query = { ...req.query, dataset_id: getDatasetId(req) };
+        const result = await sendFileToFlask(req.file.path, req.file.originalname, req.file.mimetype, 'append_transactions', query);
+        res.json(result);
+    } catch (error) {
+        next(error);
     } finally {
         try {
             fs.unlinkSync(req.file.path);
@@ -90,9 +90,10 @@ function Analysis({ activeTab, setActiveTab }) {
     formData.append("file", file);
 
     try {
-      await axios.post("http://localhost:5001/upload_csv", formData, {
+      const uploadResponse = await axios.post("http://localhost:5001/upload_csv", formData, {
         headers: { "Content-Type": "multipart/form-data" },
       });
+      const datasetId = uploadResponse.data.dataset_id;
 
       const endpoints = [
         "rfm_analysis",
@@ -119,9 +120,7 @@ function Analysis({ activeTab, setActiveTab }) {
       const responses = await Promise.all(
         endpoints.map((endpoint) =>
           axios
-            .post(`http://localhost:5001/${endpoint}`, formData, {
-              headers: { "Content-Type": "multipart/form-data" },
-            })
+            .post(`http://localhost:5001/${endpoint}`, { dataset_id: datasetId })
             .catch((err) => ({
               error: `Failed to fetch ${endpoint}: ${err.message}`,
             }))
@@ -0,0 +1,188 @@
+import logging
+import math
+import os
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from mlxtend.frequent_patterns import fpgrowth, association_rules
+from utils.serialization import records
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Minimum fraction of invoices an itemset must appear in
+AFFINITY_MIN_SUPPORT = float(os.environ.get('AFFINITY_MIN_SUPPORT', 0.005))
+
+# Largest itemset mined. Pairs come from a sparse co-occurrence product; longer
+# itemsets fall back to FP-Growth over the frequent items.
+AFFINITY_MAX_LEN = int(os.environ.get('AFFINITY_MAX_LEN', 2))
+
+# Memory allowed for the intermediate pair counts; larger products are computed in
+# blocks of item columns
+AFFINITY_MEMORY_BUDGET_BYTES = int(os.environ.get('AFFINITY_MEMORY_BUDGET_BYTES', 512 * 1024**2))
+
+# Rules returned, strongest lift first
+AFFINITY_TOP_RULES = 10
+
+# Approximate bytes per stored entry of a sparse product (value, index and workspace)
+BYTES_PER_PAIR = 24
+
+RULE_COLUMNS = ['antecedents', 'consequents', 'support', 'confidence', 'lift', 'recommendation']
+
+def affinity_options(request):
+    """Mining options from the min_support and max_len query parameters, if given."""
+    if request is None:
+        return {}
+    options = {}
+    if request.values.get('min_support'):
+        options['min_support'] = float(request.values['min_support'])
+        if not 0 < options['min_support'] <= 1:
+            raise ValueError("min_support must be in (0, 1]")
+    if request.values.get('max_len'):
+        options['max_len'] = int(request.values['max_len'])
+        if options['max_len'] < 2:
+            raise ValueError("max_len must be at least 2")
+    return options
+
+def invoice_item_matrix(df):
+    """
+    Build the invoice x item incidence matrix from the categorical codes.
+
+    An item belongs to an invoice when its summed quantity on that invoice is positive,
+    so invoices only holding returns of an item do not count as buying it.
+
+    Returns:
+        Tuple of (CSR matrix of int32 ones, item labels)
+    """
+    invoices = df['InvoiceNo'].astype('category')
+    items = df['Description'].astype('category')
+    invoice_codes = invoices.cat.codes.to_numpy()
+    item_codes = items.cat.codes.to_numpy()
+    valid = (invoice_codes >= 0) & (item_codes >= 0)
+
+    quantities = sparse.csr_matrix(
+        (df['Quantity'].to_numpy(dtype=np.float64)[valid], (invoice_codes[valid], item_codes[valid])),
+        shape=(len(invoices.cat.categories), len(items.cat.categories))
+    )
+    quantities.sum_duplicates()
+    quantities.data = (quantities.data > 0).astype(np.int32)
+    quantities.eliminate_zeros()
+    return quantities, items.cat.categories
+
+def pair_counts(matrix, min_count, memory_budget=AFFINITY_MEMORY_BUDGET_BYTES):
+    """
+    Count how many invoices contain each pair of items via the sparse product X.T @ X,
+    keeping the pairs seen in at least min_count invoices.
+
+    The product is split into blocks of item columns so that its estimated size stays
+    within memory_budget.
+
+    Returns:
+        Tuple of (first item, second item, count) arrays with first < second
+    """
+    n_items = matrix.shape[1]
+    if n_items == 0:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32), np.empty(0, dtype=matrix.dtype)
+    row_sizes = np.diff(matrix.indptr).astype(np.int64)
+    estimated_bytes = int((row_sizes ** 2).sum()) * BYTES_PER_PAIR
+    n_blocks = max(1, math.ceil(estimated_bytes / memory_budget))
+    block_size = max(1, math.ceil(n_items / n_blocks))
+    if n_blocks > 1:
+        logger.info(f"Pair counts estimated at {estimated_bytes / 1024**2:.1f} MiB; using {n_blocks} blocks")
+
+    transposed = matrix.T.tocsr()
+    columns = matrix.tocsc()
+    firsts, seconds, counts = [], [], []
+    for start in range(0, n_items, block_size):
+        block = (transposed @ columns[:, start:start + block_size]).tocoo()
+        second = block.col + start
+        keep = (block.row < second) & (block.data >= min_count)
+        firsts.append(block.row[keep])
+        seconds.append(second[keep])
+        counts.append(block.data[keep])
+    return np.concatenate(firsts), np.concatenate(seconds), np.concatenate(counts)
+
+def pair_rules(matrix, labels, min_support, memory_budget):
+    """Association rules between pairs of items, in both directions."""
+    n_invoices = matrix.shape[0]
+    item_counts = np.asarray(matrix.sum(axis=0)).ravel()
+    first, second, count = pair_counts(matrix, min_support * n_invoices, memory_budget)
+    if len(count) == 0:
+        return pd.DataFrame(columns=RULE_COLUMNS[:-1])
+
+    antecedent = np.concatenate([first, second])
+    consequent = np.concatenate([second, first])
+    count = np.concatenate([count, count]).astype(np.float64)
+    support = count / n_invoices
+    confidence = count / item_counts[antecedent]
+    lift = confidence / (item_counts[consequent] / n_invoices)
+    return pd.DataFrame({
+        'antecedents': np.asarray(labels)[antecedent],
+        'consequents': np.asarray(labels)[consequent],
+        'support': support,
+        'confidence': confidence,
+        'lift': lift
+    })
+
+def itemset_rules(matrix, labels, min_support, max_len):
+    """Association rules over itemsets of up to max_len items, mined with FP-Growth."""
+    basket = pd.DataFrame.sparse.from_spmatrix(matrix.astype(bool), columns=list(labels))
+    frequent_itemsets = fpgrowth(basket, min_support=min_support, use_colnames=True, max_len=max_len)
+    if frequent_itemsets.empty:
+        return pd.DataFrame(columns=RULE_COLUMNS[:-1])
+    rules = association_rules(frequent_itemsets, metric="lift", min_threshold=1)
+    rules['antecedents'] = rules['antecedents'].apply(lambda x: ', '.join(x))
+    rules['consequents'] = rules['consequents'].apply(lambda x: ', '.join(x))
+    return rules[['antecedents', 'consequents', 'support', 'confidence', 'lift']]
+
+def mine_affinity_rules(df, min_support=AFFINITY_MIN_SUPPORT, max_len=AFFINITY_MAX_LEN,
+                        memory_budget=AFFINITY_MEMORY_BUDGET_BYTES, top_n=AFFINITY_TOP_RULES):
+    """
+    Mine product bundle rules over every invoice of the dataset.
+
+    Args:
+        df: Cleaned DataFrame
+        min_support: Minimum fraction of invoices an itemset must appear in
+        max_len: Largest itemset mined (2 uses the co-occurrence product)
+        memory_budget: Bytes allowed for the intermediate pair counts
+        top_n: Number of rules returned
+
+    Returns:
+        List of rule dictionaries (antecedents, consequents, support, confidence, lift,
+        recommendation), strongest lift first
+    """
+    try:
+        matrix, labels = invoice_item_matrix(df)
+        n_invoices = matrix.shape[0]
+        if n_invoices == 0:
+            return []
+
+        # Only items frequent on their own can be part of a frequent itemset
+        frequent = np.flatnonzero(np.asarray(matrix.sum(axis=0)).ravel() >= min_support * n_invoices)
+        matrix = matrix[:, frequent]
+        labels = labels[frequent]
+        logger.info(f"Mining {n_invoices} invoices, {len(frequent)} frequent items, {matrix.nnz} item occurrences")
+        if len(frequent) == 0:
+            logger.warning("No item reaches the minimum support.")
+            return []
+
+        if max_len <= 2:
+            rules = pair_rules(matrix, labels, min_support, memory_budget)
+            rules = rules[rules['lift'] >= 1]
+        else:
+            rules = itemset_rules(matrix, labels, min_support, max_len)
+        if rules.empty:
+            logger.warning("No association rules found.")
+            return []
+
+        # Ties are broken by name so the result does not depend on the block layout
+        rules = rules.sort_values(['lift', 'antecedents', 'consequents'], ascending=[False, True, True]).head(top_n).copy()
+        rules['recommendation'] = [
+            f"Bundle {antecedents} with {consequents} (Confidence: {confidence:.2f}, Lift: {lift:.2f})"
+            for antecedents, consequents, confidence, lift
+            in zip(rules['antecedents'], rules['consequents'], rules['confidence'], rules['lift'])
+        ]
+        return records(rules[RULE_COLUMNS])
+    except Exception as e:
+        logger.error(f"Error in mine_affinity_rules: {e}")
+        raise
@@ -0,0 +1,163 @@
+import logging
+import numpy as np
+import pandas as pd
+from utils.date_keys import date_key, month_label, quarter_label, week_label
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Cohort granularities: name -> (date key, function turning the key into the period
+# index, function labelling a period index)
+COHORT_PERIODS = {
+    'month': ('MonthIndex', lambda keys: keys, month_label),
+    'quarter': ('MonthIndex', lambda keys: keys // 3, quarter_label),
+    'week': ('WeekIndex', lambda keys: keys, week_label),
+}
+
+DEFAULT_COHORT_PERIOD = 'month'
+
+def retention_options(request):
+    """Cohort options from the period and revenue query parameters, if given."""
+    if request is None:
+        return {}
+    options = {}
+    if request.values.get('period'):
+        options['period'] = request.values['period'].lower()
+        if options['period'] not in COHORT_PERIODS:
+            raise ValueError(f"period must be one of: {', '.join(COHORT_PERIODS)}")
+    if request.values.get('revenue'):
+        options['revenue'] = request.values['revenue'].lower() == 'true'
+    return options
+
+def period_index(df, period):
+    key, to_period, _ = COHORT_PERIODS[period]
+    return to_period(date_key(df, key).to_numpy(np.int64))
+
+def cohort_counts(customers, periods, weights=None, first_periods=None):
+    """
+    Count distinct active customers (and optionally sum revenue) per cohort and
+    period offset from integer codes.
+
+    Args:
+        customers: Integer customer code of each row
+        periods: Integer period index of each row
+        weights: Optional revenue of each row
+        first_periods: Optional cohort period of each customer code; computed as the
+            customer's earliest period when not given
+
+    Returns:
+        Tuple of (sorted cohort period indexes, int64 customer counts and float64
+        revenue (None without weights), both of shape (cohorts, offsets))
+    """
+    customers = np.asarray(customers, dtype=np.int64)
+    periods = np.asarray(periods, dtype=np.int64)
+    if len(periods) == 0:
+        return np.empty(0, dtype=np.int64), np.zeros((0, 0), dtype=np.int64), None
+
+    if first_periods is None:
+        first_periods = np.full(customers.max() + 1, periods.max(), dtype=np.int64)
+        np.minimum.at(first_periods, customers, periods)
+    offsets = periods - first_periods[customers]
+    cohorts, cohort_positions = np.unique(first_periods[customers], return_inverse=True)
+    n_offsets = int(offsets.max()) + 1
+    cells = cohort_positions * n_offsets + offsets
+    shape = (len(cohorts), n_offsets)
+
+    # A customer's cohort is fixed, so each distinct (customer, offset) is one active period
+    _, first_rows = np.unique(customers * n_offsets + offsets, return_index=True)
+    counts = np.bincount(cells[first_rows], minlength=shape[0] * shape[1]).reshape(shape)
+    revenue = None
+    if weights is not None:
+        revenue = np.bincount(cells, weights=np.asarray(weights, dtype=np.float64), minlength=shape[0] * shape[1]).reshape(shape)
+    return cohorts, counts, revenue
+
+def retention_matrix(values):
+    """Each cohort's values relative to its first period, rounded to two decimals."""
+    base = values[:, :1]
+    rates = np.divide(values, base, out=np.zeros(values.shape, dtype=np.float64), where=base > 0)
+    return np.round(rates, 2)
+
+def average_retention(rates):
+    """Mean retention over the periods after the first, averaging each offset first."""
+    if rates.shape[1] <= 1:
+        return 0
+    return pd.DataFrame(rates).iloc[:, 1:].mean().mean()
+
+def retention_rows(cohort_labels, columns, rates):
+    return [dict(cohort=label, **dict(zip(columns, row))) for label, row in zip(cohort_labels, rates.tolist())]
+
+def retention_summary(cohorts, counts, period=DEFAULT_COHORT_PERIOD, revenue=None):
+    """
+    Build the retention response from cohort x offset matrices.
+
+    Offsets at which no cohort was active are left out, and cohorts are labelled
+    with their period, e.g. '2011-03', '2011-Q1' or '2011-W05'.
+
+    Args:
+        cohorts: Sorted cohort period indexes
+        counts: Distinct active customers per cohort and offset
+        period: Cohort granularity (a key of COHORT_PERIODS)
+        revenue: Optional revenue per cohort and offset
+
+    Returns:
+        Dictionary with retention_data, avg_retention and recommendation, plus
+        revenue_retention_data and avg_revenue_retention when revenue is given
+    """
+    try:
+        if len(cohorts) == 0:
+            return {
+                "retention_data": [],
+                "recommendation": "Insufficient data for retention analysis."
+            }
+
+        active = np.flatnonzero(counts.sum(axis=0) > 0)
+        columns = [f"{period}_{offset}" for offset in active.tolist()]
+        labels = [str(COHORT_PERIODS[period][2](int(cohort))) for cohort in cohorts]
+
+        retention_rates = retention_matrix(counts[:, active])
+        avg_retention = average_retention(retention_rates)
+
+        if avg_retention < 0.3:
+            recommendation = 'Low retention rate of {:.1%}; focus on loyalty programs and customer engagement.'.format(avg_retention)
+        elif avg_retention < 0.6:
+            recommendation = 'Moderate retention rate of {:.1%}; enhance customer engagement with personalized offers.'.format(avg_retention)
+        else:
+            recommendation = 'High retention rate of {:.1%}; maintain current strategies and consider referral programs.'.format(avg_retention)
+
+        summary = {
+            "retention_data": retention_rows(labels, columns, retention_rates),
+            "avg_retention": float(avg_retention),
+            "recommendation": recommendation
+        }
+        if revenue is not None:
+            revenue_rates = retention_matrix(revenue[:, active])
+            summary["revenue_retention_data"] = retention_rows(labels, columns, revenue_rates)
+            summary["avg_revenue_retention"] = float(average_retention(revenue_rates))
+        return summary
+    except Exception as e:
+        logger.error(f"Error in retention_summary: {e}")
+        raise
+
+def cohort_retention(df, period=DEFAULT_COHORT_PERIOD, revenue=False):
+    """
+    Cohort retention of a cleaned dataset, cohorts being the period of each customer's
+    first purchase.
+
+    Args:
+        df: Cleaned DataFrame
+        period: Cohort granularity ('month', 'quarter' or 'week')
+        revenue: Also report revenue retention (revenue of each period relative to the
+            cohort's first period)
+    """
+    try:
+        if period not in COHORT_PERIODS:
+            raise ValueError(f"period must be one of: {', '.join(COHORT_PERIODS)}")
+        customers = df['CustomerID'].astype('category').cat.codes.to_numpy()
+        periods = period_index(df, period)
+        valid = customers >= 0
+        weights = df['TotalPrice'].to_numpy()[valid] if revenue else None
+        cohorts, counts, cohort_revenue = cohort_counts(customers[valid], periods[valid], weights)
+        return retention_summary(cohorts, counts, period, cohort_revenue)
+    except Exception as e:
+        logger.error(f"Error in cohort_retention: {e}")
+        raise
@@ -0,0 +1,240 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from analysis.affinity_engine import invoice_item_matrix, pair_counts, AFFINITY_MEMORY_BUDGET_BYTES
+from utils.dataset_store import DATASET_STORE_FOLDER, dataset_key, key_dataset_id
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Neighbours kept per product, strongest lift first
+COOCCURRENCE_TOP_K = int(os.environ.get('COOCCURRENCE_TOP_K', 20))
+
+# Invoices a pair must share to be indexed; single co-purchases are mostly noise
+COOCCURRENCE_MIN_COUNT = int(os.environ.get('COOCCURRENCE_MIN_COUNT', 2))
+
+# Number of loaded indexes kept in memory
+COOCCURRENCE_CACHE_MAX_ENTRIES = int(os.environ.get('COOCCURRENCE_CACHE_MAX_ENTRIES', 8))
+
+# Products by revenue whose neighbours make up a segment's bundles
+SEGMENT_TOP_PRODUCTS = 5
+
+INDEX_ARRAYS = ['labels', 'item_counts', 'n_invoices', 'indptr', 'neighbours', 'support', 'confidence', 'lift',
+                'segments', 'segment_indptr', 'segment_products']
+
+def index_path(key):
+    return os.path.join(DATASET_STORE_FOLDER, f"{key}.cooccurrence.npz")
+
+def top_k_per_group(groups, scores, k):
+    """Positions of the k highest scores within each group, grouped and best first."""
+    order = np.lexsort((-scores, groups))
+    sorted_groups = groups[order]
+    rank = np.arange(len(order)) - np.searchsorted(sorted_groups, sorted_groups, side='left')
+    return order[rank < k]
+
+class CooccurrenceIndex:
+    """
+    Item-to-item co-occurrence index of one dataset: for every product, its top-K
+    co-purchased products with the support, confidence and lift of the rule
+    "product -> neighbour", stored CSR-style (neighbours of item i are the slice
+    indptr[i]:indptr[i + 1]). It also keeps each RFM segment's top products by revenue
+    so segment bundles are answered from the index alone.
+    """
+
+    def __init__(self, labels, item_counts, n_invoices, indptr, neighbours, support, confidence, lift,
+                 segments, segment_indptr, segment_products):
+        self.labels = labels
+        self.item_counts = item_counts
+        self.n_invoices = int(n_invoices)
+        self.indptr = indptr
+        self.neighbours = neighbours
+        self.support = support
+        self.confidence = confidence
+        self.lift = lift
+        self.segments = segments
+        self.segment_indptr = segment_indptr
+        self.segment_products = segment_products
+        self.codes = {label: code for code, label in enumerate(labels.tolist())}
+        self.segment_codes = {segment: code for code, segment in enumerate(segments.tolist())}
+
+    @classmethod
+    def build(cls, df, rfm, top_k=COOCCURRENCE_TOP_K, min_count=COOCCURRENCE_MIN_COUNT,
+              memory_budget=AFFINITY_MEMORY_BUDGET_BYTES):
+        """
+        Build the index from cleaned transactions and their RFM segments.
+
+        Args:
+            df: Cleaned DataFrame
+            rfm: RFM DataFrame with a segment column, indexed by CustomerID
+            top_k: Neighbours kept per product
+            min_count: Invoices a pair must share to be indexed
+            memory_budget: Bytes allowed for the intermediate pair counts
+        """
+        try:
+            matrix, labels = invoice_item_matrix(df)
+            n_invoices = matrix.shape[0]
+            item_counts = np.asarray(matrix.sum(axis=0)).ravel()
+
+            first, second, count = pair_counts(matrix, min_count, memory_budget)
+            antecedent = np.concatenate([first, second])
+            consequent = np.concatenate([second, first])
+            count = np.concatenate([count, count]).astype(np.float64)
+            support = count / n_invoices
+            confidence = count / item_counts[antecedent]
+            lift = confidence / (item_counts[consequent] / n_invoices)
+
+            keep = top_k_per_group(antecedent, lift, top_k)
+            indptr = np.concatenate([[0], np.cumsum(np.bincount(antecedent[keep], minlength=len(labels)))])
+
+            # Each segment's top products by revenue, as item codes
+            segment_of = df['CustomerID'].map(rfm['segment'])
+            revenue = pd.DataFrame({
+                'segment': segment_of.to_numpy(dtype=object),
+                'item': df['Description'].astype('category').cat.codes.to_numpy(),
+                'TotalPrice': df['TotalPrice'].to_numpy()
+            }).dropna(subset=['segment'])
+            revenue = revenue[revenue['item'] >= 0].groupby(['segment', 'item'])['TotalPrice'].sum().reset_index()
+            revenue = revenue.sort_values(['segment', 'TotalPrice'], ascending=[True, False])
+            revenue = revenue.groupby('segment').head(SEGMENT_TOP_PRODUCTS)
+            segments = np.array(sorted(revenue['segment'].unique()), dtype=str)
+            segment_sizes = revenue.groupby('segment').size().reindex(segments, fill_value=0).to_numpy()
+
+            logger.info(f"Built co-occurrence index: {len(labels)} products, {len(keep)} neighbour links")
+            return cls(
+                labels=np.asarray(labels, dtype=str),
+                item_counts=item_counts.astype(np.int64),
+                n_invoices=n_invoices,
+                indptr=indptr.astype(np.int64),
+                neighbours=consequent[keep].astype(np.int32),
+                support=support[keep],
+                confidence=confidence[keep],
+                lift=lift[keep],
+                segments=segments,
+                segment_indptr=np.concatenate([[0], np.cumsum(segment_sizes)]).astype(np.int64),
+                segment_products=revenue['item'].to_numpy(dtype=np.int32)
+            )
+        except Exception as e:
+            logger.error(f"Error in CooccurrenceIndex.build: {e}")
+            raise
+
+    def _rules(self, code, top_k):
+        start, end = self.indptr[code], min(self.indptr[code + 1], self.indptr[code] + top_k)
+        antecedent = str(self.labels[code])
+        return [
+            {
+                'antecedents': antecedent,
+                'consequents': str(self.labels[neighbour]),
+                'support': float(support),
+                'confidence': float(confidence),
+                'lift': float(lift),
+                'recommendation': f"Bundle {antecedent} with {self.labels[neighbour]} (Confidence: {confidence:.2f}, Lift: {lift:.2f})"
+            }
+            for neighbour, support, confidence, lift in zip(
+                self.neighbours[start:end], self.support[start:end], self.confidence[start:end], self.lift[start:end]
+            )
+        ]
+
+    def bundles_for_product(self, product, top_k=COOCCURRENCE_TOP_K):
+        """Rules "product -> neighbour" for a product's strongest neighbours."""
+        code = self.codes.get(product)
+        if code is None:
+            raise ValueError(f"Unknown product: {product}")
+        return self._rules(code, top_k)
+
+    def segment_top_products(self, segment):
+        code = self.segment_codes.get(segment)
+        if code is None:
+            raise ValueError(f"Unknown segment: {segment}")
+        products = self.segment_products[self.segment_indptr[code]:self.segment_indptr[code + 1]]
+        return [str(self.labels[product]) for product in products]
+
+    def bundles_for_segment(self, segment, top_k=COOCCURRENCE_TOP_K):
+        """
+        Strongest rules starting from any of a segment's top products. Lift is symmetric,
+        so when two top products are each other's neighbours only the first of "A -> B"
+        and "B -> A" is kept.
+        """
+        top_products = self.segment_top_products(segment)
+        rules = [rule for product in top_products for rule in self.bundles_for_product(product, top_k)]
+        rules.sort(key=lambda rule: rule['lift'], reverse=True)
+        pairs = set()
+        bundles = []
+        for rule in rules:
+            pair = frozenset((rule['antecedents'], rule['consequents']))
+            if pair not in pairs:
+                pairs.add(pair)
+                bundles.append(rule)
+        return top_products, bundles[:top_k]
+
+    def segment_bundles(self, top_k):
+        return {str(segment): self.bundles_for_segment(segment, top_k)[1] for segment in self.segments}
+
+    def save(self, key):
+        path = index_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, **{name: getattr(self, name) for name in INDEX_ARRAYS})
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, key):
+        path = index_path(key)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as arrays:
+            return cls(**{name: arrays[name] for name in INDEX_ARRAYS})
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+def _cache(key, index):
+    with _indexes_lock:
+        _indexes[key] = index
+        _indexes.move_to_end(key)
+        while len(_indexes) > COOCCURRENCE_CACHE_MAX_ENTRIES:
+            _indexes.popitem(last=False)
+
+def discard_cooccurrence_indexes(dataset_id, version):
+    """Drop the indexes of the versions of a dataset before version, from memory and disk."""
+    with _indexes_lock:
+        for key in [key for key in _indexes if key_dataset_id(key) == dataset_id]:
+            del _indexes[key]
+    for earlier in range(version):
+        path = index_path(dataset_key(dataset_id, earlier))
+        if os.path.exists(path):
+            os.remove(path)
+
+def get_cooccurrence_index(key):
+    """
+    Return the index of a dataset key (utils.dataset_store.dataset_key) from memory or
+    disk, or None if it was never built.
+    """
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+            return index
+    index = CooccurrenceIndex.load(key)
+    if index is not None:
+        _cache(key, index)
+    return index
+
+def cooccurrence_index(key, builder):
+    """
+    Return the index of a dataset key, calling builder() to build and persist it the
+    first time. Without a key the index is built for the request only.
+    """
+    try:
+        if key is None:
+            return builder()
+        index = get_cooccurrence_index(key)
+        if index is None:
+            index = builder()
+            index.save(key)
+            _cache(key, index)
+        return index
+    except Exception as e:
+        logger.error(f"Error in cooccurrence_index: {e}")
+        raise
@@ -1,82 +1,153 @@
 import logging
 import pandas as pd
+from analysis.cohort_engine import cohort_retention, DEFAULT_COHORT_PERIOD
+from analysis.labels import assign_labels, Quantile
+from analysis.revenue_cube import RevenueCube
+from utils.date_keys import date_key, month_labels
+from utils.serialization import records
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+CLV_TIERS = [
+    ('>', Quantile(0.75), 'Focus on retention with loyalty program.'),
+    ('>', Quantile(0.25), 'Engage with targeted promotions.'),
+]
+CLV_DEFAULT = 'Low CLV; minimize marketing spend.'
+
+ACQUISITION_TIERS = [
+    ('<', -0.1, 'Increase marketing spend to boost acquisition.'),
+    ('>', 0.1, 'Sustain acquisition strategies.'),
+]
+ACQUISITION_DEFAULT = 'Maintain current efforts.'
+
+MARKET_TIERS = [
+    ('>', Quantile(0.75), 'High-value market; expand marketing.'),
+    ('<', Quantile(0.25), 'Low-value market; optimize campaigns.'),
+]
+MARKET_DEFAULT = 'Stable market; maintain strategy.'
+
+RETURN_RATE_TIERS = [
+    ('>', 0.1, 'Investigate quality issues.'),
+    ('>', 0.02, 'Monitor returns.'),
+]
+RETURN_RATE_DEFAULT = 'Low returns; maintain quality.'
+
 def calculate_clv(df):
     try:
-        avg_purchase_value = df.groupby('CustomerID')['TotalPrice'].mean()
-        purchase_frequency = df.groupby('CustomerID')['InvoiceNo'].nunique() / df['InvoiceDate'].dt.year.nunique()
-        retention_rate = df.groupby('CustomerID')['InvoiceNo'].count().apply(lambda x: min(x / 10, 0.9))
-        churn_rate = 1 - retention_rate
-        clv = (avg_purchase_value * purchase_frequency * retention_rate) / churn_rate
-        clv = clv.reset_index().rename(columns={0: 'CLV'})
-        
-        clv['recommendation'] = clv['CLV'].apply(
-            lambda x: 'Focus on retention with loyalty program.' if x > clv['CLV'].quantile(0.75)
-            else 'Engage with targeted promotions.' if x > clv['CLV'].quantile(0.25)
-            else 'Low CLV; minimize marketing spend.'
+        grouped = df.groupby('CustomerID', observed=True)
+        return clv_from_aggregates(
+            grouped['TotalPrice'].mean(),
+            grouped['InvoiceNo'].nunique(),
+            grouped['InvoiceNo'].count(),
+            df['InvoiceDate'].dt.year.nunique()
         )
-        
-        return clv
     except Exception as e:
         logger.error(f"Error in calculate_clv: {e}")
         raise
 
+def clv_from_aggregates(avg_purchase_value, invoice_count, line_count, active_years):
+    """
+    Compute CLV and recommendations from per-customer aggregates indexed by CustomerID.
+    
+    Args:
+        avg_purchase_value: Mean TotalPrice per transaction line
+        invoice_count: Number of distinct invoices
+        line_count: Number of transaction lines
+        active_years: Number of distinct calendar years in the dataset
+    """
+    purchase_frequency = invoice_count / active_years
+    retention_rate = (line_count / 10).clip(upper=0.9)
+    churn_rate = 1 - retention_rate
+    clv = (avg_purchase_value * purchase_frequency * retention_rate) / churn_rate
+    clv = clv.rename('CLV').rename_axis('CustomerID').reset_index()
+    
+    clv['recommendation'] = assign_labels(clv['CLV'], CLV_TIERS, CLV_DEFAULT)
+    
+    return clv
+
+def customer_attributes(df, rfm):
+    """
+    Segment and country of each customer, indexed by CustomerID as strings. A
+    customer's country is the one of their first transaction line; customers without
+    an RFM segment (no positive spend) get NaN.
+    """
+    try:
+        return customer_attributes_from_aggregates(df.groupby('CustomerID', observed=True)['Country'].first(), rfm)
+    except Exception as e:
+        logger.error(f"Error in customer_attributes: {e}")
+        raise
+
+def customer_attributes_from_aggregates(countries, rfm):
+    """Segment and country of each customer from their country, indexed by CustomerID."""
+    attributes = pd.DataFrame({'Country': countries.astype(str).to_numpy()}, index=countries.index.astype(str))
+    segments = pd.Series(rfm['segment'].to_numpy(), index=rfm.index.astype(str))
+    attributes['segment'] = segments.reindex(attributes.index).to_numpy()
+    return attributes
+
 def top_customers_analysis(df):
     try:
-        top_customers = df.groupby('CustomerID')['TotalPrice'].sum().nlargest(10).reset_index()
-        top_customers['recommendation'] = 'Enroll in VIP program.'
-        return top_customers.to_dict(orient='records')
+        return top_customers_from_aggregates(df.groupby('CustomerID', observed=True)['TotalPrice'].sum())
     except Exception as e:
         logger.error(f"Error in top_customers_analysis: {e}")
         raise
 
+def top_customers_from_aggregates(revenue):
+    """The ten customers with the most revenue, from revenue indexed by CustomerID."""
+    top_customers = revenue.nlargest(10).rename('TotalPrice').rename_axis('CustomerID').reset_index()
+    top_customers['recommendation'] = 'Enroll in VIP program.'
+    return records(top_customers)
+
 def top_products_analysis(df):
     try:
-        top_products = df.groupby('Description')['TotalPrice'].sum().nlargest(10).reset_index()
-        top_products['recommendation'] = 'Promote heavily in marketing.'
-        return top_products.to_dict(orient='records')
+        return top_products_from_aggregates(df.groupby('Description', observed=True)['TotalPrice'].sum())
     except Exception as e:
         logger.error(f"Error in top_products_analysis: {e}")
         raise
 
+def top_products_from_aggregates(revenue):
+    """The ten products with the most revenue, from revenue indexed by Description."""
+    top_products = revenue.nlargest(10).rename('TotalPrice').rename_axis('Description').reset_index()
+    top_products['recommendation'] = 'Promote heavily in marketing.'
+    return records(top_products)
+
 def monthly_customer_acquisition(df):
     try:
-        df['FirstPurchaseDate'] = pd.to_datetime(df.groupby('CustomerID')['InvoiceDate'].transform('min'))
-        df['YearMonth'] = df['FirstPurchaseDate'].dt.to_period('M')
-        monthly_acquisition = df.groupby('YearMonth')['CustomerID'].nunique().reset_index()
+        # The month of a customer's first purchase is the smallest month they bought in
+        first_months = date_key(df, 'MonthIndex').groupby(df['CustomerID'], observed=True).min()
+        new_customers = first_months.value_counts().sort_index()
+        monthly_acquisition = pd.DataFrame({
+            'YearMonth': month_labels(new_customers.index),
+            'CustomerID': new_customers.to_numpy()
+        })
         monthly_acquisition['YoY_Change'] = monthly_acquisition['CustomerID'].pct_change(periods=12).fillna(0)
-        monthly_acquisition['recommendation'] = monthly_acquisition['YoY_Change'].apply(
-            lambda x: 'Increase marketing spend to boost acquisition.' if x < -0.1
-            else 'Sustain acquisition strategies.' if x > 0.1
-            else 'Maintain current efforts.'
+        monthly_acquisition['recommendation'] = assign_labels(
+            monthly_acquisition['YoY_Change'], ACQUISITION_TIERS, ACQUISITION_DEFAULT
         )
-        monthly_acquisition['YearMonth'] = monthly_acquisition['YearMonth'].astype(str)
         monthly_acquisition.rename(columns={'CustomerID': 'newCustomers'}, inplace=True)
         
-        return monthly_acquisition.to_dict(orient='records')
+        return records(monthly_acquisition)
     except Exception as e:
         logger.error(f"Error in monthly_customer_acquisition: {e}")
         raise
 
-def geographical_analysis(df, request):
+def geographical_analysis(df, request, cube=None):
     try:
-        if 'Country' not in df.columns:
-            raise ValueError("CSV file must contain a 'Country' column")
-        
-        geographical_revenue = df.groupby('Country').agg({
-            'TotalPrice': 'sum',
-            'CustomerID': 'nunique'
-        }).reset_index()
-        geographical_revenue.rename(columns={'TotalPrice': 'RawRevenue', 'CustomerID': 'CustomerCount'}, inplace=True)
+        if cube is None:
+            if 'Country' not in df.columns:
+                raise ValueError("CSV file must contain a 'Country' column")
+            cube = RevenueCube.build(df)
+        
+        revenue = cube.rollup(['country'])
+        geographical_revenue = pd.DataFrame({
+            'Country': revenue['country'],
+            'RawRevenue': revenue['revenue'],
+            'CustomerCount': revenue['customers']
+        })
         geographical_revenue['RevenuePerCustomer'] = geographical_revenue['RawRevenue'] / geographical_revenue['CustomerCount']
         
-        geographical_revenue['recommendation'] = geographical_revenue['RevenuePerCustomer'].apply(
-            lambda x: 'High-value market; expand marketing.' if x > geographical_revenue['RevenuePerCustomer'].quantile(0.75)
-            else 'Low-value market; optimize campaigns.' if x < geographical_revenue['RevenuePerCustomer'].quantile(0.25)
-            else 'Stable market; maintain strategy.'
+        geographical_revenue['recommendation'] = assign_labels(
+            geographical_revenue['RevenuePerCustomer'], MARKET_TIERS, MARKET_DEFAULT
         )
         
         scaled = request.args.get('scaled', 'false').lower() == 'true'
@@ -85,7 +156,7 @@ def geographical_analysis(df, request):
         else:
             output = geographical_revenue[['Country', 'RawRevenue', 'RevenuePerCustomer', 'CustomerCount', 'recommendation']]
         
-        return output.to_dict(orient='records')
+        return records(output)
     except Exception as e:
         logger.error(f"Error in geographical_analysis: {e}")
         raise
@@ -93,18 +164,16 @@ def geographical_analysis(df, request):
 def product_return_rate(df):
     try:
         returns = df[df['Quantity'] < 0]
-        return_rate = returns.groupby('Description')['Quantity'].sum().reset_index()
-        total_sold = df[df['Quantity'] > 0].groupby('Description')['Quantity'].sum()
+        return_rate = returns.groupby('Description', observed=True)['Quantity'].sum().reset_index()
+        total_sold = df[df['Quantity'] > 0].groupby('Description', observed=True)['Quantity'].sum()
         return_rate['ReturnRate'] = return_rate['Quantity'].abs() / total_sold
-        return_rate = return_rate.fillna(0)
+        return_rate['ReturnRate'] = return_rate['ReturnRate'].fillna(0)
         
-        return_rate['recommendation'] = return_rate['ReturnRate'].apply(
-            lambda x: 'Investigate quality issues.' if x > 0.1
-            else 'Monitor returns.' if x > 0.02
-            else 'Low returns; maintain quality.'
+        return_rate['recommendation'] = assign_labels(
+            return_rate['ReturnRate'], RETURN_RATE_TIERS, RETURN_RATE_DEFAULT
         )
         
-        return return_rate.to_dict(orient='records')
+        return records(return_rate)
     except Exception as e:
         logger.error(f"Error in product_return_rate: {e}")
         raise
@@ -118,24 +187,20 @@ def customer_activity_heatmap(df):
         if df.empty:
             raise ValueError("No valid data after cleaning InvoiceDate and InvoiceNo")
         
-        df['InvoiceDate'] = pd.to_datetime(df['InvoiceDate'], errors='coerce')
-        df = df.dropna(subset=['InvoiceDate'])
-        
-        df['Hour'] = df['InvoiceDate'].dt.hour.fillna(0).astype(int)
-        df['DayOfWeek'] = df['InvoiceDate'].dt.dayofweek.fillna(0).astype(int)
-        
-        activity_heatmap = df.groupby(['DayOfWeek', 'Hour'])['InvoiceNo'].nunique().unstack(fill_value=0)
+        activity_heatmap = df['InvoiceNo'].groupby([
+            date_key(df, 'DayOfWeek').rename('DayOfWeek'),
+            date_key(df, 'HourOfDay').rename('Hour')
+        ]).nunique().unstack(fill_value=0)
         
         activity_heatmap.columns = activity_heatmap.columns.astype(int)
         all_hours = pd.Index(range(24), name='Hour')
         activity_heatmap = activity_heatmap.reindex(columns=all_hours, fill_value=0)
         
-        activity_data = []
-        for day in activity_heatmap.index:
-            row_data = {'DayOfWeek': int(day)}
-            for hour in activity_heatmap.columns:
-                row_data[f"Hour_{int(hour)}"] = int(activity_heatmap.loc[day, hour])
-            activity_data.append(row_data)
+        hour_columns = [f"Hour_{int(hour)}" for hour in activity_heatmap.columns]
+        activity_data = [
+            {'DayOfWeek': int(day), **dict(zip(hour_columns, row))}
+            for day, row in zip(activity_heatmap.index.tolist(), activity_heatmap.astype('int64').values.tolist())
+        ]
         
         if not activity_heatmap.empty:
             hour_sums = activity_heatmap.sum()
@@ -161,76 +226,13 @@ def customer_activity_heatmap(df):
         logger.error(f"Error in customer_activity_heatmap: {e}")
         raise
 
-def retention_rate(df):
+def retention_rate(df, period=DEFAULT_COHORT_PERIOD, revenue=False):
     try:
         required_columns = ['InvoiceDate', 'CustomerID', 'InvoiceNo']
         if not all(col in df.columns for col in required_columns):
             raise ValueError(f"CSV file must contain the following columns: {', '.join(required_columns)}")
         
-        df['InvoiceDate'] = pd.to_datetime(df['InvoiceDate'], errors='coerce')
-        df = df.dropna(subset=['InvoiceDate'])
-        
-        df['YearMonth'] = df['InvoiceDate'].dt.strftime('%Y-%m')
-        cohort_data = df.groupby(['CustomerID', 'YearMonth'])['InvoiceNo'].nunique().reset_index()
-        
-        first_purchase = df.groupby('CustomerID')['InvoiceDate'].min().reset_index()
-        first_purchase['CohortMonth'] = first_purchase['InvoiceDate'].dt.strftime('%Y-%m')
-        
-        cohort_data = cohort_data.merge(first_purchase[['CustomerID', 'CohortMonth']], on='CustomerID')
-        
-        cohort_data['YearMonth_Year'] = pd.to_datetime(cohort_data['YearMonth']).dt.year
-        cohort_data['YearMonth_Month'] = pd.to_datetime(cohort_data['YearMonth']).dt.month
-        cohort_data['CohortMonth_Year'] = pd.to_datetime(cohort_data['CohortMonth']).dt.year
-        cohort_data['CohortMonth_Month'] = pd.to_datetime(cohort_data['CohortMonth']).dt.month
-        
-        cohort_data['YearMonth_Int'] = (cohort_data['YearMonth_Year'] * 12 + cohort_data['YearMonth_Month']).astype(int)
-        cohort_data['CohortMonth_Int'] = (cohort_data['CohortMonth_Year'] * 12 + cohort_data['CohortMonth_Month']).astype(int)
-        cohort_data['CohortIndex'] = (cohort_data['YearMonth_Int'] - cohort_data['CohortMonth_Int']).astype(int)
-        
-        retention_table = pd.pivot_table(
-            cohort_data,
-            values='CustomerID',
-            index='CohortMonth',
-            columns='CohortIndex',
-            aggfunc='nunique'
-        ).fillna(0)
-        
-        if retention_table.empty:
-            return {
-                "retention_data": [],
-                "recommendation": "Insufficient data for retention analysis."
-            }
-        
-        cohort_sizes = retention_table[0]
-        retention_rates = retention_table.div(cohort_sizes, axis=0).round(2)
-        
-        if retention_rates.shape[1] > 1:
-            avg_retention = retention_rates.iloc[:, 1:].mean().mean()
-        else:
-            avg_retention = 0
-        
-        if avg_retention < 0.3:
-            recommendation = 'Low retention rate of {:.1%}; focus on loyalty programs and customer engagement.'.format(avg_retention)
-        elif avg_retention < 0.6:
-            recommendation = 'Moderate retention rate of {:.1%}; enhance customer engagement with personalized offers.'.format(avg_retention)
-        else:
-            recommendation = 'High retention rate of {:.1%}; maintain current strategies and consider referral programs.'.format(avg_retention)
-        
-        retention_data = []
-        for cohort in retention_rates.index:
-            row = {'cohort': str(cohort)}
-            for i in retention_rates.columns:
-                if i in retention_rates.loc[cohort]:
-                    row[f'month_{i}'] = float(retention_rates.loc[cohort, i])
-                else:
-                    row[f'month_{i}'] = 0.0
-            retention_data.append(row)
-        
-        return {
-            "retention_data": retention_data,
-            "avg_retention": float(avg_retention),
-            "recommendation": recommendation
-        }
+        return cohort_retention(df, period, revenue)
     except Exception as e:
         logger.error(f"Error in retention_rate: {e}")
-        raise
\ No newline at end of file
+        raise
@@ -0,0 +1,316 @@
+import logging
+import threading
+import numpy as np
+import pandas as pd
+from analysis.rfm_analysis import rfm_from_aggregates
+from analysis.cohort_engine import cohort_counts, retention_summary
+from analysis.customer_analysis import clv_from_aggregates
+from analysis.cooccurrence_index import discard_cooccurrence_indexes
+from analysis.result_index import discard_result_indexes
+from analysis.revenue_cube import discard_revenue_cubes
+from utils.dataset_store import append_segment, dataset_version, load_segment
+from utils.date_keys import date_key, month_index
+from utils.file_handler import DATASET_ID_PATTERN, get_request_dataset_id, load_stored_dataset
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Activity keys pack (customer position, month index) into one int64
+MONTH_BITS = 16
+MONTH_MASK = (1 << MONTH_BITS) - 1
+
+CUSTOMER_COLUMNS = ['FirstPurchase', 'LastPurchase', 'Frequency', 'Monetary', 'LineCount']
+
+def hash_labels(series):
+    """Stable 64-bit hashes of a (possibly categorical) label column."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        category_hashes = pd.util.hash_array(series.cat.categories.astype(str).to_numpy(dtype=object))
+        return category_hashes[series.cat.codes.to_numpy()]
+    return pd.util.hash_array(series.astype(str).to_numpy(dtype=object))
+
+def hash_lines(df):
+    """
+    Stable 64-bit hashes of transaction lines: invoice, product, quantity, price, date
+    and customer. Numbers are hashed as float64, so the same line hashes alike whatever
+    compact dtype its batch was stored with.
+    """
+    lines = pd.DataFrame({
+        'InvoiceNo': hash_labels(df['InvoiceNo']),
+        'StockCode': hash_labels(df['StockCode']),
+        'Description': hash_labels(df['Description']),
+        'CustomerID': hash_labels(df['CustomerID']),
+        'Quantity': df['Quantity'].to_numpy(dtype=np.float64),
+        'UnitPrice': df['UnitPrice'].to_numpy(dtype=np.float64),
+        'InvoiceDate': df['InvoiceDate'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    })
+    return pd.util.hash_pandas_object(lines, index=False).to_numpy()
+
+def isin_sorted(sorted_values, values):
+    """Vectorized membership test of values against a sorted array."""
+    if len(sorted_values) == 0:
+        return np.zeros(len(values), dtype=bool)
+    positions = np.searchsorted(sorted_values, values).clip(max=len(sorted_values) - 1)
+    return sorted_values[positions] == values
+
+class KeySet:
+    """
+    Set of integer keys held as a few sorted runs. Added keys form a new run, merged
+    into the previous one while that is at most twice its size, so there are O(log n)
+    runs and each key is moved O(log n) times overall instead of on every insert.
+    Runs are never modified in place, so copies share them.
+    """
+
+    def __init__(self, dtype, runs=()):
+        self.dtype = dtype
+        self.runs = list(runs)
+
+    def __len__(self):
+        return sum(len(run) for run in self.runs)
+
+    def copy(self):
+        return KeySet(self.dtype, self.runs)
+
+    def contains(self, values):
+        found = np.zeros(len(values), dtype=bool)
+        for run in self.runs:
+            found |= isin_sorted(run, values)
+        return found
+
+    def add(self, values):
+        """Add keys, returning the (sorted, distinct) ones that were not present yet."""
+        values = np.unique(np.asarray(values, dtype=self.dtype))
+        values = values[~self.contains(values)]
+        if len(values):
+            self.runs.append(values)
+            while len(self.runs) > 1 and len(self.runs[-2]) <= 2 * len(self.runs[-1]):
+                last = self.runs.pop()
+                self.runs[-1] = np.union1d(self.runs[-1], last)
+        return values
+
+    def values(self):
+        if not self.runs:
+            return np.empty(0, dtype=self.dtype)
+        return np.sort(np.concatenate(self.runs))
+
+class CustomerState:
+    """
+    Per-customer aggregates for one version of a dataset that can absorb appended
+    transactions without revisiting the history.
+
+    customers holds first/last purchase, distinct invoice count, monetary sum and
+    line count per CustomerID. activity is the set of (customer, month) keys used for
+    cohort retention, invoices the hashes of every InvoiceNo seen (so a re-sent
+    invoice is not counted twice), lines the hashes of every transaction line (so a
+    re-sent line is dropped) and years the calendar years covered.
+    """
+
+    def __init__(self, customers=None, activity=None, invoices=None, lines=None, years=None, version=0):
+        if customers is None:
+            customers = pd.DataFrame({
+                'FirstPurchase': pd.Series(dtype='datetime64[ns]'),
+                'LastPurchase': pd.Series(dtype='datetime64[ns]'),
+                'Frequency': pd.Series(dtype=np.int64),
+                'Monetary': pd.Series(dtype=np.float64),
+                'LineCount': pd.Series(dtype=np.int64)
+            }, index=pd.Index([], dtype=object, name='CustomerID'))
+        self.customers = customers
+        self.activity = activity if activity is not None else KeySet(np.int64)
+        self.invoices = invoices if invoices is not None else KeySet(np.uint64)
+        self.lines = lines if lines is not None else KeySet(np.uint64)
+        self.years = years if years is not None else KeySet(np.int64)
+        self.version = version
+
+    def copy(self):
+        """A copy that can absorb a batch while readers keep using this state."""
+        return CustomerState(self.customers.copy(), self.activity.copy(), self.invoices.copy(),
+                             self.lines.copy(), self.years.copy(), self.version)
+
+    def append(self, df):
+        """
+        Merge a batch of cleaned transactions. Lines the state already holds are
+        dropped first, so a retried or overlapping batch is not counted twice; lines
+        repeated within the batch are kept, as they are in a full upload. Work is
+        proportional to the batch plus the number of customers, never to the number
+        of transactions merged before.
+
+        Returns:
+            Tuple of (dictionary describing what the batch changed, the rows merged)
+        """
+        line_hashes = hash_lines(df)
+        duplicate = self.lines.contains(line_hashes)
+        if duplicate.any():
+            df = df[~duplicate]
+            line_hashes = line_hashes[~duplicate]
+
+        customer_ids = df['CustomerID'].astype(str).to_numpy(dtype=object)
+        invoice_hashes = hash_labels(df['InvoiceNo'])
+
+        # Only invoices never seen before add to a customer's frequency
+        pairs = pd.DataFrame({'CustomerID': customer_ids, 'Invoice': invoice_hashes}).drop_duplicates('Invoice')
+        new_invoices = pairs[~self.invoices.contains(pairs['Invoice'].to_numpy())]
+
+        batch = pd.DataFrame({
+            'CustomerID': customer_ids,
+            'InvoiceDate': df['InvoiceDate'].to_numpy(),
+            'TotalPrice': df['TotalPrice'].to_numpy(dtype=np.float64)
+        }).groupby('CustomerID').agg(
+            FirstPurchase=('InvoiceDate', 'min'),
+            LastPurchase=('InvoiceDate', 'max'),
+            Monetary=('TotalPrice', 'sum'),
+            LineCount=('TotalPrice', 'size')
+        )
+        batch['Frequency'] = new_invoices.groupby('CustomerID').size().reindex(batch.index, fill_value=0)
+        batch = batch[CUSTOMER_COLUMNS]
+
+        positions = self.customers.index.get_indexer(batch.index)
+        existing = positions >= 0
+        if existing.any():
+            rows = positions[existing]
+            current = self.customers.iloc[rows]
+            update = batch[existing]
+            self.customers.iloc[rows, 0] = np.minimum(current['FirstPurchase'].to_numpy(), update['FirstPurchase'].to_numpy())
+            self.customers.iloc[rows, 1] = np.maximum(current['LastPurchase'].to_numpy(), update['LastPurchase'].to_numpy())
+            self.customers.iloc[rows, 2] = current['Frequency'].to_numpy() + update['Frequency'].to_numpy()
+            self.customers.iloc[rows, 3] = current['Monetary'].to_numpy() + update['Monetary'].to_numpy()
+            self.customers.iloc[rows, 4] = current['LineCount'].to_numpy() + update['LineCount'].to_numpy()
+        new_customers = batch[~existing]
+        if self.customers.empty:
+            self.customers = new_customers
+        elif not new_customers.empty:
+            self.customers = pd.concat([self.customers, new_customers])
+
+        customer_positions = self.customers.index.get_indexer(customer_ids).astype(np.int64)
+        months = date_key(df, 'MonthIndex').to_numpy(np.int64)
+        self.activity.add((customer_positions << MONTH_BITS) | months)
+        self.invoices.add(new_invoices['Invoice'].to_numpy(dtype=np.uint64))
+        self.lines.add(line_hashes)
+        self.years.add(df['InvoiceDate'].dt.year.to_numpy(np.int64))
+
+        return {
+            "rows_appended": int(len(df)),
+            "duplicate_rows": int(duplicate.sum()),
+            "new_invoices": int(len(new_invoices)),
+            "new_customers": int(len(new_customers)),
+            "updated_customers": int(existing.sum()),
+            "total_customers": int(len(self.customers))
+        }, df
+
+    def rfm(self):
+        """Re-derive RFM scores and segments from the stored aggregates."""
+        return rfm_from_aggregates(self.customers.sort_index())
+
+    def clv(self):
+        customers = self.customers.sort_index()
+        return clv_from_aggregates(
+            customers['Monetary'] / customers['LineCount'],
+            customers['Frequency'],
+            customers['LineCount'],
+            len(self.years)
+        )
+
+    def retention(self):
+        """Monthly customer retention from the (customer, month) activity keys."""
+        activity = self.activity.values()
+        cohorts, counts, _ = cohort_counts(
+            activity >> MONTH_BITS,
+            activity & MONTH_MASK,
+            first_periods=month_index(self.customers['FirstPurchase'])
+        )
+        return retention_summary(cohorts, counts)
+
+_states = {}
+_states_lock = threading.Lock()
+_dataset_locks = {}
+
+def _dataset_lock(dataset_id):
+    with _states_lock:
+        return _dataset_locks.setdefault(dataset_id, threading.Lock())
+
+def caught_up(dataset_id, state, version):
+    """
+    The customer state of a dataset at version: state (of an earlier version, or None)
+    with the batches appended since replayed, or built from the stored dataset.
+    """
+    if state is not None and state.version == version:
+        return state
+    if state is None or state.version > version:
+        logger.info(f"Building customer state for {dataset_id[:12]} (version {version})")
+        state = CustomerState()
+        state.append(load_stored_dataset(dataset_id, version))
+    else:
+        state = state.copy()
+        for segment in range(state.version + 1, version + 1):
+            state.append(load_segment(dataset_id, segment))
+    state.version = version
+    return state
+
+def get_customer_state(dataset_id):
+    """
+    Return the customer state of a dataset, or None if nothing was appended to it.
+    The persisted version is checked on every call, so batches appended by other
+    processes are replayed before the state is served.
+    """
+    if not DATASET_ID_PATTERN.fullmatch(str(dataset_id)):
+        raise ValueError(f"Invalid dataset_id: {dataset_id}")
+    version = dataset_version(dataset_id)
+    if version == 0:
+        return None
+    with _states_lock:
+        state = _states.get(dataset_id)
+    if state is not None and state.version == version:
+        return state
+    with _dataset_lock(dataset_id):
+        with _states_lock:
+            state = _states.get(dataset_id)
+        if state is None or state.version < version:
+            state = caught_up(dataset_id, state, version)
+            with _states_lock:
+                _states[dataset_id] = state
+    return state
+
+def customer_state_for_request(request):
+    """Customer state for a dataset_id request without a file upload, if one exists."""
+    if 'file' in request.files:
+        return None
+    dataset_id = get_request_dataset_id(request)
+    return get_customer_state(dataset_id) if dataset_id else None
+
+def append_transactions(dataset_id, df):
+    """
+    Merge a batch of cleaned transactions into a dataset: lines the dataset already
+    holds are dropped, and the rest are stored as a new segment of the dataset (read
+    by every analysis from then on) and merged into its customer state.
+
+    Returns:
+        Dictionary with the append summary and the refreshed segment counts
+    """
+    try:
+        if not DATASET_ID_PATTERN.fullmatch(str(dataset_id)):
+            raise ValueError(f"Invalid dataset_id: {dataset_id}")
+        with _dataset_lock(dataset_id):
+            with _states_lock:
+                state = _states.get(dataset_id)
+            # Build or catch up before taking the cross-process lock, which then only
+            # has to cover batches other processes appended meanwhile
+            state = caught_up(dataset_id, state, dataset_version(dataset_id))
+
+            def merge(version):
+                merged = caught_up(dataset_id, state, version).copy()
+                summary, rows = merged.append(df)
+                return rows, (merged, summary)
+
+            version, (state, summary) = append_segment(dataset_id, merge)
+            state.version = version
+            with _states_lock:
+                _states[dataset_id] = state
+        discard_result_indexes(dataset_id)
+        discard_revenue_cubes(dataset_id, version)
+        discard_cooccurrence_indexes(dataset_id, version)
+        segment_counts = state.rfm()['segment'].value_counts()
+        summary['segment_counts'] = {segment: int(count) for segment, count in segment_counts.items()}
+        summary['dataset_id'] = dataset_id
+        summary['version'] = version
+        return summary
+    except Exception as e:
+        logger.error(f"Error in append_transactions: {e}")
+        raise
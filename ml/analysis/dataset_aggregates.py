@@ -0,0 +1,95 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from analysis.rfm_analysis import rfm_from_aggregates
+from analysis.customer_analysis import (clv_from_aggregates, customer_attributes_from_aggregates,
+                                        top_customers_from_aggregates, top_products_from_aggregates)
+from analysis.sales_analysis import monthly_revenue_from_aggregates
+from utils.dataset_store import dataset_version, load_aggregate
+from utils.date_keys import month_labels
+from utils.file_handler import DATASET_ID_PATTERN, get_request_dataset_id
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Upper bound on the number of datasets whose aggregates are held in memory
+AGGREGATE_CACHE_MAX_ENTRIES = int(os.environ.get('AGGREGATE_CACHE_MAX_ENTRIES', 8))
+
+# Aggregates stored by utils.chunked_ingest for a chunk-ingested dataset
+AGGREGATE_NAMES = ('customers', 'months', 'products')
+
+class DatasetAggregates:
+    """
+    Per-customer, per-month and per-product aggregates of a chunk-ingested dataset,
+    from which its customer, monthly revenue and top product results are computed
+    without loading its rows.
+
+    customers holds first/last purchase, distinct invoice count, monetary sum, line
+    count and country per CustomerID, months the revenue per month index and products
+    the revenue per Description, each sorted by its index.
+    """
+
+    def __init__(self, customers, months, products):
+        self.customers = customers
+        self.months = months
+        self.products = products
+
+    def rfm(self):
+        return rfm_from_aggregates(self.customers)
+
+    def clv(self):
+        return clv_from_aggregates(
+            self.customers['Monetary'] / self.customers['LineCount'],
+            self.customers['Frequency'],
+            self.customers['LineCount'],
+            len(np.unique(self.months.index.to_numpy() // 12))
+        )
+
+    def monthly_revenue(self):
+        return monthly_revenue_from_aggregates(month_labels(self.months.index.to_numpy()), self.months['Revenue'].to_numpy())
+
+    def top_customers(self):
+        return top_customers_from_aggregates(self.customers['Monetary'])
+
+    def top_products(self):
+        return top_products_from_aggregates(self.products['Revenue'])
+
+    def customer_attributes(self, rfm):
+        return customer_attributes_from_aggregates(self.customers['Country'], rfm)
+
+_aggregates = OrderedDict()
+_aggregates_lock = threading.Lock()
+
+def get_dataset_aggregates(dataset_id):
+    """
+    Return the aggregates of a chunk-ingested dataset, or None if it has none or
+    transactions were appended to it since (they are not part of the aggregates).
+    """
+    if not DATASET_ID_PATTERN.fullmatch(str(dataset_id)):
+        raise ValueError(f"Invalid dataset_id: {dataset_id}")
+    if dataset_version(dataset_id) != 0:
+        return None
+    with _aggregates_lock:
+        aggregates = _aggregates.get(dataset_id)
+        if aggregates is not None:
+            _aggregates.move_to_end(dataset_id)
+            return aggregates
+    tables = [load_aggregate(dataset_id, name) for name in AGGREGATE_NAMES]
+    if any(table is None for table in tables):
+        return None
+    logger.info(f"Loaded aggregates of dataset {dataset_id[:12]} ({len(tables[0])} customers)")
+    aggregates = DatasetAggregates(*tables)
+    with _aggregates_lock:
+        _aggregates[dataset_id] = aggregates
+        while len(_aggregates) > AGGREGATE_CACHE_MAX_ENTRIES:
+            _aggregates.popitem(last=False)
+    return aggregates
+
+def aggregates_for_request(request):
+    """Dataset aggregates for a dataset_id request without a file upload, if they exist."""
+    if 'file' in request.files:
+        return None
+    dataset_id = get_request_dataset_id(request)
+    return get_dataset_aggregates(dataset_id) if dataset_id else None
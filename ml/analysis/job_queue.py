@@ -0,0 +1,248 @@
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import psutil
+from flask import Request
+from werkzeug.test import EnvironBuilder
+from analysis.pipeline import ANALYSES, run_analyses
+from utils.dataset_store import DATASET_STORE_FOLDER
+from utils.file_handler import DATASET_ID_PATTERN, load_stored_dataset
+from utils.serialization import dumps
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# SQLite file holding the job table, shared by every server process
+JOB_STORE_PATH = os.environ.get('JOB_STORE_PATH', os.path.join(DATASET_STORE_FOLDER, "jobs.sqlite"))
+
+# Folder holding the JSON result of each finished job
+JOB_RESULT_FOLDER = os.environ.get('JOB_RESULT_FOLDER', os.path.join(DATASET_STORE_FOLDER, "job_results"))
+os.makedirs(JOB_RESULT_FOLDER, exist_ok=True)
+
+# Worker processes running jobs; each job runs in its own process
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+
+# Start method of the worker processes. spawn avoids forking a multi-threaded server.
+JOB_START_METHOD = os.environ.get('JOB_START_METHOD', 'spawn')
+
+# Seconds a finished job and its result file are kept before being purged on a later
+# submission; 0 keeps them forever
+JOB_RESULT_TTL = float(os.environ.get('JOB_RESULT_TTL', 7 * 24 * 3600))
+
+FINISHED_STATUSES = ('succeeded', 'failed')
+
+JOB_COLUMNS = ['job_id', 'analyses', 'dataset_id', 'options', 'status', 'progress', 'stage', 'error',
+               'submitted_at', 'started_at', 'finished_at', 'owner_pid', 'worker_pid']
+
+_pool = None
+_pool_lock = threading.Lock()
+_active = set()
+_active_lock = threading.Lock()
+
+def _connect():
+    connection = sqlite3.connect(JOB_STORE_PATH, timeout=30)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, analyses TEXT NOT NULL, dataset_id TEXT NOT NULL, "
+        "options TEXT NOT NULL, status TEXT NOT NULL, progress REAL NOT NULL, stage TEXT, error TEXT, "
+        "submitted_at REAL NOT NULL, started_at REAL, finished_at REAL, owner_pid INTEGER, worker_pid INTEGER)"
+    )
+    return connection
+
+def _execute(sql, parameters=()):
+    connection = _connect()
+    try:
+        with connection:
+            return connection.execute(sql, parameters).fetchall()
+    finally:
+        connection.close()
+
+def job_result_path(job_id):
+    return os.path.join(JOB_RESULT_FOLDER, f"{job_id}.json")
+
+def update_job(job_id, **fields):
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    _execute(f"UPDATE jobs SET {assignments} WHERE job_id = ?", [*fields.values(), job_id])
+
+def purge_expired_jobs(ttl=JOB_RESULT_TTL):
+    """
+    Delete the jobs that finished more than ttl seconds ago, with their result files.
+
+    Returns:
+        Number of jobs purged
+    """
+    if ttl <= 0:
+        return 0
+    try:
+        cutoff = time.time() - ttl
+        connection = _connect()
+        try:
+            with connection:
+                job_ids = [row[0] for row in connection.execute(
+                    "SELECT job_id FROM jobs WHERE status IN (?, ?) AND finished_at < ?", (*FINISHED_STATUSES, cutoff)
+                ).fetchall()]
+                connection.executemany("DELETE FROM jobs WHERE job_id = ?", [(job_id,) for job_id in job_ids])
+        finally:
+            connection.close()
+        for job_id in job_ids:
+            path = job_result_path(job_id)
+            if os.path.exists(path):
+                os.remove(path)
+        if job_ids:
+            logger.info(f"Purged {len(job_ids)} jobs finished over {ttl:.0f}s ago")
+        return len(job_ids)
+    except Exception as e:
+        logger.error(f"Error in purge_expired_jobs: {e}")
+        raise
+
+def _fail_orphaned(job):
+    """
+    Mark a job failed when the process that should finish it is gone: a queued job
+    whose server exited, or a running job whose worker died.
+    """
+    pid = job['worker_pid'] if job['status'] == 'running' else job['owner_pid']
+    if job['status'] in FINISHED_STATUSES or pid is None or psutil.pid_exists(pid):
+        return job
+    error = "Worker process exited before finishing the job" if job['status'] == 'running' else "Server restarted before the job started"
+    update_job(job['job_id'], status='failed', error=error, finished_at=time.time())
+    return dict(job, status='failed', error=error)
+
+def get_job(job_id):
+    """Return a job as a dictionary, or None if there is no job with that ID."""
+    rows = _execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE job_id = ?", (str(job_id),))
+    if not rows:
+        return None
+    job = dict(zip(JOB_COLUMNS, rows[0]))
+    job['analyses'] = json.loads(job['analyses'])
+    job['options'] = json.loads(job['options'])
+    return _fail_orphaned(job)
+
+def job_status(job):
+    """Public view of a job: everything but the process IDs."""
+    return {name: value for name, value in job.items() if name not in ('owner_pid', 'worker_pid')}
+
+def job_options(request):
+    """
+    Analyses and options of a job submission. The analyses come from a list or a
+    comma-separated string; the other request values, and an 'options' object in a
+    JSON body, are passed on to the analyses.
+    """
+    payload = request.get_json(silent=True) or {}
+    names = payload.get('analyses') or request.values.get('analyses') or []
+    if isinstance(names, str):
+        names = [name.strip() for name in names.split(',') if name.strip()]
+    options = {name: value for name, value in request.values.items() if name not in ('analyses', 'dataset_id')}
+    options.update(payload.get('options') or {})
+    return names, options
+
+def job_request(options):
+    """A request carrying the job's options as form fields, read by the analyses as usual."""
+    return EnvironBuilder(method='POST', data={name: str(value) for name, value in options.items()}).get_request(Request)
+
+def run_job(job_id):
+    """
+    Run a job in the current (worker) process: load the stored dataset, run its
+    analyses with progress updates and write the result file.
+    """
+    job = get_job(job_id)
+    update_job(job_id, status='running', stage='loading dataset', started_at=time.time(), worker_pid=os.getpid())
+    try:
+        df = load_stored_dataset(job['dataset_id'])
+
+        def progress(completed, total, name):
+            update_job(job_id, progress=round(completed / total, 4), stage=name)
+
+        result = run_analyses(df, job['analyses'], job_request(job['options']), job['dataset_id'], progress)
+        path = job_result_path(job_id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(dumps(result))
+        os.replace(tmp_path, path)
+        update_job(job_id, status='succeeded', progress=1.0, stage=None, finished_at=time.time())
+    except Exception as e:
+        logger.error(f"Error in job {job_id}: {e}")
+        update_job(job_id, status='failed', error=str(e), finished_at=time.time())
+
+def get_job_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            context = multiprocessing.get_context(JOB_START_METHOD)
+            _pool = ProcessPoolExecutor(max_workers=JOB_WORKERS, mp_context=context)
+            logger.info(f"Started job pool with {JOB_WORKERS} workers")
+        return _pool
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def active_jobs():
+    """Number of jobs submitted by this process that have not finished."""
+    with _active_lock:
+        return len(_active)
+
+def _job_done(job_id):
+    def callback(future):
+        with _active_lock:
+            _active.discard(future)
+        # run_job records its own failures; this catches workers that crashed
+        if future.cancelled() or future.exception() is None:
+            return
+        logger.error(f"Job {job_id} worker failed: {future.exception()}")
+        if isinstance(future.exception(), BrokenProcessPool):
+            _reset_pool()
+        update_job(job_id, status='failed', error=str(future.exception()), finished_at=time.time())
+    return callback
+
+def submit_job(analyses, dataset_id, options=None):
+    """
+    Queue analyses of a stored dataset to run on the job pool, first purging the jobs
+    that finished more than JOB_RESULT_TTL seconds ago.
+
+    Args:
+        analyses: Analysis names (keys of analysis.pipeline.ANALYSES)
+        dataset_id: ID of the stored dataset
+        options: Request options passed to the analyses, e.g. {'backend': 'sklearn'}
+
+    Returns:
+        The queued job as returned by job_status
+    """
+    try:
+        if not DATASET_ID_PATTERN.fullmatch(str(dataset_id)):
+            raise ValueError(f"Invalid dataset_id: {dataset_id}")
+        analyses = list(analyses)
+        if not analyses:
+            raise ValueError("No analyses requested")
+        unknown = [name for name in analyses if name not in ANALYSES]
+        if unknown:
+            raise ValueError(f"Unknown analyses: {', '.join(unknown)}")
+
+        purge_expired_jobs()
+        job_id = uuid.uuid4().hex
+        _execute(
+            "INSERT INTO jobs (job_id, analyses, dataset_id, options, status, progress, submitted_at, owner_pid) "
+            "VALUES (?, ?, ?, ?, 'queued', 0, ?, ?)",
+            (job_id, json.dumps(analyses), dataset_id, json.dumps(options or {}), time.time(), os.getpid())
+        )
+        try:
+            future = get_job_pool().submit(run_job, job_id)
+        except BrokenProcessPool:
+            _reset_pool()
+            future = get_job_pool().submit(run_job, job_id)
+        with _active_lock:
+            _active.add(future)
+        future.add_done_callback(_job_done(job_id))
+        logger.info(f"Queued job {job_id} ({', '.join(analyses)}) for dataset {dataset_id[:12]}")
+        return job_status(get_job(job_id))
+    except Exception as e:
+        logger.error(f"Error in submit_job: {e}")
+        raise
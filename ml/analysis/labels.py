@@ -0,0 +1,68 @@
+import logging
+import numpy as np
+import pandas as pd
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Recommendation tier tables in the analysis modules are (comparison, threshold, label)
+# lists checked in order; values matching no tier get the table's *_DEFAULT label
+COMPARISONS = {
+    '>': np.greater,
+    '>=': np.greater_equal,
+    '<': np.less,
+    '<=': np.less_equal,
+}
+
+class Quantile:
+    """Threshold taken as a quantile of the values being labelled."""
+
+    def __init__(self, q):
+        self.q = q
+
+    def __repr__(self):
+        return f"Quantile({self.q})"
+
+def resolve_thresholds(values, tiers):
+    """
+    Turn the tier thresholds into numbers, computing every quantile threshold in a
+    single pass over the values.
+
+    Args:
+        values: Series of values being labelled
+        tiers: List of (comparison, threshold, label) tuples
+
+    Returns:
+        List of numeric thresholds aligned with tiers
+    """
+    quantiles = sorted({threshold.q for _, threshold, _ in tiers if isinstance(threshold, Quantile)})
+    resolved = dict(zip(quantiles, values.quantile(quantiles).tolist())) if quantiles else {}
+    return [resolved[threshold.q] if isinstance(threshold, Quantile) else threshold for _, threshold, _ in tiers]
+
+def assign_labels(values, tiers, default):
+    """
+    Label each value with the first tier whose condition it meets.
+
+    Tiers are checked in order, like an if/elif chain, so a value matching several
+    tiers gets the first one; values matching none (including NaN) get the default.
+
+    Args:
+        values: Series or array of numeric values
+        tiers: List of (comparison, threshold, label) tuples, where comparison is one of
+            '>', '>=', '<', '<=' and threshold is a number or a Quantile of the values
+        default: Label of values matching no tier
+
+    Returns:
+        Object array of labels aligned with values
+    """
+    try:
+        values = pd.Series(values) if not isinstance(values, pd.Series) else values
+        array = values.to_numpy(dtype=np.float64)
+        thresholds = resolve_thresholds(values, tiers)
+        conditions = [COMPARISONS[comparison](array, threshold) for (comparison, _, _), threshold in zip(tiers, thresholds)]
+        choices = np.array([label for _, _, label in tiers] + [default], dtype=object)
+        return choices[np.select(conditions, np.arange(len(tiers)), default=len(tiers))]
+    except Exception as e:
+        logger.error(f"Error in assign_labels: {e}")
+        raise
+
@@ -0,0 +1,490 @@
+import logging
+import time
+import pandas as pd
+from analysis.rfm_analysis import perform_rfm_analysis, marketing_recommendations
+from analysis.affinity_engine import affinity_options
+from analysis.cohort_engine import retention_options
+from analysis.cooccurrence_index import CooccurrenceIndex, cooccurrence_index, COOCCURRENCE_TOP_K
+from analysis.revenue_cube import RevenueCube, revenue_cube
+from analysis.result_index import ResultIndex, get_result_index, result_index
+from analysis.customer_state import get_customer_state
+from analysis.dataset_aggregates import get_dataset_aggregates
+from analysis.product_analysis import product_affinity_analysis, sentiment_analysis, sentiment_scores, inventory_turnover, discount_impact_analysis
+from analysis.sales_analysis import sales_drop_analysis, monthly_revenue_analysis, daily_revenue_analysis, seasonality_analysis
+from analysis.customer_analysis import calculate_clv, customer_attributes, top_customers_analysis, top_products_analysis, monthly_customer_acquisition, geographical_analysis, product_return_rate, customer_activity_heatmap, retention_rate
+from models.churn_model import CHURN_FEATURES
+from models.repurchase_model import REPURCHASE_FEATURES
+from models.estimators import DEFAULT_BACKEND
+from models.training import train_models
+from models.features import feature_cache
+from models.model_registry import model_registry, feature_spec_id
+from models.batch_scoring import recommendations, score_chunks, SCORING_CHUNK_ROWS
+from utils.dataset_store import dataset_key, loaded_key
+from utils.file_handler import DATASET_ID_PATTERN, get_request_dataset_id, load_dataset
+from utils.serialization import frame_payload, payload_orient, DEFAULT_ORIENT
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Shared intermediates: name -> function computing it from the context
+INTERMEDIATES = {
+    'rfm': lambda ctx: perform_rfm_analysis(ctx.df),
+    'affinity_rules': lambda ctx: product_affinity_analysis(ctx.df, **affinity_options(ctx.request)),
+    'cooccurrence_index': lambda ctx: cooccurrence_index(ctx.dataset_key, lambda: CooccurrenceIndex.build(ctx.df, ctx.get('rfm'))),
+    'revenue_cube': lambda ctx: revenue_cube(ctx.dataset_key, lambda: RevenueCube.build(ctx.df)),
+    'clv': lambda ctx: calculate_clv(ctx.df),
+    'customer_attributes': lambda ctx: customer_attributes(ctx.df, ctx.get('rfm')),
+}
+
+# Registered model kinds: name -> feature columns the model is trained and scored on
+MODELS = {
+    'churn': CHURN_FEATURES,
+    'repurchase': REPURCHASE_FEATURES,
+}
+
+class AnalysisContext:
+    """
+    Holds a cleaned dataset and lazily computes the intermediates shared between
+    analyses, so each one is built at most once per request.
+    """
+
+    def __init__(self, df, request=None, dataset_id=None):
+        self.df = df
+        self.request = request
+        self.dataset_id = dataset_id
+        self.intermediates = {}
+        self.models = {}
+        self.timings = {}
+
+    @property
+    def dataset_key(self):
+        """
+        Key the context's derived data is cached under: the dataset version its rows
+        were loaded at, or the current version while they are not loaded.
+        """
+        if self.dataset_id is None:
+            return None
+        if self.df is not None:
+            return loaded_key(self.df, self.dataset_id)
+        return dataset_key(self.dataset_id)
+
+    def get(self, name):
+        if name not in self.intermediates:
+            start = time.perf_counter()
+            self.intermediates[name] = INTERMEDIATES[name](self)
+            self.timings[name] = round(time.perf_counter() - start, 4)
+        return self.intermediates[name]
+
+def model_backend(ctx):
+    return ctx.request.values.get('backend', DEFAULT_BACKEND) if ctx.request is not None else DEFAULT_BACKEND
+
+def model_spec_id(kind, backend):
+    return feature_spec_id(MODELS[kind], {'backend': backend, 'random_state': 42, 'dtype': 'float32'})
+
+def train_artifacts(ctx, kinds, backend):
+    """Fit the given model kinds concurrently and package them as registry artifacts."""
+    results = train_models(ctx.get('rfm'), ctx.df, kinds, backend)
+    return {kind: dict(result, features=MODELS[kind]) for kind, result in results.items()}
+
+def fitted_models(ctx, kinds, retrain=False):
+    """
+    Fitted model artifacts of the given kinds for the context's dataset. Models are taken
+    from the registry when the dataset has an ID, so they are trained once per dataset,
+    feature spec and backend; retrain=True registers new versions instead. Models that
+    have to be fitted are trained concurrently.
+    """
+    unknown = [kind for kind in kinds if kind not in MODELS]
+    if unknown:
+        raise ValueError(f"Unknown models: {', '.join(unknown)}")
+    backend = model_backend(ctx)
+    version = ctx.request.values.get('model_version') if ctx.request is not None else None
+
+    artifacts = {}
+    missing = []
+    for kind in kinds:
+        if not retrain and kind in ctx.models:
+            artifacts[kind] = ctx.models[kind]
+        elif retrain or ctx.dataset_id is None:
+            missing.append(kind)
+        elif len(kinds) == 1:
+            # A single model goes through get_or_train so concurrent requests share one fit
+            artifacts[kind] = model_registry.get_or_train(
+                ctx.dataset_id, kind, model_spec_id(kind, backend),
+                lambda: train_artifacts(ctx, [kind], backend)[kind], version
+            )
+        else:
+            artifact = model_registry.load(ctx.dataset_id, kind, model_spec_id(kind, backend), version)
+            if artifact is None and version is not None:
+                raise ValueError(f"Unknown {kind} model version {version} for dataset {ctx.dataset_id}")
+            if artifact is None:
+                missing.append(kind)
+            else:
+                artifacts[kind] = artifact
+
+    if missing:
+        trained = train_artifacts(ctx, missing, backend)
+        for kind in missing:
+            if ctx.dataset_id is None:
+                artifacts[kind] = dict(trained[kind], version=None)
+            else:
+                artifacts[kind] = model_registry.register(ctx.dataset_id, kind, model_spec_id(kind, backend), trained[kind])
+
+    ctx.models.update(artifacts)
+    return artifacts
+
+def fitted_model(ctx, kind, retrain=False):
+    return fitted_models(ctx, [kind], retrain)[kind]
+
+def model_features(ctx, kind):
+    """
+    Customer IDs and float32 feature matrix a model kind is scored on, cached per
+    dataset so repeated inference requests skip building them.
+    """
+    return feature_cache.get_or_build(ctx.dataset_key, MODELS[kind], lambda: ctx.get('rfm'))
+
+def predict_proba(artifact, matrix):
+    return artifact['model'].predict_proba(artifact['scaler'].transform(matrix))[:, 1]
+
+def rfm_payload(rfm, orient=DEFAULT_ORIENT):
+    segment_data = {
+        segment: frame_payload(customers, orient)
+        for segment, customers in rfm.reset_index().groupby('segment', sort=True)
+    }
+    return {"segment_data": segment_data}
+
+def build_rfm_analysis(ctx):
+    return rfm_payload(ctx.get('rfm'), payload_orient(ctx.request))
+
+def build_train_model(ctx):
+    names = ctx.request.values.get('models', 'repurchase') if ctx.request is not None else 'repurchase'
+    kinds = [name.strip() for name in names.split(',') if name.strip()]
+    start = time.perf_counter()
+    artifacts = fitted_models(ctx, kinds, retrain=True)
+    wall_time = round(time.perf_counter() - start, 4)
+    # The top-level report describes the first requested model, as before
+    artifact = artifacts[kinds[0]]
+    return {
+        "confusion_matrix": artifact['confusion_matrix'].tolist(),
+        "classification_report": artifact['classification_report'],
+        "model_trained": True,
+        "model_version": artifact['version'],
+        "models": {
+            kind: {
+                "model_version": trained['version'],
+                "backend": trained['backend'],
+                "confusion_matrix": trained['confusion_matrix'].tolist(),
+                "classification_report": trained['classification_report'],
+                **trained['training']
+            }
+            for kind, trained in artifacts.items()
+        },
+        "wall_time_s": wall_time
+    }
+
+def predictions(ctx, kind, column):
+    """The model artifact of a kind and its probability and recommendation per customer."""
+    artifact = fitted_model(ctx, kind)
+    customer_ids, matrix = model_features(ctx, kind)
+    probabilities = predict_proba(artifact, matrix)
+    return artifact, pd.DataFrame({
+        'CustomerID': customer_ids,
+        column: probabilities,
+        'recommendation': recommendations(probabilities, kind)
+    })
+
+def model_report(artifact):
+    return {
+        "confusion_matrix": artifact['confusion_matrix'].tolist(),
+        "classification_report": artifact['classification_report']
+    }
+
+def build_churn_prediction(ctx):
+    artifact, churn = predictions(ctx, 'churn', 'Churn_Probability')
+    return {
+        **model_report(artifact),
+        "churn_predictions": frame_payload(churn, payload_orient(ctx.request))
+    }
+
+def build_repurchase_prediction(ctx):
+    _, repurchase = predictions(ctx, 'repurchase', 'Repurchase_Probability')
+    return {
+        "repurchase_predictions": frame_payload(repurchase, payload_orient(ctx.request))
+    }
+
+def build_marketing_recommendations(ctx):
+    segment_bundles = ctx.get('cooccurrence_index').segment_bundles(3)
+    recommendations = marketing_recommendations(ctx.get('rfm'), ctx.get('affinity_rules'), segment_bundles)
+    return {"marketing_recommendations": recommendations}
+
+# Analyses served by /analyze: name -> function building the same payload as the matching route
+ANALYSES = {
+    'rfm_analysis': build_rfm_analysis,
+    'train_model': build_train_model,
+    'churn_prediction': build_churn_prediction,
+    'repurchase_prediction': build_repurchase_prediction,
+    'customer_lifetime_value': lambda ctx: {"clv": frame_payload(ctx.get('clv'), payload_orient(ctx.request))},
+    'product_affinity': lambda ctx: {"affinity_rules": ctx.get('affinity_rules')},
+    'sentiment_analysis': lambda ctx: {"sentiment_summary": sentiment_analysis(ctx.df)},
+    'inventory_turnover': lambda ctx: {"inventory_turnover": inventory_turnover(ctx.df)},
+    'discount_impact': lambda ctx: {"discount_impact": discount_impact_analysis(ctx.df)},
+    'monthly_revenue': lambda ctx: {"monthly_revenue": monthly_revenue_analysis(ctx.df, ctx.get('revenue_cube'))},
+    'daily_revenue': lambda ctx: {"daily_revenue": daily_revenue_analysis(ctx.df, ctx.get('revenue_cube'))},
+    'top_customers': lambda ctx: {"top_customers": top_customers_analysis(ctx.df)},
+    'top_products': lambda ctx: {"top_products": top_products_analysis(ctx.df)},
+    'monthly_customer_acquisition': lambda ctx: {"monthly_acquisition": monthly_customer_acquisition(ctx.df)},
+    'geographical_analysis': lambda ctx: {"geographical_revenue": geographical_analysis(ctx.df, ctx.request, ctx.get('revenue_cube'))},
+    'product_return_rate': lambda ctx: {"product_return_rate": product_return_rate(ctx.df)},
+    'customer_activity_heatmap': lambda ctx: customer_activity_heatmap(ctx.df),
+    'seasonality_analysis': lambda ctx: {"seasonal_revenue": seasonality_analysis(ctx.df, ctx.get('revenue_cube'))},
+    'retention_rate': lambda ctx: retention_rate(ctx.df, **retention_options(ctx.request)),
+    'sales_drop_analysis': lambda ctx: {"sales_drop_factors": sales_drop_analysis(ctx.df)},
+    'marketing_recommendations': build_marketing_recommendations,
+}
+
+# Analyses scoring with a registered model: name -> model kind
+MODEL_ANALYSES = {
+    'churn_prediction': 'churn',
+    'repurchase_prediction': 'repurchase',
+}
+
+# Intermediates each analysis reads, resolved before the analysis is timed
+DEPENDENCIES = {
+    'rfm_analysis': ['rfm'],
+    'train_model': ['rfm'],
+    'churn_prediction': ['rfm'],
+    'repurchase_prediction': ['rfm'],
+    'product_affinity': ['affinity_rules'],
+    'marketing_recommendations': ['rfm', 'affinity_rules', 'cooccurrence_index'],
+    'monthly_revenue': ['revenue_cube'],
+    'daily_revenue': ['revenue_cube'],
+    'geographical_analysis': ['revenue_cube'],
+    'seasonality_analysis': ['revenue_cube'],
+}
+
+def run_analyses(df, names=None, request=None, dataset_id=None, progress=None):
+    """
+    Run several analyses over one dataset, computing each shared intermediate once.
+
+    Args:
+        df: Cleaned DataFrame
+        names: Analysis names to run (defaults to all of ANALYSES)
+        request: Flask request, for analyses that read query options
+        dataset_id: ID of the stored dataset, used to reuse its registered models
+        progress: Optional callback progress(completed, total, name) called before each
+            analysis and once all are done (with name None)
+
+    Returns:
+        Dictionary with per-analysis results, errors and timings in seconds
+    """
+    names = list(names) if names else list(ANALYSES)
+    unknown = [name for name in names if name not in ANALYSES]
+    if unknown:
+        raise ValueError(f"Unknown analyses: {', '.join(unknown)}")
+
+    ctx = AnalysisContext(df, request, dataset_id)
+    results, errors, timings = {}, {}, {}
+
+    # Resolve the models of the requested analyses together, so missing ones train concurrently
+    kinds = [kind for name, kind in MODEL_ANALYSES.items() if name in names]
+    if len(kinds) > 1:
+        try:
+            fitted_models(ctx, kinds)
+        except Exception as e:
+            logger.error(f"Error fitting models {', '.join(kinds)}: {e}")
+
+    for completed, name in enumerate(names):
+        if progress is not None:
+            progress(completed, len(names), name)
+        try:
+            for dependency in DEPENDENCIES.get(name, []):
+                ctx.get(dependency)
+            start = time.perf_counter()
+            results[name] = ANALYSES[name](ctx)
+            timings[name] = round(time.perf_counter() - start, 4)
+        except Exception as e:
+            logger.error(f"Error in analysis {name}: {e}")
+            errors[name] = str(e)
+    if progress is not None:
+        progress(len(names), len(names), None)
+
+    return {
+        "results": results,
+        "errors": errors,
+        "timings": timings,
+        "intermediate_timings": ctx.timings
+    }
+
+def run_analysis(df, name, request=None, dataset_id=None):
+    """Build the payload of a single analysis, raising on failure."""
+    ctx = AnalysisContext(df, request, dataset_id)
+    return ANALYSES[name](ctx)
+
+def batch_score(df, kind, request=None, dataset_id=None, chunk_rows=SCORING_CHUNK_ROWS):
+    """
+    Score every customer of a dataset with its registered model of the given kind.
+
+    The model and feature frame are resolved before returning, so errors surface to
+    the caller; scoring itself happens lazily, chunk by chunk, as the result is consumed.
+
+    Returns:
+        Generator of scored DataFrames (CustomerID, probability, recommendation)
+    """
+    if kind not in MODELS:
+        raise ValueError(f"Unknown model: {kind}")
+    ctx = AnalysisContext(df, request, dataset_id)
+    artifact = fitted_model(ctx, kind)
+    customer_ids, matrix = model_features(ctx, kind)
+    return score_chunks(artifact, matrix, customer_ids.astype(str).to_numpy(dtype=object), kind, chunk_rows)
+
+def find_bundles(df, dataset_id, product=None, segment=None, top_k=COOCCURRENCE_TOP_K):
+    """
+    Bundles that go with a product, or with the top products of an RFM segment, read
+    from the dataset's co-occurrence index (built on first use).
+    """
+    if (product is None) == (segment is None):
+        raise ValueError("Specify exactly one of product or segment")
+    ctx = AnalysisContext(df, dataset_id=dataset_id)
+    return bundles_from_index(ctx.get('cooccurrence_index'), product, segment, top_k)
+
+def bundles_from_index(index, product=None, segment=None, top_k=COOCCURRENCE_TOP_K):
+    if product is not None:
+        return {"product": product, "bundles": index.bundles_for_product(product, top_k)}
+    top_products, bundles = index.bundles_for_segment(segment, top_k)
+    return {"segment": segment, "top_products": top_products, "bundles": bundles}
+
+def with_customer_attributes(ctx, frame):
+    """
+    Add each customer's segment and country (where known) to a per-customer result, to
+    filter it by. The added columns are listed in frame.attrs['filter_columns'].
+    """
+    attributes = ctx.get('customer_attributes').reindex(frame['CustomerID'].astype(str).to_numpy())
+    added = [column for column in attributes.columns if column not in frame.columns]
+    for column in added:
+        frame[column] = attributes[column].to_numpy()
+    frame.attrs['filter_columns'] = added
+    return frame
+
+def churn_rows(ctx):
+    artifact, churn = predictions(ctx, 'churn', 'Churn_Probability')
+    return with_customer_attributes(ctx, churn), model_report(artifact)
+
+def repurchase_rows(ctx):
+    _, repurchase = predictions(ctx, 'repurchase', 'Repurchase_Probability')
+    return with_customer_attributes(ctx, repurchase), {}
+
+# Per-row results served in pages: name -> (payload key of the rows, default sort
+# column, function returning the rows and the payload fields sent with every page)
+PAGED_RESULTS = {
+    'rfm_analysis': ('customers', 'Monetary', lambda ctx: (with_customer_attributes(ctx, ctx.get('rfm').reset_index()), {})),
+    'customer_lifetime_value': ('clv', 'CLV', lambda ctx: (with_customer_attributes(ctx, ctx.get('clv').copy()), {})),
+    'churn_prediction': ('churn_predictions', 'Churn_Probability', churn_rows),
+    'repurchase_prediction': ('repurchase_predictions', 'Repurchase_Probability', repurchase_rows),
+    'sentiment_analysis': ('sentiment_summary', 'Sentiment', lambda ctx: (sentiment_scores(ctx.df), {})),
+}
+
+# Paged results that follow a dataset's appended customer state or chunked-ingest
+# aggregates, as their routes do
+CUSTOMER_STATE_RESULTS = ('rfm_analysis', 'customer_lifetime_value')
+
+def build_result_index(ctx, name):
+    _, default_sort, build_rows = PAGED_RESULTS[name]
+    rows, extra = build_rows(ctx)
+    return ResultIndex(rows, default_sort, extra)
+
+def use_customer_state(ctx, state):
+    """Serve the customer results from appended customer aggregates instead of the rows."""
+    rfm = state.rfm()
+    ctx.intermediates['rfm'] = rfm
+    ctx.intermediates['clv'] = state.clv()
+    ctx.intermediates['customer_attributes'] = pd.DataFrame({'segment': rfm['segment'].to_numpy()}, index=rfm.index.astype(str))
+
+def use_dataset_aggregates(ctx, aggregates):
+    """Serve the customer results from a chunk-ingested dataset's aggregates instead of the rows."""
+    rfm = aggregates.rfm()
+    ctx.intermediates['rfm'] = rfm
+    ctx.intermediates['clv'] = aggregates.clv()
+    ctx.intermediates['customer_attributes'] = aggregates.customer_attributes(rfm)
+
+def result_key(ctx, name):
+    """
+    Cache key of a paged result, starting with the dataset key. Model results are
+    keyed by the model version they are scored with; before the rows are loaded, a
+    model that was never trained has no key yet (None).
+    """
+    kind = MODEL_ANALYSES.get(name)
+    if kind is None:
+        return (ctx.dataset_key, name)
+    spec_id = model_spec_id(kind, model_backend(ctx))
+    if ctx.df is None:
+        artifact = model_registry.load(ctx.dataset_id, kind, spec_id, ctx.request.values.get('model_version'))
+        if artifact is None:
+            return None
+    else:
+        artifact = fitted_model(ctx, kind)
+    return (ctx.dataset_key, name, spec_id, artifact['version'])
+
+def result_index_for_request(request, name):
+    """
+    The cached result index of a per-row result. A stored dataset whose index is
+    cached is answered without loading its rows; otherwise the result is computed
+    once and indexed.
+    """
+    dataset_id = get_request_dataset_id(request) if 'file' not in request.files else None
+    ctx = AnalysisContext(None, request, dataset_id)
+    index = None
+    if dataset_id is not None and DATASET_ID_PATTERN.fullmatch(str(dataset_id)):
+        key = result_key(ctx, name)
+        index = get_result_index(key) if key is not None else None
+        if index is None and name in CUSTOMER_STATE_RESULTS:
+            state = get_customer_state(dataset_id)
+            aggregates = get_dataset_aggregates(dataset_id) if state is None else None
+            if state is not None:
+                use_customer_state(ctx, state)
+            elif aggregates is not None:
+                use_dataset_aggregates(ctx, aggregates)
+            if state is not None or aggregates is not None:
+                index = result_index(key, lambda: build_result_index(ctx, name))
+    if index is None:
+        ctx.dataset_id, ctx.df = load_dataset(request)
+        index = result_index(result_key(ctx, name), lambda: build_result_index(ctx, name))
+    return index
+
+def result_page(request, name, options):
+    """
+    One page of a per-row result, served from the dataset's result index as a binary
+    search and a slice of a pre-sorted view.
+
+    Args:
+        request: Flask request
+        name: Key of PAGED_RESULTS
+        options: Paging options from result_index.page_options
+
+    Returns:
+        Dictionary with the page's rows under the result's usual key, a page
+        description, and the fields sent with every page
+    """
+    try:
+        index = result_index_for_request(request, name)
+        rows, page = index.page(**options)
+        return {**index.extra, PAGED_RESULTS[name][0]: frame_payload(rows, payload_orient(request)), "page": page}
+    except Exception as e:
+        logger.error(f"Error in result_page: {e}")
+        raise
+
+def result_stream(request, name, options=None):
+    """
+    Every row of a per-row result, for streaming, in chunks read from the result
+    index. The sort, order and filters of options apply; paging does not.
+
+    Returns:
+        Tuple of (payload fields sent before the rows, payload key of the rows,
+        generator of DataFrames)
+    """
+    try:
+        index = result_index_for_request(request, name)
+        options = options or {}
+        chunks = index.chunks(options.get('sort'), options.get('order', 'desc'), options.get('filters', ()))
+        return index.extra, PAGED_RESULTS[name][0], chunks
+    except Exception as e:
+        logger.error(f"Error in result_stream: {e}")
+        raise
@@ -0,0 +1,236 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from utils.dataset_store import key_dataset_id
+from utils.file_handler import get_request_value
+from utils.serialization import STREAM_CHUNK_ROWS
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Number of result indexes kept in memory, and of sorted/filtered views kept per index
+RESULT_INDEX_CACHE_MAX_ENTRIES = int(os.environ.get('RESULT_INDEX_CACHE_MAX_ENTRIES', 16))
+RESULT_VIEW_CACHE_MAX_ENTRIES = int(os.environ.get('RESULT_VIEW_CACHE_MAX_ENTRIES', 32))
+
+# Page size used when none is requested, and the largest one served
+DEFAULT_PAGE_LIMIT = int(os.environ.get('RESULT_PAGE_LIMIT', 100))
+MAX_PAGE_LIMIT = int(os.environ.get('RESULT_PAGE_MAX_LIMIT', 5000))
+
+# Request filters: parameter -> result column it matches
+FILTERS = {
+    'segment': 'segment',
+    'country': 'Country',
+}
+
+SORT_ORDERS = ('asc', 'desc')
+
+# Request parameters that switch a result endpoint to paged responses
+PAGE_PARAMETERS = ('limit', 'offset', 'cursor', 'sort') + tuple(FILTERS)
+
+def sort_keys(values):
+    """Integer or float keys ordering a column; labels are ranked by their sorted codes."""
+    if values.dtype.kind in 'biuf':
+        return values.to_numpy(dtype=np.float64)
+    codes, _ = pd.factorize(values.astype(str), sort=True)
+    return codes.astype(np.float64)
+
+class ResultIndex:
+    """
+    One row per customer or product of an analysis result, with sorted views over it.
+
+    A view is the row positions of the rows matching a filter, in the order of a sort
+    column; each (sort, order, filters) view is built once with a stable argsort and
+    kept, so later pages are slices of it. NaN sorts last in either order. Cursors are
+    the position of the last row served, so the next page is found by binary search
+    on the view's ranks instead of scanning the rows before it. Columns added only for
+    filtering (frame.attrs['filter_columns']) can be filtered and sorted on but are not
+    part of the rows served, which keep the columns of the regular response.
+    """
+
+    def __init__(self, frame, default_sort, extra=None):
+        filter_columns = frame.attrs.get('filter_columns', ())
+        self.columns = [column for column in frame.columns if column not in filter_columns]
+        self.frame = frame.reset_index(drop=True)
+        self.default_sort = default_sort
+        self.extra = extra or {}
+        self._orders = {}
+        self._views = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.frame)
+
+    def order(self, sort, descending):
+        """Row positions sorted by a column, with the rank of each row in that order."""
+        key = (sort, descending)
+        if key not in self._orders:
+            values = sort_keys(self.frame[sort])
+            order = np.argsort(-values if descending else values, kind='stable')
+            ranks = np.empty(len(order), dtype=np.int64)
+            ranks[order] = np.arange(len(order))
+            self._orders[key] = (order, ranks)
+        return self._orders[key]
+
+    def rows(self, positions):
+        return self.frame.iloc[positions][self.columns]
+
+    def filter_mask(self, filters):
+        mask = np.ones(len(self.frame), dtype=bool)
+        for column, values in filters:
+            if column not in self.frame.columns:
+                raise ValueError(f"This result cannot be filtered by {column}")
+            mask &= self.frame[column].astype(str).isin(values).to_numpy()
+        return mask
+
+    def view(self, sort, descending, filters):
+        """Sorted row positions matching the filters and their ranks in the full order."""
+        key = (sort, descending, filters)
+        with self._lock:
+            view = self._views.get(key)
+            if view is not None:
+                self._views.move_to_end(key)
+                return view
+            order, ranks = self.order(sort, descending)
+            if filters:
+                order = order[self.filter_mask(filters)[order]]
+            view = (order, ranks[order])
+            self._views[key] = view
+            while len(self._views) > RESULT_VIEW_CACHE_MAX_ENTRIES:
+                self._views.popitem(last=False)
+            return view
+
+    def page(self, sort=None, order='desc', offset=0, cursor=None, limit=DEFAULT_PAGE_LIMIT, filters=()):
+        """
+        One page of rows.
+
+        Args:
+            sort: Column to sort by (the index's default sort when None)
+            order: 'asc' or 'desc'
+            offset: Number of matching rows to skip, when no cursor is given
+            cursor: next_cursor of the previous page; the page starts after that row
+            limit: Maximum number of rows
+            filters: Tuple of (column, tuple of accepted values)
+
+        Returns:
+            Tuple of (DataFrame of the page's rows, page description)
+        """
+        try:
+            sort = sort or self.default_sort
+            if sort not in self.frame.columns:
+                raise ValueError(f"Cannot sort by {sort}; expected one of {', '.join(map(str, self.frame.columns))}")
+            positions, ranks = self.view(sort, order == 'desc', filters)
+
+            if cursor is not None:
+                row = int(cursor)
+                if not 0 <= row < len(self.frame):
+                    raise ValueError(f"Invalid cursor: {cursor}")
+                full_ranks = self.order(sort, order == 'desc')[1]
+                offset = int(np.searchsorted(ranks, full_ranks[row], side='right'))
+            rows = positions[offset:offset + limit]
+            end = offset + len(rows)
+
+            return self.rows(rows), {
+                "total": int(len(positions)),
+                "offset": int(offset),
+                "limit": int(limit),
+                "sort": sort,
+                "order": order,
+                "next_cursor": str(int(rows[-1])) if end < len(positions) else None
+            }
+        except Exception as e:
+            logger.error(f"Error in page: {e}")
+            raise
+
+    def chunks(self, sort=None, order='desc', filters=(), chunk_rows=STREAM_CHUNK_ROWS):
+        """
+        Every matching row, as DataFrames of at most chunk_rows rows. Rows come in
+        their original order unless a sort or filter is given; paging options are
+        ignored.
+        """
+        if sort is None and not filters:
+            positions = np.arange(len(self.frame))
+        else:
+            sort = sort or self.default_sort
+            if sort not in self.frame.columns:
+                raise ValueError(f"Cannot sort by {sort}; expected one of {', '.join(map(str, self.frame.columns))}")
+            positions = self.view(sort, order == 'desc', filters)[0]
+        return (self.rows(positions[start:start + chunk_rows]) for start in range(0, len(positions), chunk_rows))
+
+def page_options(request):
+    """
+    Paging options from the request values, or None when the request asks for the
+    whole result: limit, offset or cursor, sort and order, and comma-separated
+    segment and country filters.
+    """
+    if not any(get_request_value(request, name) is not None for name in PAGE_PARAMETERS):
+        return None
+    limit = int(get_request_value(request, 'limit', DEFAULT_PAGE_LIMIT))
+    offset = int(get_request_value(request, 'offset', 0))
+    if not 0 < limit <= MAX_PAGE_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_LIMIT}")
+    if offset < 0:
+        raise ValueError("offset must not be negative")
+    order = str(get_request_value(request, 'order', 'desc')).lower()
+    if order not in SORT_ORDERS:
+        raise ValueError(f"order must be one of: {', '.join(SORT_ORDERS)}")
+
+    filters = []
+    for name, column in FILTERS.items():
+        values = get_request_value(request, name)
+        if isinstance(values, str):
+            values = [value.strip() for value in values.split(',') if value.strip()]
+        if values:
+            filters.append((column, tuple(sorted(str(value) for value in values))))
+    return {
+        'sort': get_request_value(request, 'sort'),
+        'order': order,
+        'offset': offset,
+        'cursor': get_request_value(request, 'cursor'),
+        'limit': limit,
+        'filters': tuple(filters)
+    }
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+def _cache(key, index):
+    with _indexes_lock:
+        _indexes[key] = index
+        _indexes.move_to_end(key)
+        while len(_indexes) > RESULT_INDEX_CACHE_MAX_ENTRIES:
+            _indexes.popitem(last=False)
+
+def get_result_index(key):
+    """Return a cached result index, or None if it is not in memory."""
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+        return index
+
+def result_index(key, builder):
+    """
+    Return the result index cached under key, calling builder() to build it the first
+    time. Keys start with the dataset key; without one the index is built for the
+    request only.
+    """
+    try:
+        if key[0] is None:
+            return builder()
+        index = get_result_index(key)
+        if index is None:
+            index = builder()
+            _cache(key, index)
+        return index
+    except Exception as e:
+        logger.error(f"Error in result_index: {e}")
+        raise
+
+def discard_result_indexes(dataset_id):
+    """Drop the cached indexes of every version of a dataset whose rows changed."""
+    with _indexes_lock:
+        for key in [key for key in _indexes if key_dataset_id(key[0]) == dataset_id]:
+            del _indexes[key]
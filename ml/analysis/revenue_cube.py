@@ -0,0 +1,328 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from utils.dataset_store import DATASET_STORE_FOLDER, dataset_key, key_dataset_id, loaded_key
+from utils.date_keys import WEEK_EPOCH, month_label, quarter_label, week_label
+from utils.file_handler import DATASET_ID_PATTERN, get_request_dataset_id, get_request_value, load_dataset
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Column holding a product category, when the upload has one; otherwise every product
+# falls in a single category
+CATEGORY_COLUMN = os.environ.get('REVENUE_CUBE_CATEGORY_COLUMN', 'Category')
+DEFAULT_CATEGORY = 'All products'
+
+# Number of loaded cubes kept in memory
+REVENUE_CUBE_CACHE_MAX_ENTRIES = int(os.environ.get('REVENUE_CUBE_CACHE_MAX_ENTRIES', 8))
+
+CUBE_ARRAYS = ['days', 'countries', 'categories', 'revenue', 'quantity', 'lines', 'country_labels',
+               'category_labels', 'customer_cells', 'customer_ids', 'order_cells', 'order_ids']
+
+MEASURES = ['revenue', 'quantity', 'lines', 'orders', 'customers']
+
+# Offset between days since 1970-01-01 and the Monday-based week index of utils.date_keys
+WEEK_DAY_OFFSET = (pd.Timestamp('1970-01-01') - WEEK_EPOCH).days
+
+def cube_path(key):
+    return os.path.join(DATASET_STORE_FOLDER, f"{key}.revenue_cube.npz")
+
+def day_number(value):
+    """Days since 1970-01-01 of a date string or timestamp."""
+    return int((pd.Timestamp(value).normalize() - pd.Timestamp('1970-01-01')).days)
+
+def day_label(day):
+    return str(np.datetime64(int(day), 'D'))
+
+def month_numbers(days):
+    """Month index (year * 12 + month - 1) of each day number."""
+    return days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64) + 1970 * 12
+
+def day_of_month(days):
+    month_starts = days.astype('datetime64[D]').astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)
+    return days - month_starts + 1
+
+# Roll-up dimensions: name -> function returning (integer key of each cell, function
+# labelling a key). Calendar keys are derived from the cell's day.
+DIMENSIONS = {
+    'day': lambda cube: (cube.days, day_label),
+    'week': lambda cube: ((cube.days + WEEK_DAY_OFFSET) // 7, week_label),
+    'month': lambda cube: (month_numbers(cube.days), month_label),
+    'quarter': lambda cube: (month_numbers(cube.days) // 3, quarter_label),
+    'year': lambda cube: (month_numbers(cube.days) // 12, int),
+    'month_of_year': lambda cube: (month_numbers(cube.days) % 12 + 1, int),
+    'day_of_month': lambda cube: (day_of_month(cube.days), int),
+    'day_of_week': lambda cube: ((cube.days + WEEK_DAY_OFFSET) % 7, int),
+    'country': lambda cube: (cube.countries.astype(np.int64), lambda code: str(cube.country_labels[code])),
+    'category': lambda cube: (cube.categories.astype(np.int64), lambda code: str(cube.category_labels[code])),
+}
+
+def distinct_pairs(cells, ids):
+    """Distinct (cell, id) pairs sorted by cell, ignoring missing ids (code -1)."""
+    valid = ids >= 0
+    cells, ids = cells[valid].astype(np.int64), ids[valid].astype(np.int64)
+    if len(ids) == 0:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+    n_ids = int(ids.max()) + 1
+    pairs = np.unique(cells * n_ids + ids)
+    return (pairs // n_ids).astype(np.int32), (pairs % n_ids).astype(np.int32)
+
+def distinct_counts(cells, ids, group_of_cell, n_groups):
+    """Distinct ids per group from (cell, id) pairs; an id seen in several cells of a group counts once."""
+    groups = group_of_cell[cells]
+    valid = groups >= 0
+    if not valid.any():
+        return np.zeros(n_groups, dtype=np.int64)
+    ids = ids[valid].astype(np.int64)
+    n_ids = int(ids.max()) + 1
+    pairs = np.unique(groups[valid] * n_ids + ids)
+    return np.bincount(pairs // n_ids, minlength=n_groups)
+
+class RevenueCube:
+    """
+    Revenue of one dataset pre-aggregated by day x country x product category.
+
+    Each cell holds summed revenue, quantity and transaction lines. Distinct customers
+    and orders are not additive across cells, so the cube keeps the distinct (cell,
+    customer) and (cell, invoice) pairs as exact distinct-count sketches; rolling up
+    counts each customer or order once per group.
+    """
+
+    def __init__(self, days, countries, categories, revenue, quantity, lines, country_labels,
+                 category_labels, customer_cells, customer_ids, order_cells, order_ids):
+        self.days = days
+        self.countries = countries
+        self.categories = categories
+        self.revenue = revenue
+        self.quantity = quantity
+        self.lines = lines
+        self.country_labels = country_labels
+        self.category_labels = category_labels
+        self.customer_cells = customer_cells
+        self.customer_ids = customer_ids
+        self.order_cells = order_cells
+        self.order_ids = order_ids
+
+    @classmethod
+    def build(cls, df):
+        """
+        Build the cube from cleaned transactions.
+
+        Args:
+            df: Cleaned DataFrame
+        """
+        try:
+            days = df['InvoiceDate'].to_numpy().astype('datetime64[D]').astype(np.int64)
+            countries = df['Country'].astype('category')
+            if CATEGORY_COLUMN in df.columns:
+                categories = df[CATEGORY_COLUMN].astype('category')
+            else:
+                categories = pd.Series(pd.Categorical.from_codes(np.zeros(len(df), dtype=np.int8), [DEFAULT_CATEGORY]), index=df.index)
+
+            grouped = pd.DataFrame({
+                'day': days,
+                'country': countries.cat.codes.to_numpy(),
+                'category': categories.cat.codes.to_numpy(),
+                'TotalPrice': df['TotalPrice'].to_numpy(),
+                'Quantity': df['Quantity'].to_numpy()
+            }).groupby(['day', 'country', 'category'], sort=True)
+            cells = grouped.agg(
+                revenue=('TotalPrice', 'sum'),
+                quantity=('Quantity', 'sum'),
+                lines=('TotalPrice', 'size')
+            )
+            cell_of_row = grouped.ngroup().to_numpy()
+
+            customer_cells, customer_ids = distinct_pairs(cell_of_row, df['CustomerID'].astype('category').cat.codes.to_numpy())
+            order_cells, order_ids = distinct_pairs(cell_of_row, df['InvoiceNo'].astype('category').cat.codes.to_numpy())
+
+            logger.info(f"Built revenue cube: {len(cells)} cells from {len(df)} rows")
+            return cls(
+                days=cells.index.get_level_values('day').to_numpy(dtype=np.int32),
+                countries=cells.index.get_level_values('country').to_numpy(dtype=np.int32),
+                categories=cells.index.get_level_values('category').to_numpy(dtype=np.int32),
+                revenue=cells['revenue'].to_numpy(dtype=np.float64),
+                quantity=cells['quantity'].to_numpy(dtype=np.int64 if pd.api.types.is_integer_dtype(df['Quantity']) else np.float64),
+                lines=cells['lines'].to_numpy(dtype=np.int64),
+                country_labels=np.asarray(countries.cat.categories, dtype=str),
+                category_labels=np.asarray(categories.cat.categories, dtype=str),
+                customer_cells=customer_cells,
+                customer_ids=customer_ids,
+                order_cells=order_cells,
+                order_ids=order_ids
+            )
+        except Exception as e:
+            logger.error(f"Error in RevenueCube.build: {e}")
+            raise
+
+    def cell_mask(self, start=None, end=None, countries=None):
+        """Cells within an inclusive date range and a set of countries."""
+        mask = np.ones(len(self.days), dtype=bool)
+        if start is not None:
+            mask &= self.days >= day_number(start)
+        if end is not None:
+            mask &= self.days <= day_number(end)
+        if countries:
+            known = set(self.country_labels.tolist())
+            unknown = [country for country in countries if country not in known]
+            if unknown:
+                raise ValueError(f"Unknown countries: {', '.join(unknown)}")
+            codes = np.flatnonzero(np.isin(self.country_labels, countries))
+            mask &= np.isin(self.countries, codes)
+        return mask
+
+    def rollup(self, by, start=None, end=None, countries=None):
+        """
+        Aggregate the cube to the given dimensions.
+
+        Args:
+            by: Dimension names (keys of DIMENSIONS), e.g. ['month', 'country']; an
+                empty list gives the grand total
+            start: Optional first day included (date string or timestamp)
+            end: Optional last day included
+            countries: Optional list of countries included
+
+        Returns:
+            DataFrame with one row per group, ordered by the dimension keys, holding the
+            dimension labels and the measures revenue, quantity, lines, orders and
+            customers
+        """
+        try:
+            unknown = [name for name in by if name not in DIMENSIONS]
+            if unknown:
+                raise ValueError(f"Unknown dimensions: {', '.join(unknown)}; use {', '.join(DIMENSIONS)}")
+            if len(set(by)) != len(by):
+                raise ValueError("Each dimension can only be used once")
+
+            mask = self.cell_mask(start, end, countries)
+            dimensions = [DIMENSIONS[name](self) for name in by]
+            # Cells without a country or category label do not belong to any group of that dimension
+            for name, (keys, _) in zip(by, dimensions):
+                if name in ('country', 'category'):
+                    mask &= keys >= 0
+
+            keys = pd.DataFrame({name: dimension_keys[mask] for name, (dimension_keys, _) in zip(by, dimensions)})
+            measures = pd.DataFrame({
+                'revenue': self.revenue[mask],
+                'quantity': self.quantity[mask],
+                'lines': self.lines[mask]
+            })
+            if by:
+                grouped = measures.groupby([keys[name] for name in by], sort=True)
+                result = grouped.sum()
+                group_of_cell = np.full(len(self.days), -1, dtype=np.int64)
+                group_of_cell[mask] = grouped.ngroup().to_numpy()
+            else:
+                result = pd.DataFrame({name: [values.sum()] for name, values in measures.items()})
+                group_of_cell = np.where(mask, 0, -1)
+
+            result['orders'] = distinct_counts(self.order_cells, self.order_ids, group_of_cell, len(result))
+            result['customers'] = distinct_counts(self.customer_cells, self.customer_ids, group_of_cell, len(result))
+
+            result = result.reset_index(drop=not by)
+            for name, (_, label) in zip(by, dimensions):
+                result[name] = [label(key) for key in result[name].tolist()]
+            return result[list(by) + MEASURES]
+        except Exception as e:
+            logger.error(f"Error in RevenueCube.rollup: {e}")
+            raise
+
+    def save(self, key):
+        path = cube_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, **{name: getattr(self, name) for name in CUBE_ARRAYS})
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, key):
+        path = cube_path(key)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as arrays:
+            return cls(**{name: arrays[name] for name in CUBE_ARRAYS})
+
+_cubes = OrderedDict()
+_cubes_lock = threading.Lock()
+
+def _cache(key, cube):
+    with _cubes_lock:
+        _cubes[key] = cube
+        _cubes.move_to_end(key)
+        while len(_cubes) > REVENUE_CUBE_CACHE_MAX_ENTRIES:
+            _cubes.popitem(last=False)
+
+def get_revenue_cube(key):
+    """
+    Return the cube of a dataset key (utils.dataset_store.dataset_key) from memory or
+    disk, or None if it was never built.
+    """
+    with _cubes_lock:
+        cube = _cubes.get(key)
+        if cube is not None:
+            _cubes.move_to_end(key)
+            return cube
+    cube = RevenueCube.load(key)
+    if cube is not None:
+        _cache(key, cube)
+    return cube
+
+def revenue_cube(key, builder):
+    """
+    Return the cube of a dataset key, calling builder() to build and persist it the
+    first time. Without a key the cube is built for the request only.
+    """
+    try:
+        if key is None:
+            return builder()
+        cube = get_revenue_cube(key)
+        if cube is None:
+            cube = builder()
+            cube.save(key)
+            _cache(key, cube)
+        return cube
+    except Exception as e:
+        logger.error(f"Error in revenue_cube: {e}")
+        raise
+
+def discard_revenue_cubes(dataset_id, version):
+    """Drop the cubes of the versions of a dataset before version, from memory and disk."""
+    with _cubes_lock:
+        for key in [key for key in _cubes if key_dataset_id(key) == dataset_id]:
+            del _cubes[key]
+    for earlier in range(version):
+        path = cube_path(dataset_key(dataset_id, earlier))
+        if os.path.exists(path):
+            os.remove(path)
+
+def revenue_cube_for_request(request):
+    """
+    Cube for a request: a stored dataset's cube is answered without loading its rows;
+    otherwise the dataset is loaded and the cube built on first use.
+    """
+    if 'file' not in request.files:
+        dataset_id = get_request_dataset_id(request)
+        if dataset_id is not None and DATASET_ID_PATTERN.fullmatch(str(dataset_id)):
+            cube = get_revenue_cube(dataset_key(dataset_id))
+            if cube is not None:
+                return cube
+    dataset_id, df = load_dataset(request)
+    return revenue_cube(loaded_key(df, dataset_id), lambda: RevenueCube.build(df))
+
+def cube_query_options(request):
+    """
+    Roll-up options from the request values: by (comma-separated dimensions, or
+    'total' for the grand total), start and end dates and country (comma-separated).
+    """
+    by = get_request_value(request, 'by', 'month')
+    countries = get_request_value(request, 'country')
+    if by == 'total':
+        by = []
+    return {
+        'by': [name.strip() for name in by.split(',') if name.strip()] if isinstance(by, str) else list(by),
+        'start': get_request_value(request, 'start'),
+        'end': get_request_value(request, 'end'),
+        'countries': [c.strip() for c in countries.split(',') if c.strip()] if isinstance(countries, str) else countries
+    }
@@ -1,4 +1,5 @@
 import logging
+import numpy as np
 import pandas as pd
 import warnings
 
@@ -8,62 +9,97 @@ logger = logging.getLogger(__name__)
 # Suppress warnings
 warnings.filterwarnings("ignore", category=pd.errors.SettingWithCopyWarning)
 
+# Segment for each (recency_score, frequency_score) pair, indexed [r - 1, f - 1]
+SEGMENT_LOOKUP = np.array([
+    ['hibernating', 'hibernating', 'at_Risk', 'at_Risk', 'cant_loose'],
+    ['hibernating', 'hibernating', 'at_Risk', 'at_Risk', 'cant_loose'],
+    ['about_to_Sleep', 'about_to_Sleep', 'need_attention', 'loyal_customers', 'loyal_customers'],
+    ['promising', 'potential_loyalists', 'potential_loyalists', 'loyal_customers', 'loyal_customers'],
+    ['new_customers', 'potential_loyalists', 'potential_loyalists', 'champions', 'champions'],
+], dtype=object)
+
+# RFM_SCORE label for each (recency_score, frequency_score) pair
+SCORE_LOOKUP = np.array([[f"{r}{f}" for f in range(1, 6)] for r in range(1, 6)], dtype=object)
+
+SEGMENT_RECOMMENDATIONS = {
+    'hibernating': 'Send re-engagement email with discount.',
+    'at_Risk': 'Offer loyalty discount to retain.',
+    'cant_loose': 'Provide exclusive offer to prevent churn.',
+    'about_to_Sleep': 'Send reminder email with new products.',
+    'need_attention': 'Engage with personalized recommendations.',
+    'loyal_customers': 'Reward with loyalty points.',
+    'promising': 'Upsell with product bundles.',
+    'new_customers': 'Welcome email with first-purchase discount.',
+    'potential_loyalists': 'Encourage repeat purchase with coupon.',
+    'champions': 'VIP program invitation.'
+}
+
+def compute_rfm_metrics(df):
+    """
+    Compute Recency, Frequency and Monetary per customer in a single groupby using
+    native reductions.
+    """
+    today_date = df['InvoiceDate'].max() + pd.Timedelta(days=1)
+    rfm = df.groupby('CustomerID', observed=True).agg(
+        LastPurchase=('InvoiceDate', 'max'),
+        Frequency=('InvoiceNo', 'nunique'),
+        Monetary=('TotalPrice', 'sum')
+    )
+    rfm.insert(0, 'Recency', (today_date - rfm.pop('LastPurchase')).dt.days)
+    return rfm
+
+def score_rfm(rfm):
+    """
+    Add quintile scores, segments and recommendations to a frame of Recency,
+    Frequency and Monetary values indexed by CustomerID.
+    """
+    rfm = rfm[rfm['Monetary'] > 0]
+    
+    rfm['recency_score'] = pd.qcut(rfm['Recency'], 5, labels=[5, 4, 3, 2, 1], duplicates='drop')
+    rfm['frequency_score'] = pd.qcut(rfm['Frequency'].rank(method='first'), 5, labels=[1, 2, 3, 4, 5], duplicates='drop')
+    rfm['monetary_score'] = pd.qcut(rfm['Monetary'], 5, labels=[1, 2, 3, 4, 5], duplicates='drop')
+    
+    r = rfm['recency_score'].to_numpy(dtype=np.int8) - 1
+    f = rfm['frequency_score'].to_numpy(dtype=np.int8) - 1
+    rfm['RFM_SCORE'] = SCORE_LOOKUP[r, f]
+    rfm['segment'] = SEGMENT_LOOKUP[r, f]
+    rfm['recommendation'] = rfm['segment'].map(SEGMENT_RECOMMENDATIONS)
+    
+    return rfm
+
+def rfm_from_aggregates(customers):
+    """
+    RFM scores from per-customer aggregates indexed by CustomerID: LastPurchase,
+    Frequency (distinct invoices) and Monetary.
+    """
+    today_date = customers['LastPurchase'].max() + pd.Timedelta(days=1)
+    rfm = pd.DataFrame({
+        'Recency': (today_date - customers['LastPurchase']).dt.days,
+        'Frequency': customers['Frequency'],
+        'Monetary': customers['Monetary']
+    })
+    return score_rfm(rfm)
+
 def perform_rfm_analysis(df):
     try:
         required_columns = ['InvoiceNo', 'StockCode', 'Description', 'Quantity', 'InvoiceDate', 'UnitPrice', 'CustomerID']
         if not all(col in df.columns for col in required_columns):
             raise ValueError(f"CSV file must contain the following columns: {', '.join(required_columns)}")
         
-        df_cleaned = df.copy()
-        
-        today_date = pd.to_datetime(df_cleaned['InvoiceDate'].max()) + pd.Timedelta(days=1)
-        rfm = df_cleaned.groupby('CustomerID').agg({
-            'InvoiceDate': lambda date: (today_date - pd.to_datetime(date.max())).days,
-            'InvoiceNo': lambda num: num.nunique(),
-            'TotalPrice': lambda price: price.sum()
-        })
-        
-        rfm.columns = ['Recency', 'Frequency', 'Monetary']
-        rfm = rfm[rfm['Monetary'] > 0]
-        
-        rfm['recency_score'] = pd.qcut(rfm['Recency'], 5, labels=[5, 4, 3, 2, 1], duplicates='drop')
-        rfm['frequency_score'] = pd.qcut(rfm['Frequency'].rank(method='first'), 5, labels=[1, 2, 3, 4, 5], duplicates='drop')
-        rfm['monetary_score'] = pd.qcut(rfm['Monetary'], 5, labels=[1, 2, 3, 4, 5], duplicates='drop')
-        rfm['RFM_SCORE'] = rfm['recency_score'].astype(str) + rfm['frequency_score'].astype(str)
-        
-        seg_map = {
-            r'[1-2][1-2]': 'hibernating',
-            r'[1-2][3-4]': 'at_Risk',
-            r'[1-2]5': 'cant_loose',
-            r'3[1-2]': 'about_to_Sleep',
-            r'33': 'need_attention',
-            r'[3-4][4-5]': 'loyal_customers',
-            r'41': 'promising',
-            r'51': 'new_customers',
-            r'[4-5][2-3]': 'potential_loyalists',
-            r'5[4-5]': 'champions'
-        }
-        rfm['segment'] = rfm['RFM_SCORE'].replace(seg_map, regex=True)
-        
-        rfm['recommendation'] = rfm['segment'].map({
-            'hibernating': 'Send re-engagement email with discount.',
-            'at_Risk': 'Offer loyalty discount to retain.',
-            'cant_loose': 'Provide exclusive offer to prevent churn.',
-            'about_to_Sleep': 'Send reminder email with new products.',
-            'need_attention': 'Engage with personalized recommendations.',
-            'loyal_customers': 'Reward with loyalty points.',
-            'promising': 'Upsell with product bundles.',
-            'new_customers': 'Welcome email with first-purchase discount.',
-            'potential_loyalists': 'Encourage repeat purchase with coupon.',
-            'champions': 'VIP program invitation.'
-        })
-        
-        return rfm
+        return score_rfm(compute_rfm_metrics(df))
     except Exception as e:
         logger.error(f"Error in perform_rfm_analysis: {e}")
         raise
 
-def marketing_recommendations(rfm, rules):
+def marketing_recommendations(rfm, rules, segment_bundles=None):
+    """
+    Build per-segment marketing recommendations.
+    
+    Args:
+        rfm: RFM DataFrame with segments
+        rules: Global affinity rules, used for segments without bundles of their own
+        segment_bundles: Optional dictionary of segment -> rules built from the segment's top products
+    """
     try:
         if rfm is None or rfm.empty:
             return [{"Segment": "No data", "Recommendation": "Insufficient data for recommendations"}]
@@ -85,7 +121,8 @@ def marketing_recommendations(rfm, rules):
                 logger.warning(f"Error getting top customers: {e}")
             
             bundle_suggestions = []
-            for i, rule in enumerate(rules[:3]):
+            segment_rules = (segment_bundles or {}).get(str(segment)) or rules
+            for i, rule in enumerate(segment_rules[:3]):
                 try:
                     if isinstance(rule, dict) and 'antecedents' in rule and 'consequents' in rule and 'lift' in rule:
                         bundle_suggestions.append(
@@ -1,64 +1,95 @@
 import logging
 import pandas as pd
+from analysis.labels import assign_labels, Quantile
+from analysis.revenue_cube import RevenueCube
+from utils.date_keys import date_key, month_labels
+from utils.serialization import records
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+REVENUE_TREND_TIERS = [
+    ('<', -0.1, 'Investigate decline; consider promotions.'),
+    ('>', 0.1, 'Monitor growth; optimize marketing.'),
+]
+REVENUE_TREND_DEFAULT = 'Stable; maintain strategy.'
+
+SEASON_TIERS = [
+    ('>', Quantile(0.75), 'High season; increase inventory.'),
+    ('<', Quantile(0.25), 'Low season; run promotions.'),
+]
+SEASON_DEFAULT = 'Stable season; maintain strategy.'
+
+def monthly_summary(df):
+    """
+    Per-month sales statistics in one pass over the transactions.
+    
+    Args:
+        df: Cleaned DataFrame
+    
+    Returns:
+        DataFrame indexed by MonthIndex in calendar order with TotalPrice, CustomerCount,
+        OrderCount, AvgOrderValue, SalesQty and ReturnsQty
+    """
+    quantity = df['Quantity']
+    month = date_key(df, 'MonthIndex')
+    summary = pd.DataFrame({
+        'MonthIndex': month,
+        'TotalPrice': df['TotalPrice'],
+        'CustomerID': df['CustomerID'],
+        'SalesQty': quantity.clip(lower=0),
+        'ReturnsQty': (-quantity).clip(lower=0)
+    }).groupby('MonthIndex').agg(
+        TotalPrice=('TotalPrice', 'sum'),
+        CustomerCount=('CustomerID', 'nunique'),
+        SalesQty=('SalesQty', 'sum'),
+        ReturnsQty=('ReturnsQty', 'sum')
+    )
+    
+    order_values = df.groupby([month, 'InvoiceNo'], observed=True)['TotalPrice'].sum().groupby(level='MonthIndex')
+    summary['OrderCount'] = order_values.size()
+    summary['AvgOrderValue'] = order_values.mean()
+    return summary
+
 def sales_drop_analysis(df):
     try:
-        df['InvoiceDate'] = pd.to_datetime(df['InvoiceDate'], errors='coerce')
-        df = df.dropna(subset=['InvoiceDate'])
-        
-        df['YearMonth'] = df['InvoiceDate'].dt.strftime('%Y-%m')
-        
-        monthly_revenue = df.groupby('YearMonth')['TotalPrice'].sum().reset_index()
+        monthly = monthly_summary(df)
+        monthly.index = month_labels(monthly.index)
         
-        monthly_revenue['YearMonth_date'] = pd.to_datetime(monthly_revenue['YearMonth'] + '-01')
-        monthly_revenue = monthly_revenue.sort_values('YearMonth_date')
-        
-        if len(monthly_revenue) >= 13:
-            monthly_revenue['YoY_Change'] = monthly_revenue['TotalPrice'].pct_change(12).fillna(0)
+        if len(monthly) >= 13:
+            monthly['YoY_Change'] = monthly['TotalPrice'].pct_change(12).fillna(0)
         else:
-            monthly_revenue['YoY_Change'] = monthly_revenue['TotalPrice'].pct_change().fillna(0)
+            monthly['YoY_Change'] = monthly['TotalPrice'].pct_change().fillna(0)
             logger.warning("Insufficient data for YoY calculation, using MoM instead")
         
-        drops = monthly_revenue[monthly_revenue['YoY_Change'] < -0.1].copy()
+        drops = monthly[monthly['YoY_Change'] < -0.1].copy()
         if drops.empty:
             logger.info("No significant sales drops detected.")
             return []
         
+        overall_customer_avg = monthly['CustomerCount'].mean()
+        overall_order_avg = monthly['AvgOrderValue'].mean()
+        
+        drops['ReturnRate'] = (drops['ReturnsQty'] / drops['SalesQty']).where(drops['SalesQty'] > 0, 0)
+        low_customers = (drops['CustomerCount'] < overall_customer_avg * 0.8).to_numpy()
+        low_order_value = (drops['AvgOrderValue'] < overall_order_avg * 0.8).to_numpy()
+        high_returns = (drops['ReturnRate'] > 0.05).to_numpy()
+        
         factors = []
-        for _, row in drops.iterrows():
-            current_month = row['YearMonth']
-            month_data = df[df['YearMonth'] == current_month].copy()
-            
-            customer_count = month_data['CustomerID'].nunique()
-            avg_order_value = month_data.groupby('InvoiceNo')['TotalPrice'].sum().mean()
-            total_orders = month_data['InvoiceNo'].nunique()
-            
-            sales_qty = df[(df['YearMonth'] == current_month) & (df['Quantity'] > 0)]['Quantity'].sum()
-            returns_qty = df[(df['YearMonth'] == current_month) & (df['Quantity'] < 0)]['Quantity'].abs().sum()
-            
-            return_rate = 0
-            if sales_qty > 0:
-                return_rate = returns_qty / sales_qty
-            
-            overall_customer_avg = df.groupby('YearMonth')['CustomerID'].nunique().mean()
-            overall_order_avg = df.groupby(['YearMonth', 'InvoiceNo'])['TotalPrice'].sum().groupby('YearMonth').mean().mean()
-            
+        for i, (current_month, row) in enumerate(drops.iterrows()):
             reasons = []
             recommendations = []
             
-            if customer_count < overall_customer_avg * 0.8:
-                reasons.append(f"Customer activity dropped to {customer_count} customers vs. avg {overall_customer_avg:.0f}")
+            if low_customers[i]:
+                reasons.append(f"Customer activity dropped to {int(row['CustomerCount'])} customers vs. avg {overall_customer_avg:.0f}")
                 recommendations.append("Launch customer re-engagement campaign with special offers")
             
-            if avg_order_value < overall_order_avg * 0.8:
-                reasons.append(f"Low average order value: ${avg_order_value:.2f} vs. avg ${overall_order_avg:.2f}")
+            if low_order_value[i]:
+                reasons.append(f"Low average order value: ${row['AvgOrderValue']:.2f} vs. avg ${overall_order_avg:.2f}")
                 recommendations.append("Implement product bundling and upselling strategies")
             
-            if return_rate > 0.05:
-                reasons.append(f"High return rate: {return_rate:.1%}")
+            if high_returns[i]:
+                reasons.append(f"High return rate: {row['ReturnRate']:.1%}")
                 recommendations.append("Review product quality and listings for accuracy")
             
             if not reasons:
@@ -69,9 +100,9 @@ def sales_drop_analysis(df):
                 'YearMonth': current_month,
                 'Revenue': float(row['TotalPrice']),
                 'YoY_Change': float(row['YoY_Change']),
-                'CustomerCount': int(customer_count),
-                'AvgOrderValue': float(avg_order_value),
-                'ReturnRate': float(return_rate),
+                'CustomerCount': int(row['CustomerCount']),
+                'AvgOrderValue': float(row['AvgOrderValue']),
+                'ReturnRate': float(row['ReturnRate']),
                 'Reasons': reasons,
                 'Recommendations': recommendations
             })
@@ -81,59 +112,59 @@ def sales_drop_analysis(df):
         logger.error(f"Error in sales_drop_analysis: {e}")
         raise
 
-def monthly_revenue_analysis(df):
+def revenue_cube_of(df, cube):
+    """The given revenue cube, or one built from the transactions."""
+    if cube is not None:
+        return cube
+    required_columns = ['InvoiceDate', 'Quantity', 'UnitPrice']
+    if not all(col in df.columns for col in required_columns):
+        raise ValueError(f"CSV file must contain the following columns: {', '.join(required_columns)}")
+    return RevenueCube.build(df)
+
+def monthly_revenue_analysis(df, cube=None):
     try:
-        required_columns = ['InvoiceDate', 'Quantity', 'UnitPrice']
-        if not all(col in df.columns for col in required_columns):
-            raise ValueError(f"CSV file must contain the following columns: {', '.join(required_columns)}")
-        
-        df['YearMonth'] = pd.to_datetime(df['InvoiceDate']).dt.to_period('M')
-        monthly_revenue = df.groupby('YearMonth')['TotalPrice'].sum().reset_index()
-        monthly_revenue['YoY_Change'] = monthly_revenue['TotalPrice'].pct_change(periods=12).fillna(0)
-        monthly_revenue['recommendation'] = monthly_revenue['YoY_Change'].apply(
-            lambda x: 'Investigate decline; consider promotions.' if x < -0.1
-            else 'Monitor growth; optimize marketing.' if x > 0.1
-            else 'Stable; maintain strategy.'
-        )
-        monthly_revenue['YearMonth'] = monthly_revenue['YearMonth'].astype(str)
-        
-        return monthly_revenue.to_dict(orient='records')
+        revenue = revenue_cube_of(df, cube).rollup(['month'])
+        return monthly_revenue_from_aggregates(revenue['month'], revenue['revenue'])
     except Exception as e:
         logger.error(f"Error in monthly_revenue_analysis: {e}")
         raise
 
-def daily_revenue_analysis(df):
+def monthly_revenue_from_aggregates(year_months, revenue):
+    """
+    Revenue trend per month from arrays of the 'YYYY-MM' labels of the months with
+    sales, in order, and their revenue.
+    """
+    monthly_revenue = pd.DataFrame({'YearMonth': year_months, 'TotalPrice': revenue})
+    monthly_revenue['YoY_Change'] = monthly_revenue['TotalPrice'].pct_change(periods=12).fillna(0)
+    monthly_revenue['recommendation'] = assign_labels(
+        monthly_revenue['YoY_Change'], REVENUE_TREND_TIERS, REVENUE_TREND_DEFAULT
+    )
+    
+    return records(monthly_revenue)
+
+def daily_revenue_analysis(df, cube=None):
     try:
-        required_columns = ['InvoiceDate', 'Quantity', 'UnitPrice']
-        if not all(col in df.columns for col in required_columns):
-            raise ValueError(f"CSV file must contain the following columns: {', '.join(required_columns)}")
+        revenue = revenue_cube_of(df, cube).rollup(['month', 'day_of_month'])
         
-        df['YearMonth'] = pd.to_datetime(df['InvoiceDate']).dt.to_period('M')
-        df['Day'] = df['InvoiceDate'].dt.day.astype(int)
-        daily_revenue = df.groupby(['YearMonth', 'Day'])['TotalPrice'].sum().reset_index()
-        daily_revenue['YearMonth'] = daily_revenue['YearMonth'].astype(str)
-        
-        daily_revenue_dict = daily_revenue.groupby('YearMonth').apply(
-            lambda x: x.set_index('Day')['TotalPrice'].to_dict()
-        ).to_dict()
+        daily_revenue_dict = {}
+        for month, day, total in zip(revenue['month'], revenue['day_of_month'], revenue['revenue'].tolist()):
+            daily_revenue_dict.setdefault(month, {})[day] = total
         
         return daily_revenue_dict
     except Exception as e:
         logger.error(f"Error in daily_revenue_analysis: {e}")
         raise
 
-def seasonality_analysis(df):
+def seasonality_analysis(df, cube=None):
     try:
-        df['Month'] = pd.to_datetime(df['InvoiceDate']).dt.month.astype(int)
-        seasonal_revenue = df.groupby('Month')['TotalPrice'].sum().reset_index()
+        revenue = revenue_cube_of(df, cube).rollup(['month_of_year'])
+        seasonal_revenue = pd.DataFrame({'Month': revenue['month_of_year'], 'TotalPrice': revenue['revenue']})
         
-        seasonal_revenue['recommendation'] = seasonal_revenue['TotalPrice'].apply(
-            lambda x: 'High season; increase inventory.' if x > seasonal_revenue['TotalPrice'].quantile(0.75)
-            else 'Low season; run promotions.' if x < seasonal_revenue['TotalPrice'].quantile(0.25)
-            else 'Stable season; maintain strategy.'
+        seasonal_revenue['recommendation'] = assign_labels(
+            seasonal_revenue['TotalPrice'], SEASON_TIERS, SEASON_DEFAULT
         )
         
-        return seasonal_revenue.to_dict(orient='records')
+        return records(seasonal_revenue)
     except Exception as e:
         logger.error(f"Error in seasonality_analysis: {e}")
-        raise
\ No newline at end of file
+        raise
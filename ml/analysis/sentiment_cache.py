@@ -0,0 +1,95 @@
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from textblob import TextBlob
+from utils.dataset_store import DATASET_STORE_FOLDER
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# SQLite file holding description -> polarity; shared by all datasets and kept across restarts
+SENTIMENT_CACHE_PATH = os.environ.get('SENTIMENT_CACHE_PATH', os.path.join(DATASET_STORE_FOLDER, "sentiment_cache.sqlite"))
+
+# Cache misses scored in worker processes once there are at least this many
+SENTIMENT_PARALLEL_THRESHOLD = int(os.environ.get('SENTIMENT_PARALLEL_THRESHOLD', 2000))
+SENTIMENT_WORKERS = int(os.environ.get('SENTIMENT_WORKERS', os.cpu_count() or 1))
+
+# Descriptions per worker task and per SQLite statement (below SQLite's variable limit)
+SCORING_BATCH = 500
+
+_memo = {}
+_memo_lock = threading.Lock()
+_pool = None
+_pool_lock = threading.Lock()
+
+def score_polarity(descriptions):
+    """TextBlob polarity of each description."""
+    return [TextBlob(description).sentiment.polarity for description in descriptions]
+
+def _connect():
+    connection = sqlite3.connect(SENTIMENT_CACHE_PATH, timeout=30)
+    connection.execute("CREATE TABLE IF NOT EXISTS polarity (description TEXT PRIMARY KEY, polarity REAL NOT NULL)")
+    return connection
+
+def _batches(values, size=SCORING_BATCH):
+    return [values[i:i + size] for i in range(0, len(values), size)]
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=SENTIMENT_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+def _score(descriptions):
+    if len(descriptions) < SENTIMENT_PARALLEL_THRESHOLD or SENTIMENT_WORKERS <= 1:
+        return score_polarity(descriptions)
+    scores = []
+    for batch_scores in _get_pool().map(score_polarity, _batches(descriptions)):
+        scores.extend(batch_scores)
+    return scores
+
+def polarities(descriptions):
+    """
+    Polarity of each distinct description, reading the in-process memo first, then the
+    persistent cache, and scoring only descriptions never seen before.
+
+    Args:
+        descriptions: List of distinct description strings
+
+    Returns:
+        List of polarities aligned with descriptions
+    """
+    try:
+        with _memo_lock:
+            missing = [description for description in descriptions if description not in _memo]
+
+        if missing:
+            connection = _connect()
+            try:
+                found = {}
+                for batch in _batches(missing):
+                    placeholders = ','.join('?' * len(batch))
+                    found.update(connection.execute(
+                        f"SELECT description, polarity FROM polarity WHERE description IN ({placeholders})", batch
+                    ).fetchall())
+                unscored = [description for description in missing if description not in found]
+                if unscored:
+                    logger.info(f"Scoring sentiment of {len(unscored)} new descriptions ({len(found)} cached)")
+                    scored = dict(zip(unscored, _score(unscored)))
+                    with connection:
+                        connection.executemany("INSERT OR REPLACE INTO polarity VALUES (?, ?)", scored.items())
+                    found.update(scored)
+            finally:
+                connection.close()
+            with _memo_lock:
+                _memo.update(found)
+
+        with _memo_lock:
+            return [_memo[description] for description in descriptions]
+    except Exception as e:
+        logger.error(f"Error in polarities: {e}")
+        raise
@@ -1,13 +1,24 @@
 import logging
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, send_file
 from flask_cors import CORS
-from utils.file_handler import load_and_clean_file
-from analysis.rfm_analysis import perform_rfm_analysis, marketing_recommendations
+from utils.file_handler import load_and_clean_file, load_dataset, get_request_dataset_id, get_request_value
+from utils.chunked_ingest import ingest_upload, should_ingest_chunked
+from utils.dataset_store import dataset_key
+from analysis.affinity_engine import affinity_options
+from analysis.cohort_engine import retention_options, DEFAULT_COHORT_PERIOD
 from analysis.product_analysis import product_affinity_analysis, sentiment_analysis, inventory_turnover, discount_impact_analysis
 from analysis.sales_analysis import sales_drop_analysis, monthly_revenue_analysis, daily_revenue_analysis, seasonality_analysis
 from analysis.customer_analysis import calculate_clv, top_customers_analysis, top_products_analysis, monthly_customer_acquisition, geographical_analysis, product_return_rate, customer_activity_heatmap, retention_rate
-from models.churn_model import train_churn_model
-from models.repurchase_model import train_repurchase_model
+from analysis.pipeline import run_analyses, run_analysis, rfm_payload, batch_score, find_bundles, bundles_from_index, result_page, result_stream
+from analysis.result_index import page_options
+from analysis.job_queue import submit_job, get_job, job_status, job_options, job_result_path
+from serving import service_status
+from analysis.cooccurrence_index import get_cooccurrence_index, COOCCURRENCE_TOP_K
+from analysis.revenue_cube import revenue_cube_for_request, cube_query_options
+from models.batch_scoring import OUTPUT_FORMATS, SCORING_CHUNK_ROWS
+from utils.serialization import json_response, frame_payload, payload_orient, stream_format, stream_response
+from analysis.customer_state import append_transactions, customer_state_for_request
+from analysis.dataset_aggregates import aggregates_for_request
 
 app = Flask(__name__)
 CORS(app)
@@ -16,256 +27,402 @@ CORS(app)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+@app.route('/health', methods=['GET'])
+def health():
+    try:
+        status = service_status()
+        # 503 tells a load balancer to stop routing to this worker
+        return json_response(status), 200 if status['ready'] else 503
+    except Exception as e:
+        logger.error(f"Error in health: {e}")
+        return json_response({"status": "error", "ready": False, "error": str(e)}), 500
+
 @app.route('/upload_csv', methods=['POST'])
 def upload_csv():
     try:
-        df = load_and_clean_file(request)
-        return jsonify({"message": "File uploaded and cleaned successfully"}), 200
+        if should_ingest_chunked(request):
+            dataset_id, stats = ingest_upload(request)
+            return json_response({
+                "message": "File uploaded and cleaned successfully",
+                "dataset_id": dataset_id,
+                "ingest_stats": stats
+            }), 200
+        dataset_id, df = load_dataset(request)
+        return json_response({"message": "File uploaded and cleaned successfully", "dataset_id": dataset_id}), 200
     except Exception as e:
         logger.error(f"Error in upload_csv: {e}")
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 @app.route('/rfm_analysis', methods=['POST'])
 def rfm_analysis():
     try:
+        options = page_options(request)
+        stream = stream_format(request)
+        if stream is not None:
+            return stream_response(stream, *result_stream(request, 'rfm_analysis', options)), 200
+        if options is not None:
+            return json_response(result_page(request, 'rfm_analysis', options)), 200
+        state = customer_state_for_request(request)
+        if state is not None:
+            return json_response(rfm_payload(state.rfm(), payload_orient(request))), 200
+        aggregates = aggregates_for_request(request)
+        if aggregates is not None:
+            return json_response(rfm_payload(aggregates.rfm(), payload_orient(request))), 200
         df = load_and_clean_file(request)
-        rfm = perform_rfm_analysis(df)
-        segment_data = rfm.groupby('segment').apply(lambda x: x.reset_index().to_dict(orient='records')).to_dict()
-        return jsonify({"segment_data": segment_data}), 200
+        return json_response(run_analysis(df, 'rfm_analysis', request)), 200
     except Exception as e:
         logger.error(f"Error in rfm_analysis: {e}")
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 @app.route('/train_model', methods=['POST'])
 def train_model():
     try:
-        df = load_and_clean_file(request)
-        rfm = perform_rfm_analysis(df)
-        model, scaler, conf_matrix, class_report = train_repurchase_model(rfm, df)
-        return jsonify({
-            "confusion_matrix": conf_matrix.tolist(),
-            "classification_report": class_report,
-            "model_trained": True
-        }), 200
+        dataset_id, df = load_dataset(request)
+        return json_response(run_analysis(df, 'train_model', request, dataset_id)), 200
     except Exception as e:
         logger.error(f"Error in train_model: {e}")
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 @app.route('/churn_prediction', methods=['POST'])
 def churn_prediction():
     try:
-        df = load_and_clean_file(request)
-        rfm = perform_rfm_analysis(df)
-        model, scaler, conf_matrix, class_report = train_churn_model(rfm, df)
-        churn_probs = model.predict_proba(scaler.transform(rfm[['Recency', 'Frequency', 'Monetary', 'Days_Since_Last_Purchase']]))[:, 1]
-        rfm_reset = rfm.reset_index()
-        rfm_reset['Churn_Probability'] = churn_probs
-        rfm_reset['recommendation'] = rfm_reset['Churn_Probability'].apply(
-            lambda x: f"High churn risk ({x:.2f}); offer discount." if x > 0.7
-            else f"Moderate risk ({x:.2f}); engage with email." if x > 0.3
-            else f"Low risk ({x:.2f}); maintain relationship."
-        )
-        return jsonify({
-            "confusion_matrix": conf_matrix.tolist(),
-            "classification_report": class_report,
-            "churn_predictions": rfm_reset[['CustomerID', 'Churn_Probability', 'recommendation']].to_dict(orient='records')
-        }), 200
+        options = page_options(request)
+        stream = stream_format(request)
+        if stream is not None:
+            return stream_response(stream, *result_stream(request, 'churn_prediction', options)), 200
+        if options is not None:
+            return json_response(result_page(request, 'churn_prediction', options)), 200
+        dataset_id, df = load_dataset(request)
+        return json_response(run_analysis(df, 'churn_prediction', request, dataset_id)), 200
     except Exception as e:
         logger.error(f"Error in churn_prediction: {e}")
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 @app.route('/repurchase_prediction', methods=['POST'])
 def repurchase_prediction():
     try:
-        df = load_and_clean_file(request)
-        rfm = perform_rfm_analysis(df)
-        model, scaler, _, _ = train_repurchase_model(rfm, df)
-        repurchase_probs = model.predict_proba(scaler.transform(rfm[['Recency', 'Frequency', 'Monetary']]))[:, 1]
-        rfm_reset = rfm.reset_index()
-        rfm_reset['Repurchase_Probability'] = repurchase_probs
-        rfm_reset['recommendation'] = rfm_reset['Repurchase_Probability'].apply(
-            lambda x: f"High repurchase likelihood ({x:.2f}); upsell products." if x > 0.7
-            else f"Moderate likelihood ({x:.2f}); send promotional email." if x > 0.3
-            else f"Low likelihood ({x:.2f}); re-engage with discount."
-        )
-        return jsonify({
-            "repurchase_predictions": rfm_reset[['CustomerID', 'Repurchase_Probability', 'recommendation']].to_dict(orient='records')
-        }), 200
+        options = page_options(request)
+        stream = stream_format(request)
+        if stream is not None:
+            return stream_response(stream, *result_stream(request, 'repurchase_prediction', options)), 200
+        if options is not None:
+            return json_response(result_page(request, 'repurchase_prediction', options)), 200
+        dataset_id, df = load_dataset(request)
+        return json_response(run_analysis(df, 'repurchase_prediction', request, dataset_id)), 200
     except Exception as e:
         logger.error(f"Error in repurchase_prediction: {e}")
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
+
+@app.route('/batch_score', methods=['POST'])
+def batch_score_endpoint():
+    try:
+        kind = request.values.get('model', 'churn')
+        output_format = request.values.get('format', 'ndjson')
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown format: {output_format}; expected one of {', '.join(OUTPUT_FORMATS)}")
+        chunk_rows = int(request.values.get('chunk_rows', SCORING_CHUNK_ROWS))
+        if chunk_rows <= 0:
+            raise ValueError("chunk_rows must be positive")
+        dataset_id, df = load_dataset(request)
+        chunks = batch_score(df, kind, request, dataset_id, chunk_rows)
+        serializer, mimetype = OUTPUT_FORMATS[output_format]
+        return Response(serializer(chunks), mimetype=mimetype), 200
+    except Exception as e:
+        logger.error(f"Error in batch_score: {e}")
+        return json_response({"error": str(e)}), 500
 
 @app.route('/customer_lifetime_value', methods=['POST'])
 def customer_lifetime_value():
     try:
+        options = page_options(request)
+        stream = stream_format(request)
+        if stream is not None:
+            return stream_response(stream, *result_stream(request, 'customer_lifetime_value', options)), 200
+        if options is not None:
+            return json_response(result_page(request, 'customer_lifetime_value', options)), 200
+        state = customer_state_for_request(request)
+        if state is not None:
+            return json_response({"clv": frame_payload(state.clv(), payload_orient(request))}), 200
+        aggregates = aggregates_for_request(request)
+        if aggregates is not None:
+            return json_response({"clv": frame_payload(aggregates.clv(), payload_orient(request))}), 200
         df = load_and_clean_file(request)
         clv = calculate_clv(df)
-        return jsonify({"clv": clv.to_dict(orient='records')}), 200
+        return json_response({"clv": frame_payload(clv, payload_orient(request))}), 200
     except Exception as e:
         logger.error(f"Error in customer_lifetime_value: {e}")
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 @app.route('/product_affinity', methods=['POST'])
 def product_affinity():
     try:
         df = load_and_clean_file(request)
-        rules = product_affinity_analysis(df)
-        return jsonify({"affinity_rules": rules}), 200
+        rules = product_affinity_analysis(df, **affinity_options(request))
+        return json_response({"affinity_rules": rules}), 200
     except Exception as e:
         logger.error(f"Error in product_affinity: {e}")
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 @app.route('/sentiment_analysis', methods=['POST'])
 def sentiment_analysis_endpoint():
     try:
+        options = page_options(request)
+        stream = stream_format(request)
+        if stream is not None:
+            return stream_response(stream, *result_stream(request, 'sentiment_analysis', options)), 200
+        if options is not None:
+            return json_response(result_page(request, 'sentiment_analysis', options)), 200
         df = load_and_clean_file(request)
         sentiment_summary = sentiment_analysis(df)
-        return jsonify({"sentiment_summary": sentiment_summary}), 200
+        return json_response({"sentiment_summary": sentiment_summary}), 200
     except Exception as e:
         logger.error(f"Error in sentiment_analysis_endpoint: {e}")
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 @app.route('/inventory_turnover', methods=['POST'])
 def inventory_turnover_endpoint():
     try:
         df = load_and_clean_file(request)
         turnover = inventory_turnover(df)
-        return jsonify({"inventory_turnover": turnover}), 200
+        return json_response({"inventory_turnover": turnover}), 200
     except Exception as e:
         logger.error(f"Error in inventory_turnover_endpoint: {e}")
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 @app.route('/discount_impact', methods=['POST'])
 def discount_impact():
     try:
         df = load_and_clean_file(request)
         discount_impact = discount_impact_analysis(df)
-        return jsonify({"discount_impact": discount_impact}), 200
+        return json_response({"discount_impact": discount_impact}), 200
     except Exception as e:
         logger.error(f"Error in discount_impact: {e}")
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 @app.route('/monthly_revenue', methods=['POST'])
 def monthly_revenue():
     try:
-        df = load_and_clean_file(request)
-        monthly_revenue = monthly_revenue_analysis(df)
-        return jsonify({"monthly_revenue": monthly_revenue}), 200
+        aggregates = aggregates_for_request(request)
+        if aggregates is not None:
+            return json_response({"monthly_revenue": aggregates.monthly_revenue()}), 200
+        monthly_revenue = monthly_revenue_analysis(None, revenue_cube_for_request(request))
+        return json_response({"monthly_revenue": monthly_revenue}), 200
     except Exception as e:
         logger.error(f"Error in monthly_revenue: {e}")
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 @app.route('/daily_revenue', methods=['POST'])
 def daily_revenue():
     try:
-        df = load_and_clean_file(request)
-        daily_revenue = daily_revenue_analysis(df)
-        return jsonify({"daily_revenue": daily_revenue}), 200
+        daily_revenue = daily_revenue_analysis(None, revenue_cube_for_request(request))
+        return json_response({"daily_revenue": daily_revenue}), 200
     except Exception as e:
         logger.error(f"Error in daily_revenue: {e}")
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 @app.route('/top_customers', methods=['POST'])
 def top_customers():
     try:
+        aggregates = aggregates_for_request(request)
+        if aggregates is not None:
+            return json_response({"top_customers": aggregates.top_customers()}), 200
         df = load_and_clean_file(request)
         top_customers = top_customers_analysis(df)
-        return jsonify({"top_customers": top_customers}), 200
+        return json_response({"top_customers": top_customers}), 200
     except Exception as e:
         logger.error(f"Error in top_customers: {e}")
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 @app.route('/top_products', methods=['POST'])
 def top_products():
     try:
+        aggregates = aggregates_for_request(request)
+        if aggregates is not None:
+            return json_response({"top_products": aggregates.top_products()}), 200
         df = load_and_clean_file(request)
         top_products = top_products_analysis(df)
-        return jsonify({"top_products": top_products}), 200
+        return json_response({"top_products": top_products}), 200
     except Exception as e:
         logger.error(f"Error in top_products: {e}")
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 @app.route('/monthly_customer_acquisition', methods=['POST'])
 def monthly_customer_acquisition_endpoint():
     try:
         df = load_and_clean_file(request)
         monthly_acquisition = monthly_customer_acquisition(df)
-        return jsonify({"monthly_acquisition": monthly_acquisition}), 200
+        return json_response({"monthly_acquisition": monthly_acquisition}), 200
     except Exception as e:
         logger.error(f"Error in monthly_customer_acquisition: {e}")
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 @app.route('/geographical_analysis', methods=['POST'])
 def geographical_analysis_endpoint():
     try:
-        df = load_and_clean_file(request)
-        geographical_revenue = geographical_analysis(df, request)
-        return jsonify({"geographical_revenue": geographical_revenue}), 200
+        geographical_revenue = geographical_analysis(None, request, revenue_cube_for_request(request))
+        return json_response({"geographical_revenue": geographical_revenue}), 200
     except Exception as e:
         logger.error(f"Error in geographical_analysis: {e}")
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 @app.route('/product_return_rate', methods=['POST'])
 def product_return_rate_endpoint():
     try:
         df = load_and_clean_file(request)
         return_rate = product_return_rate(df)
-        return jsonify({"product_return_rate": return_rate}), 200
+        return json_response({"product_return_rate": return_rate}), 200
     except Exception as e:
         logger.error(f"Error in product_return_rate: {e}")
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 @app.route('/customer_activity_heatmap', methods=['POST'])
 def customer_activity_heatmap_endpoint():
     try:
         df = load_and_clean_file(request)
         heatmap_data = customer_activity_heatmap(df)
-        return jsonify(heatmap_data), 200
+        return json_response(heatmap_data), 200
     except Exception as e:
         logger.error(f"Error in customer_activity_heatmap: {e}")
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 @app.route('/seasonality_analysis', methods=['POST'])
 def seasonality_analysis_endpoint():
     try:
-        df = load_and_clean_file(request)
-        seasonal_revenue = seasonality_analysis(df)
-        return jsonify({"seasonal_revenue": seasonal_revenue}), 200
+        seasonal_revenue = seasonality_analysis(None, revenue_cube_for_request(request))
+        return json_response({"seasonal_revenue": seasonal_revenue}), 200
     except Exception as e:
         logger.error(f"Error in seasonality_analysis: {e}")
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 @app.route('/retention_rate', methods=['POST'])
 def retention_rate_endpoint():
     try:
+        options = retention_options(request)
+        # The customer state only tracks monthly customer activity
+        if options.get('period', DEFAULT_COHORT_PERIOD) == DEFAULT_COHORT_PERIOD and not options.get('revenue'):
+            state = customer_state_for_request(request)
+            if state is not None:
+                return json_response(state.retention()), 200
         df = load_and_clean_file(request)
-        retention_data = retention_rate(df)
-        return jsonify(retention_data), 200
+        retention_data = retention_rate(df, **options)
+        return json_response(retention_data), 200
     except Exception as e:
         logger.error(f"Error in retention_rate: {e}")
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 @app.route('/sales_drop_analysis', methods=['POST'])
 def sales_drop_analysis_endpoint():
     try:
         df = load_and_clean_file(request)
         factors = sales_drop_analysis(df)
-        return jsonify({"sales_drop_factors": factors}), 200
+        return json_response({"sales_drop_factors": factors}), 200
     except Exception as e:
         logger.error(f"Error in sales_drop_analysis_endpoint: {e}")
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 @app.route('/marketing_recommendations', methods=['POST'])
 def marketing_recommendations_endpoint():
     try:
         df = load_and_clean_file(request)
-        rfm = perform_rfm_analysis(df)
-        rules = product_affinity_analysis(df)
-        recommendations = marketing_recommendations(rfm, rules)
-        return jsonify({"marketing_recommendations": recommendations}), 200
+        return json_response(run_analysis(df, 'marketing_recommendations', request)), 200
     except Exception as e:
         logger.error(f"Error in marketing_recommendations_endpoint: {e}")
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
+
+@app.route('/append_transactions', methods=['POST'])
+def append_transactions_endpoint():
+    try:
+        dataset_id = get_request_dataset_id(request)
+        if dataset_id is None:
+            raise ValueError("dataset_id of the dataset to append to is required")
+        delta = load_and_clean_file(request)
+        summary = append_transactions(dataset_id, delta)
+        return json_response(summary), 200
+    except Exception as e:
+        logger.error(f"Error in append_transactions: {e}")
+        return json_response({"error": str(e)}), 500
+
+@app.route('/bundles', methods=['POST'])
+def bundles():
+    try:
+        product = get_request_value(request, 'product')
+        segment = get_request_value(request, 'segment')
+        top_k = int(get_request_value(request, 'top_k', COOCCURRENCE_TOP_K))
+        # A dataset whose index is already built is answered without loading its rows
+        dataset_id = get_request_dataset_id(request) if 'file' not in request.files else None
+        index = get_cooccurrence_index(dataset_key(dataset_id)) if dataset_id else None
+        if index is not None and (product is None) != (segment is None):
+            return json_response(bundles_from_index(index, product, segment, top_k)), 200
+        dataset_id, df = load_dataset(request)
+        return json_response(find_bundles(df, dataset_id, product, segment, top_k)), 200
+    except Exception as e:
+        logger.error(f"Error in bundles: {e}")
+        return json_response({"error": str(e)}), 500
+
+@app.route('/revenue_cube', methods=['POST'])
+def revenue_cube_query():
+    try:
+        options = cube_query_options(request)
+        revenue = revenue_cube_for_request(request).rollup(**options)
+        return json_response({"revenue": frame_payload(revenue, payload_orient(request)), "by": options['by']}), 200
+    except Exception as e:
+        logger.error(f"Error in revenue_cube: {e}")
+        return json_response({"error": str(e)}), 500
+
+@app.route('/analyze', methods=['POST'])
+def analyze():
+    try:
+        dataset_id, df = load_dataset(request)
+        payload = request.get_json(silent=True) or {}
+        names = payload.get('analyses') or request.values.get('analyses')
+        if isinstance(names, str):
+            names = [name.strip() for name in names.split(',') if name.strip()]
+        return json_response(run_analyses(df, names, request, dataset_id)), 200
+    except Exception as e:
+        logger.error(f"Error in analyze: {e}")
+        return json_response({"error": str(e)}), 500
+
+@app.route('/jobs', methods=['POST'])
+def submit_job_endpoint():
+    try:
+        names, options = job_options(request)
+        # An uploaded file is stored first so the worker can load it by ID
+        dataset_id = load_dataset(request)[0] if 'file' in request.files else get_request_dataset_id(request)
+        if dataset_id is None:
+            raise ValueError("No file uploaded or dataset_id provided")
+        return json_response(submit_job(names, dataset_id, options)), 200
+    except Exception as e:
+        logger.error(f"Error in submit_job: {e}")
+        return json_response({"error": str(e)}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status_endpoint(job_id):
+    try:
+        job = get_job(job_id)
+        if job is None:
+            return json_response({"error": f"Unknown job: {job_id}"}), 404
+        return json_response(job_status(job)), 200
+    except Exception as e:
+        logger.error(f"Error in job_status: {e}")
+        return json_response({"error": str(e)}), 500
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result_endpoint(job_id):
+    try:
+        job = get_job(job_id)
+        if job is None:
+            return json_response({"error": f"Unknown job: {job_id}"}), 404
+        if job['status'] != 'succeeded':
+            return json_response({"error": f"Job {job_id} is {job['status']}", **job_status(job)}), 409
+        try:
+            result = open(job_result_path(job_id), 'rb')
+        except FileNotFoundError:
+            # Purged by another process between the status check and here
+            return json_response({"error": f"Unknown job: {job_id}"}), 404
+        return send_file(result, mimetype='application/json')
+    except Exception as e:
+        logger.error(f"Error in job_result: {e}")
+        return json_response({"error": str(e)}), 500
 
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,32 @@
+import os
+
+# Address the Node backend proxies to
+bind = os.environ.get('SERVER_BIND', '127.0.0.1:5000')
+
+# Worker processes, and request threads per worker
+workers = int(os.environ.get('SERVER_WORKERS', 2))
+threads = int(os.environ.get('SERVER_THREADS', 4))
+worker_class = 'gthread'
+
+# Import the app (and preload datasets) once in the master, before forking
+preload_app = True
+
+# Matches the Node backend's request timeout; long analyses should go through /jobs
+timeout = int(os.environ.get('SERVER_TIMEOUT', 300))
+graceful_timeout = int(os.environ.get('SERVER_GRACEFUL_TIMEOUT', 60))
+keepalive = 5
+
+# Also recycle workers after a number of requests (0 disables), jittered so they do
+# not all restart at once
+max_requests = int(os.environ.get('SERVER_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.environ.get('SERVER_MAX_REQUESTS_JITTER', 50))
+
+accesslog = '-'
+
+def post_request(worker, req, environ, resp):
+    # Imported from the preloaded app, so this is a lookup rather than a load
+    from serving import should_recycle
+    if worker.alive and should_recycle():
+        # The worker finishes its in-flight requests, exits and is replaced
+        worker.log.info(f"Recycling worker {worker.pid} on high memory")
+        worker.alive = False
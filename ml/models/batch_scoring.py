@@ -0,0 +1,109 @@
+import copy
+import io
+import logging
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Customers scored per predict_proba call; bounds the memory of one scoring step
+SCORING_CHUNK_ROWS = int(os.environ.get('SCORING_CHUNK_ROWS', 100_000))
+
+# Parallelism of predict_proba for estimators that support it (-1 uses all cores)
+SCORING_N_JOBS = int(os.environ.get('SCORING_N_JOBS', -1))
+
+# Per model kind: probability column, then (threshold, prefix, suffix) tiers checked in
+# order, with the last tier as the fallback. The message reads prefix + "0.42" + suffix.
+RECOMMENDATION_TIERS = {
+    'churn': ('Churn_Probability', [
+        (0.7, "High churn risk (", "); offer discount."),
+        (0.3, "Moderate risk (", "); engage with email."),
+        (None, "Low risk (", "); maintain relationship.")
+    ]),
+    'repurchase': ('Repurchase_Probability', [
+        (0.7, "High repurchase likelihood (", "); upsell products."),
+        (0.3, "Moderate likelihood (", "); send promotional email."),
+        (None, "Low likelihood (", "); re-engage with discount.")
+    ]),
+}
+
+def probability_column(kind):
+    return RECOMMENDATION_TIERS[kind][0]
+
+def recommendations(probabilities, kind):
+    """
+    Map predicted probabilities to recommendation messages without a Python-level loop.
+
+    Args:
+        probabilities: 1-D array of predicted probabilities
+        kind: Model kind ('churn' or 'repurchase')
+
+    Returns:
+        Object array of recommendation strings
+    """
+    tiers = RECOMMENDATION_TIERS[kind][1]
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    conditions = [probabilities > threshold for threshold, _, _ in tiers[:-1]]
+    tier = np.select(conditions, np.arange(len(conditions)), default=len(tiers) - 1)
+    prefixes = np.array([prefix for _, prefix, _ in tiers])
+    suffixes = np.array([suffix for _, _, suffix in tiers])
+    messages = np.char.add(np.char.add(prefixes[tier], np.char.mod('%.2f', probabilities)), suffixes[tier])
+    return messages.astype(object)
+
+def score_chunks(artifact, matrix, customer_ids, kind, chunk_rows=SCORING_CHUNK_ROWS):
+    """
+    Score customers in fixed-size chunks with a registered model artifact.
+
+    Args:
+        artifact: Model artifact from the model registry
+        matrix: Feature matrix in the artifact's feature order, one row per customer
+        customer_ids: Array of customer IDs aligned with the matrix rows
+        kind: Model kind ('churn' or 'repurchase')
+        chunk_rows: Number of customers scored per step
+
+    Yields:
+        DataFrames with CustomerID, the probability column and recommendation
+    """
+    model = artifact['model']
+    if 'n_jobs' in model.get_params():
+        # A shallow copy shares the fitted trees; the registry's cached estimator keeps its n_jobs
+        model = copy.copy(model).set_params(n_jobs=SCORING_N_JOBS)
+    column = probability_column(kind)
+    for start in range(0, len(matrix), chunk_rows):
+        block = matrix[start:start + chunk_rows]
+        probabilities = model.predict_proba(artifact['scaler'].transform(block))[:, 1]
+        yield pd.DataFrame({
+            'CustomerID': customer_ids[start:start + chunk_rows],
+            column: probabilities,
+            'recommendation': recommendations(probabilities, kind)
+        })
+
+def ndjson_stream(chunks):
+    """Serialize scored chunks as newline-delimited JSON, one customer per line."""
+    for chunk in chunks:
+        yield chunk.to_json(orient='records', lines=True)
+
+def arrow_stream(chunks):
+    """Serialize scored chunks as an Arrow IPC stream, one record batch per chunk."""
+    sink = io.BytesIO()
+    writer = None
+    for chunk in chunks:
+        batch = pa.RecordBatch.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            writer = pa.ipc.new_stream(sink, batch.schema)
+        writer.write_batch(batch)
+        yield sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+    if writer is not None:
+        writer.close()
+        yield sink.getvalue()
+
+# Output formats of /batch_score: name -> (serializer, mimetype)
+OUTPUT_FORMATS = {
+    'ndjson': (ndjson_stream, 'application/x-ndjson'),
+    'arrow': (arrow_stream, 'application/vnd.apache.arrow.stream'),
+}
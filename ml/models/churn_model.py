@@ -1,26 +1,32 @@
 import logging
-import pandas as pd
-from sklearn.ensemble import RandomForestClassifier
+import numpy as np
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import classification_report, confusion_matrix
+from models.features import build_feature_matrix
+from models.estimators import make_estimator, DEFAULT_BACKEND, TRAINING_N_JOBS
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-def train_churn_model(rfm, df):
+CHURN_FEATURES = ['Recency', 'Frequency', 'Monetary', 'Days_Since_Last_Purchase']
+
+def churn_labels(rfm):
+    """Customers without a purchase in the last 90 days count as churned."""
+    return (rfm['Recency'] > 90).to_numpy(dtype=np.int64)
+
+def train_churn_model(rfm, df, backend=DEFAULT_BACKEND, n_jobs=TRAINING_N_JOBS):
+    """
+    Fit the churn model on the RFM frame, which is left unchanged. df is accepted for
+    a uniform trainer signature; churn labels only need the RFM recency.
+    """
     try:
-        last_purchase = df.groupby('CustomerID')['InvoiceDate'].max()
-        today_date = pd.to_datetime(df['InvoiceDate'].max()) + pd.Timedelta(days=1)
-        rfm['Days_Since_Last_Purchase'] = rfm.index.map(lambda x: (today_date - pd.to_datetime(last_purchase[x])).days)
-        rfm['Churn'] = (rfm['Days_Since_Last_Purchase'] > 90).astype(int)
-        
-        X = rfm[['Recency', 'Frequency', 'Monetary', 'Days_Since_Last_Purchase']]
-        y = rfm['Churn']
+        X = build_feature_matrix(rfm, CHURN_FEATURES)
+        y = churn_labels(rfm)
         scaler = StandardScaler()
         X_scaled = scaler.fit_transform(X)
         X_train, X_test, y_train, y_test = train_test_split(X_scaled, y, test_size=0.2, random_state=42)
-        model = RandomForestClassifier(random_state=42)
+        model = make_estimator(backend, n_jobs)
         model.fit(X_train, y_train)
         y_pred = model.predict(X_test)
         conf_matrix = confusion_matrix(y_test, y_pred)
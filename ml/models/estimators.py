@@ -0,0 +1,21 @@
+import os
+from sklearn.ensemble import RandomForestClassifier, HistGradientBoostingClassifier
+
+# Backend used when a request does not name one
+DEFAULT_BACKEND = os.environ.get('MODEL_BACKEND', 'random_forest')
+
+# Cores a single fit may use (-1 uses all of them)
+TRAINING_N_JOBS = int(os.environ.get('TRAINING_N_JOBS', -1))
+
+# Estimator backends the trainers can fit: name -> factory taking n_jobs. Histogram-based
+# gradient boosting bins the features once and is much faster on large customer tables;
+# it parallelizes through OpenMP rather than n_jobs.
+ESTIMATOR_BACKENDS = {
+    'random_forest': lambda n_jobs: RandomForestClassifier(random_state=42, n_jobs=n_jobs),
+    'hist_gradient_boosting': lambda n_jobs: HistGradientBoostingClassifier(random_state=42),
+}
+
+def make_estimator(backend=DEFAULT_BACKEND, n_jobs=TRAINING_N_JOBS):
+    if backend not in ESTIMATOR_BACKENDS:
+        raise ValueError(f"Unknown model backend: {backend}; expected one of {', '.join(ESTIMATOR_BACKENDS)}")
+    return ESTIMATOR_BACKENDS[backend](n_jobs)
@@ -0,0 +1,77 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Number of feature matrices kept in memory for reuse by inference requests
+FEATURE_CACHE_MAX_ENTRIES = int(os.environ.get('FEATURE_CACHE_MAX_ENTRIES', 8))
+
+# Model features computed from the RFM frame: name -> function returning the column.
+# Days since the last purchase is the RFM Recency (both count from the day after the
+# last invoice in the dataset); the churn model keeps it as a named feature.
+FEATURE_SOURCES = {
+    'Recency': lambda rfm: rfm['Recency'],
+    'Frequency': lambda rfm: rfm['Frequency'],
+    'Monetary': lambda rfm: rfm['Monetary'],
+    'Days_Since_Last_Purchase': lambda rfm: rfm['Recency'],
+}
+
+def build_feature_matrix(rfm, features):
+    """
+    Build a model feature matrix from the RFM frame without modifying it.
+
+    Args:
+        rfm: RFM DataFrame indexed by CustomerID
+        features: Ordered feature names (keys of FEATURE_SOURCES)
+
+    Returns:
+        C-contiguous float32 array of shape (customers, features), rows in rfm order
+    """
+    unknown = [name for name in features if name not in FEATURE_SOURCES]
+    if unknown:
+        raise ValueError(f"Unknown features: {', '.join(unknown)}")
+    matrix = np.empty((len(rfm), len(features)), dtype=np.float32)
+    for i, name in enumerate(features):
+        matrix[:, i] = FEATURE_SOURCES[name](rfm).to_numpy()
+    return matrix
+
+class FeatureCache:
+    """
+    LRU cache of feature matrices keyed by (dataset key, feature names). Matrices are
+    marked read-only and shared between callers rather than copied.
+    """
+
+    def __init__(self, max_entries=FEATURE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_build(self, dataset_key, features, rfm_loader):
+        """
+        Return (customer_ids, matrix) for a dataset key (utils.dataset_store.dataset_key),
+        building the matrix from the RFM frame returned by rfm_loader() when it is not
+        cached.
+        """
+        key = (dataset_key, tuple(features))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        rfm = rfm_loader()
+        matrix = build_feature_matrix(rfm, features)
+        matrix.flags.writeable = False
+        entry = (rfm.index, matrix)
+        if dataset_key is not None:
+            with self._lock:
+                self._entries[key] = entry
+                while len(self._entries) > self.max_entries:
+                    evicted, _ = self._entries.popitem(last=False)
+                    logger.info(f"Evicted features of dataset {evicted[0][:12]} from cache")
+        return entry
+
+feature_cache = FeatureCache()
@@ -0,0 +1,213 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import joblib
+import psutil
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Fitted models are persisted here, one sub-folder per dataset ID
+MODEL_STORE_FOLDER = os.environ.get('MODEL_STORE_FOLDER', "Models")
+os.makedirs(MODEL_STORE_FOLDER, exist_ok=True)
+
+# Number of fitted models kept in memory
+MODEL_CACHE_MAX_ENTRIES = int(os.environ.get('MODEL_CACHE_MAX_ENTRIES', 16))
+
+# Seconds a request waits for another process training the same model before giving up
+MODEL_TRAINING_WAIT_TIMEOUT = float(os.environ.get('MODEL_TRAINING_WAIT_TIMEOUT', 600))
+
+# Seconds between checks for a model another process is training
+MODEL_TRAINING_POLL_INTERVAL = float(os.environ.get('MODEL_TRAINING_POLL_INTERVAL', 0.5))
+
+VERSION_PATTERN = re.compile(r'\.v(\d+)\.joblib$')
+
+def feature_spec_id(features, params=None):
+    """
+    Short identifier of a feature spec: the ordered feature columns plus the estimator
+    settings. Models trained on a different spec never shadow each other.
+    """
+    spec = json.dumps({'features': list(features), 'params': params or {}}, sort_keys=True)
+    return hashlib.sha256(spec.encode()).hexdigest()[:12]
+
+class ModelRegistry:
+    """
+    Versioned store of fitted model artifacts keyed by (dataset ID, model kind, feature
+    spec), backed by joblib files on disk and an LRU cache of loaded artifacts.
+
+    An artifact is a dictionary holding the fitted model and scaler, the feature
+    columns, the evaluation results of the training run and its version number.
+    Registering a new artifact for the same key adds a version; loads default to the
+    latest one. Server processes sharing the folder coordinate through a SQLite file in
+    it, which hands out version numbers and records which process trains each key.
+    """
+
+    def __init__(self, folder=MODEL_STORE_FOLDER, max_entries=MODEL_CACHE_MAX_ENTRIES):
+        self.folder = folder
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def _path(self, dataset_id, kind, spec_id, version):
+        return os.path.join(self.folder, dataset_id, f"{kind}.{spec_id}.v{version}.joblib")
+
+    def _connect(self):
+        connection = sqlite3.connect(os.path.join(self.folder, "registry.sqlite"), timeout=30)
+        connection.isolation_level = None
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS versions (dataset_id TEXT NOT NULL, kind TEXT NOT NULL, spec_id TEXT NOT NULL, "
+            "version INTEGER NOT NULL, claimed_at REAL NOT NULL, PRIMARY KEY (dataset_id, kind, spec_id, version))"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS trainings (dataset_id TEXT NOT NULL, kind TEXT NOT NULL, spec_id TEXT NOT NULL, "
+            "pid INTEGER NOT NULL, started_at REAL NOT NULL, PRIMARY KEY (dataset_id, kind, spec_id))"
+        )
+        return connection
+
+    def _transaction(self, work):
+        """Run work(connection) in a transaction that excludes other processes' writes."""
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = work(connection)
+                connection.execute("COMMIT")
+                return result
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+        finally:
+            connection.close()
+
+    def _claim_version(self, dataset_id, kind, spec_id):
+        """Reserve the next version number of a key, unique across processes."""
+        def claim(connection):
+            claimed = connection.execute(
+                "SELECT COALESCE(MAX(version), 0) FROM versions WHERE dataset_id = ? AND kind = ? AND spec_id = ?",
+                (dataset_id, kind, spec_id)
+            ).fetchone()[0]
+            version = max([claimed, *self.versions(dataset_id, kind, spec_id)]) + 1
+            connection.execute("INSERT INTO versions (dataset_id, kind, spec_id, version, claimed_at) VALUES (?, ?, ?, ?, ?)",
+                               (dataset_id, kind, spec_id, version, time.time()))
+            return version
+        return self._transaction(claim)
+
+    def _claim_training(self, dataset_id, kind, spec_id):
+        """Record the current process as training a key, unless a live process already is."""
+        def claim(connection):
+            row = connection.execute("SELECT pid FROM trainings WHERE dataset_id = ? AND kind = ? AND spec_id = ?",
+                                     (dataset_id, kind, spec_id)).fetchone()
+            if row is not None and psutil.pid_exists(row[0]):
+                return False
+            connection.execute("INSERT OR REPLACE INTO trainings (dataset_id, kind, spec_id, pid, started_at) VALUES (?, ?, ?, ?, ?)",
+                               (dataset_id, kind, spec_id, os.getpid(), time.time()))
+            return True
+        return self._transaction(claim)
+
+    def _release_training(self, dataset_id, kind, spec_id):
+        self._transaction(lambda connection: connection.execute(
+            "DELETE FROM trainings WHERE dataset_id = ? AND kind = ? AND spec_id = ? AND pid = ?",
+            (dataset_id, kind, spec_id, os.getpid())
+        ))
+
+    def versions(self, dataset_id, kind, spec_id):
+        """Sorted version numbers stored for a key."""
+        paths = glob.glob(os.path.join(self.folder, dataset_id, f"{kind}.{spec_id}.v*.joblib"))
+        return sorted(int(VERSION_PATTERN.search(path).group(1)) for path in paths)
+
+    def register(self, dataset_id, kind, spec_id, artifact):
+        """
+        Persist a freshly trained artifact as the next version of its key.
+
+        Returns:
+            The artifact, with its version number and training timestamp filled in
+        """
+        try:
+            os.makedirs(os.path.join(self.folder, dataset_id), exist_ok=True)
+            version = self._claim_version(dataset_id, kind, spec_id)
+            artifact = dict(artifact, version=version, spec_id=spec_id, trained_at=time.time())
+            path = self._path(dataset_id, kind, spec_id, version)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            joblib.dump(artifact, tmp_path)
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._put((dataset_id, kind, spec_id, version), artifact)
+            logger.info(f"Registered {kind} model v{version} for dataset {dataset_id[:12]}")
+            return artifact
+        except Exception as e:
+            logger.error(f"Error in register: {e}")
+            raise
+
+    def load(self, dataset_id, kind, spec_id, version=None):
+        """Return a stored artifact (the latest version by default), or None if there is none."""
+        if version is None:
+            existing = self.versions(dataset_id, kind, spec_id)
+            if not existing:
+                return None
+            version = existing[-1]
+        key = (dataset_id, kind, spec_id, int(version))
+        with self._lock:
+            artifact = self._entries.get(key)
+            if artifact is not None:
+                self._entries.move_to_end(key)
+                return artifact
+        path = self._path(*key)
+        if not os.path.exists(path):
+            return None
+        artifact = joblib.load(path)
+        with self._lock:
+            self._put(key, artifact)
+        logger.info(f"Loaded {kind} model v{version} for dataset {dataset_id[:12]}")
+        return artifact
+
+    def get_or_train(self, dataset_id, kind, spec_id, trainer, version=None):
+        """
+        Return the requested artifact, calling trainer() to fit and register one when the
+        key has no stored version yet. Concurrent requests for the same key train once,
+        also across processes: while another process trains it, this one waits for its
+        artifact (up to MODEL_TRAINING_WAIT_TIMEOUT seconds).
+        """
+        artifact = self.load(dataset_id, kind, spec_id, version)
+        if artifact is not None:
+            return artifact
+        if version is not None:
+            raise ValueError(f"Unknown {kind} model version {version} for dataset {dataset_id}")
+        with self._lock:
+            key_lock = self._key_locks.setdefault((dataset_id, kind, spec_id), threading.Lock())
+        try:
+            with key_lock:
+                deadline = time.monotonic() + MODEL_TRAINING_WAIT_TIMEOUT
+                while True:
+                    artifact = self.load(dataset_id, kind, spec_id)
+                    if artifact is not None:
+                        return artifact
+                    if self._claim_training(dataset_id, kind, spec_id):
+                        break
+                    if time.monotonic() > deadline:
+                        raise TimeoutError(f"Timed out waiting for another process to train the {kind} model")
+                    time.sleep(MODEL_TRAINING_POLL_INTERVAL)
+                try:
+                    return self.register(dataset_id, kind, spec_id, trainer())
+                finally:
+                    self._release_training(dataset_id, kind, spec_id)
+        finally:
+            with self._lock:
+                self._key_locks.pop((dataset_id, kind, spec_id), None)
+
+    def _put(self, key, artifact):
+        # Callers hold self._lock
+        self._entries[key] = artifact
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            logger.info(f"Evicted {evicted[1]} model v{evicted[3]} for dataset {evicted[0][:12]} from cache")
+
+model_registry = ModelRegistry()
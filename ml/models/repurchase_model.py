@@ -1,31 +1,38 @@
 import logging
 import numpy as np
 import pandas as pd
-from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import classification_report, confusion_matrix
+from models.features import build_feature_matrix
+from models.estimators import make_estimator, DEFAULT_BACKEND, TRAINING_N_JOBS
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-def train_repurchase_model(rfm, df):
+REPURCHASE_FEATURES = ['Recency', 'Frequency', 'Monetary']
+
+def repurchase_labels(rfm, df):
+    """Customers with an invoice in the last 90 days of the dataset count as repurchasing."""
+    max_date = pd.to_datetime(df['InvoiceDate'].max())
+    cutoff_date = max_date - pd.Timedelta(days=90)
+    future_purchases = df[pd.to_datetime(df['InvoiceDate']) > cutoff_date].groupby('CustomerID', observed=True)['InvoiceNo'].nunique()
+    labels = rfm.index.isin(future_purchases.index).astype(int)
+    
+    if labels.sum() == 0:
+        logger.warning("No future purchases found for training. Using synthetic labels.")
+        labels = np.random.choice([0, 1], size=len(rfm), p=[0.7, 0.3])
+    return labels
+
+def train_repurchase_model(rfm, df, backend=DEFAULT_BACKEND, n_jobs=TRAINING_N_JOBS):
+    """Fit the repurchase model on the RFM frame, which is left unchanged."""
     try:
-        max_date = pd.to_datetime(df['InvoiceDate'].max())
-        cutoff_date = max_date - pd.Timedelta(days=90)
-        future_purchases = df[pd.to_datetime(df['InvoiceDate']) > cutoff_date].groupby('CustomerID')['InvoiceNo'].nunique()
-        rfm['Purchased_Again'] = rfm.index.isin(future_purchases.index).astype(int)
-        
-        if rfm['Purchased_Again'].sum() == 0:
-            logger.warning("No future purchases found for training. Using synthetic labels.")
-            rfm['Purchased_Again'] = np.random.choice([0, 1], size=len(rfm), p=[0.7, 0.3])
-        
-        X = rfm[['Recency', 'Frequency', 'Monetary']]
-        y = rfm['Purchased_Again']
+        X = build_feature_matrix(rfm, REPURCHASE_FEATURES)
+        y = repurchase_labels(rfm, df)
         scaler = StandardScaler()
         X_scaled = scaler.fit_transform(X)
         X_train, X_test, y_train, y_test = train_test_split(X_scaled, y, test_size=0.2, random_state=42)
-        model = RandomForestClassifier(random_state=42)
+        model = make_estimator(backend, n_jobs)
         model.fit(X_train, y_train)
         y_pred = model.predict(X_test)
         conf_matrix = confusion_matrix(y_test, y_pred)
@@ -0,0 +1,150 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import psutil
+from threadpoolctl import threadpool_limits
+from models.churn_model import train_churn_model
+from models.repurchase_model import train_repurchase_model
+from models.estimators import DEFAULT_BACKEND, TRAINING_N_JOBS, ESTIMATOR_BACKENDS
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Worker processes fitting models; each fit runs in its own process
+TRAINING_WORKERS = int(os.environ.get('TRAINING_WORKERS', 2))
+
+# Start method of the worker processes. spawn avoids forking a multi-threaded server.
+TRAINING_START_METHOD = os.environ.get('TRAINING_START_METHOD', 'spawn')
+
+TRAINERS = {
+    'churn': train_churn_model,
+    'repurchase': train_repurchase_model,
+}
+
+# Transaction columns the trainers read; only these are shipped to the workers
+TRAINING_COLUMNS = ['CustomerID', 'InvoiceNo', 'InvoiceDate']
+
+MEMORY_SAMPLE_INTERVAL = 0.05
+
+_pool = None
+_pool_lock = threading.Lock()
+
+class PeakMemory:
+    """Tracks the peak resident memory of the current process while the block runs."""
+
+    def __init__(self, interval=MEMORY_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.process.memory_info().rss
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+        return False
+
+def training_frame(df):
+    """
+    Reduce the transactions to what the trainers need, one row per customer invoice,
+    so the data sent to the worker processes is a fraction of the dataset.
+    """
+    return df[TRAINING_COLUMNS].drop_duplicates().reset_index(drop=True)
+
+def run_training_job(kind, rfm, df, backend, n_jobs):
+    """
+    Fit one model in the current process.
+
+    Returns:
+        Dictionary with the fitted model and scaler, the evaluation results and the wall
+        time and peak memory of the fit
+    """
+    start = time.perf_counter()
+    with PeakMemory() as memory, threadpool_limits(limits=n_jobs if n_jobs > 0 else None):
+        model, scaler, conf_matrix, class_report = TRAINERS[kind](rfm, df, backend=backend, n_jobs=n_jobs)
+    return {
+        "model": model,
+        "scaler": scaler,
+        "confusion_matrix": conf_matrix,
+        "classification_report": class_report,
+        "backend": backend,
+        "training": {
+            "wall_time_s": round(time.perf_counter() - start, 4),
+            "peak_memory_mb": round(memory.peak / 1024**2, 1),
+            "n_jobs": n_jobs,
+            "pid": os.getpid()
+        }
+    }
+
+def get_training_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            context = multiprocessing.get_context(TRAINING_START_METHOD)
+            _pool = ProcessPoolExecutor(max_workers=TRAINING_WORKERS, mp_context=context)
+            logger.info(f"Started training pool with {TRAINING_WORKERS} workers")
+        return _pool
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def jobs_per_fit(concurrent_fits):
+    """Split the available cores between fits running at the same time."""
+    if TRAINING_N_JOBS > 0:
+        return TRAINING_N_JOBS
+    return max(1, (os.cpu_count() or 1) // max(1, min(concurrent_fits, TRAINING_WORKERS)))
+
+def train_models(rfm, df, kinds, backend=DEFAULT_BACKEND):
+    """
+    Train several model kinds concurrently on the training pool.
+
+    Args:
+        rfm: RFM DataFrame indexed by CustomerID
+        df: Cleaned transactions DataFrame
+        kinds: Model kinds to train ('churn', 'repurchase')
+        backend: Estimator backend (see models.estimators.ESTIMATOR_BACKENDS)
+
+    Returns:
+        Dictionary of model kind -> training result of run_training_job
+    """
+    try:
+        unknown = [kind for kind in kinds if kind not in TRAINERS]
+        if unknown:
+            raise ValueError(f"Unknown models: {', '.join(unknown)}")
+        if backend not in ESTIMATOR_BACKENDS:
+            raise ValueError(f"Unknown model backend: {backend}; expected one of {', '.join(ESTIMATOR_BACKENDS)}")
+
+        frame = training_frame(df)
+        n_jobs = jobs_per_fit(len(kinds))
+        start = time.perf_counter()
+        pool = get_training_pool()
+        try:
+            futures = {kind: pool.submit(run_training_job, kind, rfm, frame, backend, n_jobs) for kind in kinds}
+            results = {kind: future.result() for kind, future in futures.items()}
+        except BrokenProcessPool:
+            _reset_pool()
+            raise
+        logger.info(f"Trained {', '.join(kinds)} ({backend}) in {time.perf_counter() - start:.2f}s")
+        return results
+    except Exception as e:
+        logger.error(f"Error in train_models: {e}")
+        raise
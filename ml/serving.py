@@ -0,0 +1,113 @@
+import gc
+import logging
+import os
+import threading
+import time
+import psutil
+from analysis.job_queue import JOB_RESULT_FOLDER, active_jobs
+from models.model_registry import MODEL_STORE_FOLDER
+from utils.dataset_cache import dataset_cache, DATASET_CACHE_MAX_ENTRIES
+from utils.dataset_store import DATASET_STORE_FOLDER, dataset_path
+from utils.file_handler import DATASET_ID_PATTERN, UPLOAD_FOLDER, load_stored_dataset
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Datasets loaded into the dataset cache before the server forks its workers: 'all'
+# (the most recently stored, up to the cache's entry limit) or comma-separated IDs
+PRELOAD_DATASETS = os.environ.get('PRELOAD_DATASETS', '')
+
+# A worker whose own (unshared) memory exceeds this is recycled once its requests and
+# jobs are done; 0 disables recycling
+WORKER_MAX_MEMORY_MB = int(os.environ.get('WORKER_MAX_MEMORY_MB', 4096))
+
+# Seconds between memory checks of a worker
+MEMORY_CHECK_INTERVAL = float(os.environ.get('MEMORY_CHECK_INTERVAL', 5))
+
+# Folders the service writes to; it is not ready unless all are writable
+STORAGE_FOLDERS = [DATASET_STORE_FOLDER, UPLOAD_FOLDER, MODEL_STORE_FOLDER, JOB_RESULT_FOLDER]
+
+_recycling = False
+_last_check = 0.0
+_check_lock = threading.Lock()
+
+def stored_dataset_ids():
+    """IDs of the persisted datasets, most recently stored first."""
+    ids = [name[:-len('.feather')] for name in os.listdir(DATASET_STORE_FOLDER) if name.endswith('.feather')]
+    ids = [dataset_id for dataset_id in ids if DATASET_ID_PATTERN.fullmatch(dataset_id)]
+    return sorted(ids, key=lambda dataset_id: os.path.getmtime(dataset_path(dataset_id)), reverse=True)
+
+def preload(datasets=PRELOAD_DATASETS):
+    """
+    Warm the process before it forks its workers, so they share what is loaded here
+    copy-on-write: the TextBlob lexicon and the requested datasets. Objects created so
+    far are then moved out of the garbage collector's reach, so collections in the
+    workers do not write to (and copy) the shared pages.
+    """
+    try:
+        start = time.perf_counter()
+        from textblob import TextBlob
+        TextBlob("warm up").sentiment
+
+        if datasets == 'all':
+            dataset_ids = stored_dataset_ids()[:DATASET_CACHE_MAX_ENTRIES]
+        else:
+            dataset_ids = [dataset_id.strip() for dataset_id in datasets.split(',') if dataset_id.strip()]
+        for dataset_id in dataset_ids:
+            try:
+                load_stored_dataset(dataset_id)
+            except Exception as e:
+                logger.warning(f"Could not preload dataset {dataset_id[:12]}: {e}")
+
+        gc.collect()
+        gc.freeze()
+        logger.info(f"Preloaded {len(dataset_ids)} datasets in {time.perf_counter() - start:.2f}s")
+    except Exception as e:
+        logger.error(f"Error in preload: {e}")
+        raise
+
+def process_memory_mb():
+    """Unique set size of the current process: the memory it would free on exit."""
+    process = psutil.Process()
+    try:
+        return process.memory_full_info().uss / 1024**2
+    except (psutil.AccessDenied, AttributeError):
+        return process.memory_info().rss / 1024**2
+
+def should_recycle():
+    """
+    Whether this worker should stop taking requests and be replaced: its memory is
+    above WORKER_MAX_MEMORY_MB and it has no job in flight. Checked at most once per
+    MEMORY_CHECK_INTERVAL; once true it stays true.
+    """
+    global _recycling, _last_check
+    if _recycling or WORKER_MAX_MEMORY_MB <= 0:
+        return _recycling
+    with _check_lock:
+        now = time.monotonic()
+        if now - _last_check < MEMORY_CHECK_INTERVAL:
+            return False
+        _last_check = now
+    memory = process_memory_mb()
+    if memory > WORKER_MAX_MEMORY_MB and active_jobs() == 0:
+        logger.warning(f"Worker {os.getpid()} uses {memory:.0f} MiB (limit {WORKER_MAX_MEMORY_MB} MiB); recycling")
+        _recycling = True
+    return _recycling
+
+def service_status():
+    """
+    Liveness and readiness of this process. It is ready when every storage folder is
+    writable and it is not being recycled.
+    """
+    storage = {folder: os.path.isdir(folder) and os.access(folder, os.W_OK) for folder in STORAGE_FOLDERS}
+    return {
+        "status": "ok",
+        "ready": all(storage.values()) and not _recycling,
+        "recycling": _recycling,
+        "pid": os.getpid(),
+        "uptime_s": round(time.time() - psutil.Process().create_time(), 1),
+        "memory_mb": round(process_memory_mb(), 1),
+        "cached_datasets": len(dataset_cache),
+        "active_jobs": active_jobs(),
+        "storage": storage
+    }
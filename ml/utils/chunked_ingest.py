@@ -0,0 +1,193 @@
+import json
+import logging
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from utils.data_cleaning import map_headers_dynamic
+from utils.dataset_cache import hash_stream
+from utils.dataset_store import compact_dtypes, dataset_path, save_aggregate, DATASET_STORE_FOLDER
+from utils.file_handler import UPLOAD_FOLDER, detect_encoding, standardize_columns, coerce_values
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Rows parsed per chunk; peak memory scales with this rather than with the file size
+CHUNK_ROWS = int(os.environ.get('CHUNK_ROWS', 500_000))
+
+# Uploads larger than this are ingested chunk by chunk even without ?chunked=true
+CHUNKED_INGEST_THRESHOLD_BYTES = int(os.environ.get('CHUNKED_INGEST_THRESHOLD_BYTES', 1024**3))
+
+# Chunks are cleaned independently, so Quantity cannot be narrowed to int32 from the
+# values of the first chunk: a later one may hold fractional quantities
+CHUNK_QUANTITY_DTYPE = np.float32
+
+# Aggregates built chunk by chunk, so the customer, monthly and product results of a
+# chunk-ingested dataset are answered without loading its rows (see
+# analysis.dataset_aggregates): name -> how two partial aggregates of a column combine
+AGGREGATIONS = {
+    'customers': {'FirstPurchase': 'min', 'LastPurchase': 'max', 'Frequency': 'sum', 'Monetary': 'sum',
+                  'LineCount': 'sum', 'Country': 'first'},
+    'months': {'Revenue': 'sum'},
+    'products': {'Revenue': 'sum'},
+}
+
+def stats_path(dataset_id):
+    return os.path.join(DATASET_STORE_FOLDER, f"{dataset_id}.ingest.json")
+
+def should_ingest_chunked(request):
+    chunked = request.values.get('chunked', 'false').lower() == 'true'
+    return chunked or (request.content_length or 0) > CHUNKED_INGEST_THRESHOLD_BYTES
+
+def _merge(acc, part, aggregations):
+    """Fold a chunk's partial aggregate into the running aggregate."""
+    if acc is None:
+        return part
+    return pd.concat([acc, part]).groupby(level=0, sort=False).agg(aggregations)
+
+def pair_hashes(first, second):
+    """64-bit hashes of (first, second) label pairs."""
+    return pd.util.hash_pandas_object(pd.DataFrame({'first': first, 'second': second}), index=False).to_numpy()
+
+def chunk_aggregates(chunk, seen_invoices):
+    """
+    Partial per-customer, per-month and per-product aggregates of a cleaned chunk.
+    A customer's Frequency only counts the invoices not seen in earlier chunks.
+
+    Args:
+        chunk: Cleaned chunk
+        seen_invoices: Sorted hashes of the (customer, invoice) pairs of earlier chunks
+
+    Returns:
+        Tuple of (dictionary of name -> partial aggregate, updated seen_invoices)
+    """
+    invoices = chunk[['CustomerID', 'InvoiceNo']].drop_duplicates()
+    hashes = pair_hashes(invoices['CustomerID'].to_numpy(), invoices['InvoiceNo'].to_numpy())
+    new = ~np.isin(hashes, seen_invoices, assume_unique=True)
+
+    customers = chunk.groupby('CustomerID', sort=False).agg(
+        FirstPurchase=('InvoiceDate', 'min'),
+        LastPurchase=('InvoiceDate', 'max'),
+        Monetary=('TotalPrice', 'sum'),
+        LineCount=('TotalPrice', 'size'),
+        Country=('Country', 'first')
+    )
+    customers['Frequency'] = invoices['CustomerID'][new].value_counts().reindex(customers.index, fill_value=0)
+    months = chunk.groupby('MonthIndex', sort=False)['TotalPrice'].sum().to_frame('Revenue')
+    products = chunk.groupby('Description', sort=False)['TotalPrice'].sum().to_frame('Revenue')
+    return {'customers': customers, 'months': months, 'products': products}, np.union1d(seen_invoices, hashes[new])
+
+def _arrow_schema(chunk):
+    # Columns that are entirely empty in the first chunk would otherwise be typed as null
+    schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+    for i, field in enumerate(schema):
+        if pa.types.is_null(field.type):
+            schema = schema.set(i, pa.field(field.name, pa.string()))
+    return schema
+
+def ingest_file_chunked(dataset_id, file_path, chunk_rows=CHUNK_ROWS):
+    """
+    Clean a CSV chunk by chunk, writing the cleaned rows to the columnar dataset store
+    and building per-customer, per-month and per-product aggregates incrementally.
+
+    Only one chunk of raw rows is held in memory at a time; the running aggregates grow
+    with the number of distinct customers, months, products and invoices, not rows.
+    RFM, CLV, monthly revenue and the top customers and products are answered from
+    the aggregates; other analyses still load the stored rows.
+
+    Returns:
+        Dictionary of ingestion statistics (rows read, dropped and kept, ...)
+    """
+    try:
+        encoding = detect_encoding(file_path)
+        reader = pd.read_csv(file_path, encoding=encoding, dtype=str, on_bad_lines='skip', chunksize=chunk_rows)
+
+        header_mapping = None
+        schema = None
+        writer = None
+        store_path = dataset_path(dataset_id)
+        tmp_path = f"{store_path}.{os.getpid()}.tmp"
+
+        aggregates = dict.fromkeys(AGGREGATIONS)
+        seen_invoices = np.empty(0, dtype=np.uint64)
+        rows_read = rows_kept = chunks = 0
+
+        try:
+            for chunk in reader:
+                chunks += 1
+                rows_read += len(chunk)
+                if header_mapping is None:
+                    header_mapping = map_headers_dynamic(chunk.columns)
+                chunk = coerce_values(standardize_columns(chunk, header_mapping))
+                if chunk.empty:
+                    continue
+                # Chunks keep plain strings: each chunk would otherwise get its own dictionary
+                chunk = compact_dtypes(chunk, encode_text=False, quantity=CHUNK_QUANTITY_DTYPE).reset_index(drop=True)
+                rows_kept += len(chunk)
+
+                if writer is None:
+                    schema = _arrow_schema(chunk)
+                    writer = pa.ipc.new_file(tmp_path, schema)
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+                parts, seen_invoices = chunk_aggregates(chunk, seen_invoices)
+                for name, part in parts.items():
+                    aggregates[name] = _merge(aggregates[name], part, AGGREGATIONS[name])
+                logger.info(f"Ingested chunk {chunks}: {rows_read} rows read, {rows_kept} kept")
+        finally:
+            if writer is not None:
+                writer.close()
+
+        if rows_kept == 0:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise ValueError("No valid data after cleaning")
+        os.replace(tmp_path, store_path)
+        for name, aggregate in aggregates.items():
+            save_aggregate(dataset_id, name, aggregate[list(AGGREGATIONS[name])].sort_index())
+
+        stats = {
+            "rows_read": int(rows_read),
+            "rows_dropped": int(rows_read - rows_kept),
+            "rows_kept": int(rows_kept),
+            "chunks": int(chunks),
+            "customers": int(len(aggregates['customers'])),
+            "months": int(len(aggregates['months'])),
+            "products": int(len(aggregates['products']))
+        }
+        with open(stats_path(dataset_id), 'w') as f:
+            json.dump(stats, f)
+        logger.info(f"Chunked ingestion of {dataset_id[:12]} finished: {stats}")
+        return stats
+    except Exception as e:
+        logger.error(f"Error in ingest_file_chunked: {e}")
+        raise
+
+def ingest_upload(request):
+    """
+    Chunked counterpart of load_dataset for uploads too large to parse in one go.
+
+    Returns:
+        Tuple of (dataset_id, ingestion statistics)
+    """
+    try:
+        if 'file' not in request.files:
+            raise ValueError("No file uploaded")
+
+        file = request.files['file']
+        if file.filename == '':
+            raise ValueError("No file selected")
+
+        dataset_id = hash_stream(file.stream)
+        if os.path.exists(stats_path(dataset_id)):
+            with open(stats_path(dataset_id)) as f:
+                return dataset_id, json.load(f)
+
+        file_path = os.path.join(UPLOAD_FOLDER, f"{dataset_id}.csv")
+        file.save(file_path)
+        stats = ingest_file_chunked(dataset_id, file_path)
+        os.remove(file_path)
+        return dataset_id, stats
+    except Exception as e:
+        logger.error(f"Error in ingest_upload: {e}")
+        raise
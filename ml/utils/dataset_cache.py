@@ -0,0 +1,119 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Upper bounds for the in-process cache of cleaned DataFrames
+DATASET_CACHE_MAX_BYTES = int(os.environ.get('DATASET_CACHE_MAX_BYTES', 2 * 1024**3))
+DATASET_CACHE_MAX_ENTRIES = int(os.environ.get('DATASET_CACHE_MAX_ENTRIES', 8))
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def hash_stream(stream, chunk_size=HASH_CHUNK_SIZE):
+    """
+    Compute a content hash of a file-like object without loading it into memory.
+    The stream is rewound so it can be read or saved afterwards.
+
+    Args:
+        stream: Binary file-like object supporting read() and seek()
+        chunk_size: Number of bytes read per iteration
+
+    Returns:
+        Hex digest identifying the content of the stream
+    """
+    digest = hashlib.sha256()
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+class DatasetCache:
+    """
+    LRU cache of cleaned DataFrames keyed by dataset ID (content hash of the upload).
+
+    Entries are evicted least-recently-used first once either the entry count or the
+    total estimated memory footprint exceeds its bound. Callers receive a shallow copy:
+    a new frame over the cached column arrays, so a column added or replaced by one
+    request is not seen by others, while the rows themselves are never copied (which
+    keeps preloaded datasets shared copy-on-write across forked workers). The analysis
+    functions do not write into the columns of the frame they are given.
+    """
+
+    def __init__(self, max_bytes=DATASET_CACHE_MAX_BYTES, max_entries=DATASET_CACHE_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            df = entry[0]
+        logger.info(f"Dataset cache hit for {key[:12]}")
+        return df.copy(deep=False)
+
+    def put(self, key, df):
+        size = int(df.memory_usage(deep=True).sum())
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)[1]
+            if size > self.max_bytes:
+                logger.warning(f"Dataset {key[:12]} ({size / 1024**2:.1f} MiB) exceeds cache size; not cached")
+                return
+            self._entries[key] = (df, size)
+            self._total_bytes += size
+            self._evict()
+
+    def discard(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._total_bytes -= entry[1]
+
+    def get_or_load(self, key, loader):
+        """
+        Return the cached frame for key, calling loader() at most once per key when it is
+        missing, even if several requests for the same dataset arrive concurrently.
+        """
+        df = self.get(key)
+        if df is not None:
+            return df
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                df = self.get(key)
+                if df is not None:
+                    return df
+                df = loader()
+                self.put(key, df)
+        finally:
+            with self._lock:
+                self._key_locks.pop(key, None)
+        return df.copy(deep=False) if key in self else df
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes):
+            key, (_, size) = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            logger.info(f"Evicted dataset {key[:12]} from cache ({size / 1024**2:.1f} MiB)")
+
+dataset_cache = DatasetCache()
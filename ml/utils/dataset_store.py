@@ -0,0 +1,219 @@
+import logging
+import os
+import sqlite3
+import time
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+from pandas.api.types import union_categoricals
+from utils.date_keys import add_date_keys, DATE_KEYS
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Cleaned datasets are persisted here as uncompressed Feather (Arrow IPC) files,
+# which can be memory-mapped on reload instead of re-parsing the CSV
+DATASET_STORE_FOLDER = os.environ.get('DATASET_STORE_FOLDER', "Datasets")
+os.makedirs(DATASET_STORE_FOLDER, exist_ok=True)
+
+# SQLite file logging the transaction batches appended to stored datasets, shared by
+# every server process; each batch is stored as a Feather segment next to the dataset
+APPEND_LOG_PATH = os.environ.get('APPEND_LOG_PATH', os.path.join(DATASET_STORE_FOLDER, "appends.sqlite"))
+
+# Seconds an append waits for another process's append to the same store to finish
+APPEND_LOCK_TIMEOUT = float(os.environ.get('APPEND_LOCK_TIMEOUT', 300))
+
+# Text columns held dictionary-encoded (pandas categoricals): rows store compact integer
+# codes and each distinct label once, so groupbys hash integers instead of Python strings
+CATEGORICAL_COLUMNS = ['CustomerID', 'InvoiceNo', 'StockCode', 'Description', 'Country']
+
+def encode_categoricals(df):
+    """Dictionary-encode the text key columns that are not encoded yet."""
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    return df
+
+def quantity_dtype(quantity):
+    """int32 when every quantity is a whole number that fits, float32 otherwise."""
+    if np.all(np.mod(quantity, 1) == 0) and quantity.abs().max() < np.iinfo(np.int32).max:
+        return np.int32
+    return np.float32
+
+def compact_dtypes(df, encode_text=True, quantity=None):
+    """
+    Convert a cleaned DataFrame to the compact typed layout used by all analyses:
+    categorical key columns, int32 quantities, float32 prices and datetime64 (int64
+    epoch) dates. TotalPrice stays float64 since revenue is summed over millions of
+    rows. Labels are only decoded when results are serialized. The integer date keys
+    of utils.date_keys are added here so they are computed once per dataset.
+
+    Args:
+        df: Cleaned DataFrame
+        encode_text: Dictionary-encode the text key columns
+        quantity: dtype of Quantity; chosen from the values when None, which is only
+            safe when df holds the whole dataset
+    """
+    df['Quantity'] = df['Quantity'].astype(quantity or quantity_dtype(df['Quantity']))
+    df['UnitPrice'] = df['UnitPrice'].astype(np.float32)
+    df['InvoiceDate'] = df['InvoiceDate'].astype('datetime64[ns]')
+    df = add_date_keys(df)
+    if encode_text:
+        df = encode_categoricals(df)
+    return df
+
+def dataset_path(dataset_id):
+    return os.path.join(DATASET_STORE_FOLDER, f"{dataset_id}.feather")
+
+def has_stored_dataset(dataset_id):
+    return os.path.exists(dataset_path(dataset_id))
+
+def save_dataset(dataset_id, df):
+    """Persist a cleaned DataFrame in columnar form, dictionary-encoding text columns."""
+    try:
+        stored = encode_categoricals(df.reset_index(drop=True))
+        path = dataset_path(dataset_id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        feather.write_feather(stored, tmp_path, compression='uncompressed')
+        os.replace(tmp_path, path)
+        logger.info(f"Stored dataset {dataset_id[:12]} at {path}")
+    except Exception as e:
+        logger.error(f"Error in save_dataset: {e}")
+        raise
+
+def aggregate_path(dataset_id, name):
+    return os.path.join(DATASET_STORE_FOLDER, f"{dataset_id}.{name}.feather")
+
+def save_aggregate(dataset_id, name, df):
+    """Persist a per-dataset aggregate table (per-customer, per-month, ...) with its index."""
+    path = aggregate_path(dataset_id, name)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    feather.write_feather(df, tmp_path, compression='uncompressed')
+    os.replace(tmp_path, path)
+
+def load_aggregate(dataset_id, name):
+    """A table stored by save_aggregate, or None if the dataset has none of that name."""
+    path = aggregate_path(dataset_id, name)
+    if not os.path.exists(path):
+        return None
+    return feather.read_table(path, memory_map=True).to_pandas()
+
+def segment_path(dataset_id, version):
+    return os.path.join(DATASET_STORE_FOLDER, f"{dataset_id}.append.{version}.feather")
+
+def _connect_append_log():
+    connection = sqlite3.connect(APPEND_LOG_PATH, timeout=APPEND_LOCK_TIMEOUT)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS appends (dataset_id TEXT NOT NULL, version INTEGER NOT NULL, "
+        "rows INTEGER NOT NULL, appended_at REAL NOT NULL, PRIMARY KEY (dataset_id, version))"
+    )
+    return connection
+
+def _latest_version(connection, dataset_id):
+    return connection.execute("SELECT COALESCE(MAX(version), 0) FROM appends WHERE dataset_id = ?", (dataset_id,)).fetchone()[0]
+
+def dataset_version(dataset_id):
+    """Number of transaction batches appended to a stored dataset; 0 when there are none."""
+    if not os.path.exists(APPEND_LOG_PATH):
+        return 0
+    connection = _connect_append_log()
+    try:
+        return _latest_version(connection, str(dataset_id))
+    finally:
+        connection.close()
+
+def dataset_key(dataset_id, version=None):
+    """
+    Key of the contents of a stored dataset at a version (the current one by default):
+    the dataset ID, suffixed with the version once batches were appended. Data derived
+    from a dataset is cached under this key, so a process never serves what it derived
+    before another process appended to the dataset.
+    """
+    version = dataset_version(dataset_id) if version is None else version
+    return str(dataset_id) if version == 0 else f"{dataset_id}.{version}"
+
+def key_dataset_id(key):
+    """Dataset ID of a dataset key."""
+    return key.split('.', 1)[0]
+
+def loaded_key(df, dataset_id):
+    """Dataset key of a frame returned by load_stored_frame; the ID for a freshly cleaned upload."""
+    return df.attrs.get('dataset_key', dataset_id)
+
+def append_segment(dataset_id, merge):
+    """
+    Append a batch of transactions to a stored dataset as a new segment. Appends are
+    serialized across processes: merge(version) is called with the dataset's current
+    version while the append log is locked, and returns the cleaned rows to store (the
+    batch without the lines the dataset already holds) and a result passed back.
+
+    Returns:
+        Tuple of (version of the dataset after the append, result of merge)
+    """
+    connection = _connect_append_log()
+    connection.isolation_level = None
+    try:
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            version = _latest_version(connection, dataset_id)
+            rows, result = merge(version)
+            if len(rows):
+                version += 1
+                path = segment_path(dataset_id, version)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                feather.write_feather(encode_categoricals(rows.reset_index(drop=True)), tmp_path, compression='uncompressed')
+                os.replace(tmp_path, path)
+                connection.execute("INSERT INTO appends (dataset_id, version, rows, appended_at) VALUES (?, ?, ?, ?)",
+                                   (dataset_id, version, len(rows), time.time()))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        logger.info(f"Appended {len(rows)} rows to dataset {dataset_id[:12]} (version {version})")
+        return version, result
+    except Exception as e:
+        logger.error(f"Error in append_segment: {e}")
+        raise
+    finally:
+        connection.close()
+
+def read_frame(path):
+    table = feather.read_table(path, memory_map=True)
+    return encode_categoricals(table.to_pandas(split_blocks=True))
+
+def concat_frames(frames):
+    """Concatenate cleaned frames, merging the dictionaries of their categorical columns."""
+    if len(frames) == 1:
+        return frames[0]
+    shared = [col for col in frames[0].columns
+              if all(col in frame.columns and isinstance(frame[col].dtype, pd.CategoricalDtype) for frame in frames)]
+    df = pd.concat([frame.drop(columns=shared) for frame in frames], ignore_index=True)
+    for col in shared:
+        df[col] = union_categoricals([frame[col] for frame in frames], sort_categories=True)
+    df = df[list(frames[0].columns) + [col for col in df.columns if col not in frames[0].columns]]
+    df['Quantity'] = df['Quantity'].astype(quantity_dtype(df['Quantity']))
+    return encode_categoricals(df)
+
+def load_segment(dataset_id, version):
+    """The rows of one appended batch."""
+    return read_frame(segment_path(dataset_id, version))
+
+def load_stored_frame(dataset_id, version=0):
+    """
+    Reload a persisted dataset through a memory map, with the batches appended up to
+    version. Numeric and date columns of a dataset without appends are handed to
+    pandas without copying and dictionary-encoded columns come back as categoricals.
+    The frame's attrs record its dataset key.
+    """
+    try:
+        frames = [read_frame(dataset_path(dataset_id))]
+        frames += [load_segment(dataset_id, segment) for segment in range(1, version + 1)]
+        df = concat_frames(frames)
+        if not all(name in df.columns for name in DATE_KEYS):
+            df = add_date_keys(df, only_missing=True)
+        df.attrs['dataset_key'] = dataset_key(dataset_id, version)
+        logger.info(f"Loaded stored dataset {dataset_id[:12]} ({len(df)} rows, version {version})")
+        return df
+    except Exception as e:
+        logger.error(f"Error in load_stored_frame: {e}")
+        raise
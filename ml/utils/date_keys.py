@@ -0,0 +1,71 @@
+import logging
+import numpy as np
+import pandas as pd
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Monday the week indexes count from, so weeks run Monday to Sunday like ISO weeks
+WEEK_EPOCH = pd.Timestamp('1969-12-29')
+
+# Integer time keys derived from InvoiceDate once, when a dataset is cleaned, so the
+# time-based analyses group on small integers instead of re-parsing or formatting
+# dates: name -> (dtype, function of the InvoiceDate series)
+DATE_KEYS = {
+    'MonthIndex': (np.int32, lambda dates: dates.dt.year * 12 + dates.dt.month - 1),
+    'DayOfMonth': (np.int8, lambda dates: dates.dt.day),
+    'HourOfDay': (np.int8, lambda dates: dates.dt.hour),
+    'DayOfWeek': (np.int8, lambda dates: dates.dt.dayofweek),
+    'MonthOfYear': (np.int8, lambda dates: dates.dt.month),
+    'ISOWeek': (np.int8, lambda dates: dates.dt.isocalendar().week),
+    'WeekIndex': (np.int32, lambda dates: (dates.dt.normalize() - WEEK_EPOCH).dt.days // 7),
+}
+
+def month_index(dates):
+    """Months since year 0 as integers, e.g. 2011-03 -> 2011 * 12 + 2."""
+    return (dates.dt.year * 12 + dates.dt.month - 1).to_numpy(np.int64)
+
+def month_label(index):
+    return f"{index // 12}-{index % 12 + 1:02d}"
+
+def quarter_label(index):
+    return f"{index // 4}-Q{index % 4 + 1}"
+
+def week_label(index):
+    """ISO year and week of a week index, e.g. '2011-W05'."""
+    year, week, _ = (WEEK_EPOCH + pd.Timedelta(weeks=int(index))).isocalendar()
+    return f"{year}-W{week:02d}"
+
+def month_labels(indices):
+    """'YYYY-MM' labels of an array of month indexes, formatting each distinct month once."""
+    months, inverse = np.unique(np.asarray(indices), return_inverse=True)
+    return np.array([month_label(int(month)) for month in months], dtype=object)[inverse]
+
+def compute_date_key(dates, name):
+    dtype, source = DATE_KEYS[name]
+    return source(dates).to_numpy(dtype=dtype)
+
+def add_date_keys(df, only_missing=False):
+    """
+    Add the integer date key columns computed from InvoiceDate.
+
+    Args:
+        df: DataFrame with a datetime64 InvoiceDate column
+        only_missing: Keep key columns that are already present (used for datasets
+            stored before the keys existed)
+    """
+    try:
+        for name in DATE_KEYS:
+            if only_missing and name in df.columns:
+                continue
+            df[name] = compute_date_key(df['InvoiceDate'], name)
+        return df
+    except Exception as e:
+        logger.error(f"Error in add_date_keys: {e}")
+        raise
+
+def date_key(df, name):
+    """A precomputed date key column, computed on the fly for frames without it."""
+    if name in df.columns:
+        return df[name]
+    return pd.Series(compute_date_key(df['InvoiceDate'], name), index=df.index, name=name)
@@ -1,8 +1,11 @@
 import logging
 import os
+import re
 import pandas as pd
 import chardet
 from utils.data_cleaning import map_headers_dynamic
+from utils.dataset_cache import dataset_cache, hash_stream
+from utils.dataset_store import compact_dtypes, dataset_key, dataset_version, has_stored_dataset, save_dataset, load_stored_frame
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -10,6 +13,8 @@ logger = logging.getLogger(__name__)
 UPLOAD_FOLDER = "Uploads"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+DATASET_ID_PATTERN = re.compile(r'[0-9a-f]{64}')
+
 def detect_encoding(file_path, sample_size=100_000):
     try:
         with open(file_path, "rb") as f:
@@ -23,18 +28,95 @@ def detect_encoding(file_path, sample_size=100_000):
         logger.error(f"Error detecting encoding: {e}")
         raise ValueError("Failed to detect file encoding")
 
-def load_and_clean_file(request):
+def load_dataset(request):
+    """
+    Load the cleaned DataFrame for the uploaded file, parsing it only on the first
+    request for a given content hash.
+
+    Returns:
+        Tuple of (dataset_id, cleaned DataFrame)
+    """
     try:
         if 'file' not in request.files:
-            raise ValueError("No file uploaded")
+            dataset_id = get_request_dataset_id(request)
+            if dataset_id is None:
+                raise ValueError("No file uploaded or dataset_id provided")
+            return dataset_id, load_stored_dataset(dataset_id)
         
         file = request.files['file']
         if file.filename == '':
             raise ValueError("No file selected")
         
-        file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-        file.save(file_path)
+        dataset_id = hash_stream(file.stream)
+        if has_stored_dataset(dataset_id):
+            return dataset_id, load_stored_dataset(dataset_id)
+        
+        def load():
+            if has_stored_dataset(dataset_id):
+                return load_stored_frame(dataset_id)
+            file_path = os.path.join(UPLOAD_FOLDER, f"{dataset_id}.csv")
+            file.save(file_path)
+            return clean_and_store(dataset_id, file_path)
         
+        df = dataset_cache.get_or_load(dataset_id, load)
+        return dataset_id, df
+    except Exception as e:
+        logger.error(f"Error in load_dataset: {e}")
+        raise
+
+def get_request_value(request, name, default=None):
+    """Read a request option from the query string, form fields or JSON body."""
+    value = request.args.get(name) or request.form.get(name)
+    if not value:
+        payload = request.get_json(silent=True)
+        if isinstance(payload, dict):
+            value = payload.get(name)
+    return value if value not in (None, '') else default
+
+def get_request_dataset_id(request):
+    """Read a dataset ID from the query string, form fields or JSON body."""
+    return get_request_value(request, 'dataset_id')
+
+def load_stored_dataset(dataset_id, version=None):
+    """
+    Resolve a dataset ID returned by /upload_csv to its cleaned DataFrame, with the
+    transactions appended up to version (by default all of them), reloading the
+    columnar copy if it has been evicted from the in-memory cache.
+    """
+    if not DATASET_ID_PATTERN.fullmatch(str(dataset_id)):
+        raise ValueError(f"Invalid dataset_id: {dataset_id}")
+    
+    file_path = os.path.join(UPLOAD_FOLDER, f"{dataset_id}.csv")
+    version = dataset_version(dataset_id) if version is None else version
+    
+    def load():
+        if has_stored_dataset(dataset_id):
+            # Earlier versions of the dataset are superseded
+            for earlier in range(version):
+                dataset_cache.discard(dataset_key(dataset_id, earlier))
+            return load_stored_frame(dataset_id, version)
+        if not os.path.exists(file_path):
+            raise ValueError(f"Unknown dataset_id: {dataset_id}; upload the file again")
+        return clean_and_store(dataset_id, file_path)
+    
+    return dataset_cache.get_or_load(dataset_key(dataset_id, version), load)
+
+def clean_and_store(dataset_id, file_path):
+    """Clean a saved upload, persist it in columnar form and drop the raw CSV."""
+    df = clean_file(file_path)
+    save_dataset(dataset_id, df)
+    try:
+        os.remove(file_path)
+    except OSError as e:
+        logger.warning(f"Could not remove raw upload {file_path}: {e}")
+    return df
+
+def load_and_clean_file(request):
+    _, df = load_dataset(request)
+    return df
+
+def clean_file(file_path):
+    try:
         encoding = detect_encoding(file_path)
         
         # Load CSV without assuming column names
@@ -59,58 +141,75 @@ def load_and_clean_file(request):
         logger.info(f"First 5 rows:\n{df.head().to_string()}")
         logger.info(f"Initial data types:\n{df.dtypes}")
         
-        # Dynamically map headers
-        header_mapping = map_headers_dynamic(df.columns)
-        df.columns = [header_mapping.get(col, col) for col in df.columns]
-        logger.info(f"Columns after mapping: {df.columns.tolist()}")
-        
-        # Check for required columns after mapping
-        required_columns = ['InvoiceNo', 'StockCode', 'Description', 'Quantity', 'InvoiceDate', 'UnitPrice']
-        required_id_columns = ['CustomerID', 'Customer Name']
-        
-        has_customer_id = any(col in df.columns for col in required_id_columns)
-        if not has_customer_id:
-            raise ValueError(f"CSV file must contain at least one customer identifier column: {', '.join(required_id_columns)}")
-        
-        if not all(col in df.columns for col in required_columns):
-            missing_cols = [col for col in required_columns if col not in df.columns]
-            raise ValueError(f"CSV file missing columns after mapping: {', '.join(missing_cols)}")
-        
-        # Proceed with cleaning
-        if 'CustomerID' not in df.columns and 'Customer Name' in df.columns:
-            df['CustomerID'] = df['Customer Name']
-            logger.info("Using 'Customer Name' as 'CustomerID'")
-        
-        df['CustomerID'] = df['CustomerID'].astype(str)
-        
-        if 'Country' not in df.columns:
-            df['Country'] = 'Unknown'
-            logger.info("Added default 'Country' column")
-        
-        df = df.dropna(subset=['InvoiceNo', 'Quantity', 'UnitPrice', 'InvoiceDate'])
-        
-        df['InvoiceDate'] = pd.to_datetime(df['InvoiceDate'], errors='coerce')
-        invalid_dates = df['InvoiceDate'].isna().sum()
-        if invalid_dates > 0:
-            logger.warning(f"Dropping {invalid_dates} rows with invalid InvoiceDate")
-            df = df.dropna(subset=['InvoiceDate'])
-        
-        for col in ['Quantity', 'UnitPrice']:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-            invalid_nums = df[col].isna().sum()
-            if invalid_nums > 0:
-                logger.warning(f"Dropping {invalid_nums} rows with invalid {col}")
-                df = df.dropna(subset=[col])
-        
-        df['TotalPrice'] = df['Quantity'] * df['UnitPrice']
+        # Dynamically map headers, then coerce types
+        df = standardize_columns(df)
+        df = coerce_values(df)
         
         if df.empty:
             raise ValueError("No valid data after cleaning")
         
+        df = compact_dtypes(df)
+        
         logger.info(f"Final data types:\n{df.dtypes}")
         logger.info(f"Final columns: {df.columns.tolist()}")
         
         return df
     except Exception as e:
-        logger.error(f"Error in load_and_clean_file: {e}")
-        raise
\ No newline at end of file
+        logger.error(f"Error in clean_file: {e}")
+        raise
+
+def standardize_columns(df, header_mapping=None):
+    """
+    Map the raw CSV headers onto the standard column names and fill in the customer
+    and country columns. A mapping computed for an earlier chunk of the same file
+    can be passed in to skip fuzzy matching.
+    """
+    if header_mapping is None:
+        header_mapping = map_headers_dynamic(df.columns)
+        logger.info(f"Columns after mapping: {[header_mapping.get(col, col) for col in df.columns]}")
+    df.columns = [header_mapping.get(col, col) for col in df.columns]
+    
+    # Check for required columns after mapping
+    required_columns = ['InvoiceNo', 'StockCode', 'Description', 'Quantity', 'InvoiceDate', 'UnitPrice']
+    required_id_columns = ['CustomerID', 'Customer Name']
+    
+    has_customer_id = any(col in df.columns for col in required_id_columns)
+    if not has_customer_id:
+        raise ValueError(f"CSV file must contain at least one customer identifier column: {', '.join(required_id_columns)}")
+    
+    if not all(col in df.columns for col in required_columns):
+        missing_cols = [col for col in required_columns if col not in df.columns]
+        raise ValueError(f"CSV file missing columns after mapping: {', '.join(missing_cols)}")
+    
+    # Proceed with cleaning
+    if 'CustomerID' not in df.columns and 'Customer Name' in df.columns:
+        df['CustomerID'] = df['Customer Name']
+        logger.info("Using 'Customer Name' as 'CustomerID'")
+    
+    df['CustomerID'] = df['CustomerID'].astype(str)
+    
+    if 'Country' not in df.columns:
+        df['Country'] = 'Unknown'
+        logger.info("Added default 'Country' column")
+    
+    return df
+
+def coerce_values(df):
+    """Drop incomplete rows, parse dates and numbers, and compute TotalPrice."""
+    df = df.dropna(subset=['InvoiceNo', 'Quantity', 'UnitPrice', 'InvoiceDate'])
+    
+    df['InvoiceDate'] = pd.to_datetime(df['InvoiceDate'], errors='coerce')
+    invalid_dates = df['InvoiceDate'].isna().sum()
+    if invalid_dates > 0:
+        logger.warning(f"Dropping {invalid_dates} rows with invalid InvoiceDate")
+        df = df.dropna(subset=['InvoiceDate'])
+    
+    for col in ['Quantity', 'UnitPrice']:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+        invalid_nums = df[col].isna().sum()
+        if invalid_nums > 0:
+            logger.warning(f"Dropping {invalid_nums} rows with invalid {col}")
+            df = df.dropna(subset=[col])
+    
+    df['TotalPrice'] = df['Quantity'] * df['UnitPrice']
+    return df
@@ -0,0 +1,13 @@
+"""
+Production entry point of the ML service:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+With preload_app the module is imported once in the master process, so pandas,
+scikit-learn, mlxtend and TextBlob and the preloaded datasets are loaded before the
+workers fork and shared by them copy-on-write.
+"""
+from app import app
+from serving import preload
+
+preload()